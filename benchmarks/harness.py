@@ -0,0 +1,239 @@
+# coding=utf-8
+"""
+Small local harness for the benchmark suite in suite.py. It has no dependencies beyond the standard library.
+
+Benchmarks are generator functions decorated with @benchmark. Each one does its setup, yields the callable
+to time, and then cleans up. The harness calibrates how many times to call it, times several repeats with
+garbage collection disabled like timeit does, and collects the results into a dictionary which can be
+saved as JSON and compared against an earlier run. A benchmark which can't run on this system yields None.
+"""
+import contextlib
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Version of the JSON results format
+RESULTS_VERSION = 1
+
+
+class Config(object):
+    """Settings passed to each benchmark's setup"""
+    def __init__(self, quick: bool = False) -> None:
+        """
+        :param quick: if True, benchmarks use smaller data sets and the harness spends less time timing
+        """
+        self.quick = quick
+        self.min_time = 0.05 if quick else 0.2
+        self.repeat = 3 if quick else 5
+
+    def scale(self, full: int, quick: int) -> int:
+        """Return the size of a data set for this run"""
+        return quick if self.quick else full
+
+
+class Benchmark(object):
+    """A registered benchmark"""
+    def __init__(self, name: str, group: str, setup: Callable[[Config], Iterator[Callable[[], Any]]],
+                 ops: int, description: str, memory: bool = False) -> None:
+        self.name = name
+        self.group = group
+        self.setup = contextlib.contextmanager(setup)
+        self.ops = ops
+        self.description = description
+        self.memory = memory
+
+
+BENCHMARKS = []  # type: List[Benchmark]
+
+
+def benchmark(group: str, ops: int = 1, memory: bool = False) -> Callable:
+    """Decorator which registers a benchmark.
+
+    The decorated function receives a Config, does any setup, and yields the callable to time.
+    Code after the yield runs once timing is done.
+
+    :param group: the area of cmd2 being benchmarked
+    :param ops: the number of operations each call of the timed callable performs
+    :param memory: if True, the memory held by what the callable returns is also measured
+    """
+    def register(setup: Callable[[Config], Iterator[Callable[[], Any]]]) -> Callable:
+        description = (setup.__doc__ or '').strip().splitlines()
+        BENCHMARKS.append(Benchmark(setup.__name__, group, setup, ops, description[0] if description else '',
+                                    memory))
+        return setup
+    return register
+
+
+def _time_calls(func: Callable[[], Any], number: int) -> float:
+    """Return the seconds it takes to call a function a number of times with garbage collection disabled"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _measure_memory(func: Callable[[], Any]) -> int:
+    """Return the bytes still allocated to what one call of a function returns"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return used
+
+
+def run_benchmark(bench: Benchmark, config: Config) -> Optional[Dict[str, Any]]:
+    """Run one benchmark and return its results, or None if it can't run on this system"""
+    with bench.setup(config) as func:
+        if func is None:
+            return None
+
+        # Calibrate the number of calls per repeat so each repeat takes at least config.min_time
+        number = 1
+        while True:
+            elapsed = _time_calls(func, number)
+            if elapsed >= config.min_time:
+                break
+            number *= 10 if elapsed < config.min_time / 10 else 2
+
+        times = [elapsed]
+        for _ in range(config.repeat - 1):
+            times.append(_time_calls(func, number))
+
+        bytes_per_op = _measure_memory(func) / bench.ops if bench.memory else None
+
+    per_op = [elapsed / (number * bench.ops) for elapsed in times]
+    median = statistics.median(per_op)
+    result = {'group': bench.group,
+              'description': bench.description,
+              'number': number,
+              'ops': bench.ops,
+              'times': per_op,
+              'min': min(per_op),
+              'median': median,
+              'mean': statistics.mean(per_op),
+              'stdev': statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+              'ops_per_sec': 1 / median if median else 0.0}
+    if bytes_per_op is not None:
+        result['bytes_per_op'] = bytes_per_op
+    return result
+
+
+def _git_revision() -> Optional[str]:
+    """Return the git revision of the tree being benchmarked or None if it isn't available"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(config: Config) -> Dict[str, Any]:
+    """Describe the environment results were collected in"""
+    import cmd2
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cmd2_version': getattr(cmd2, '__version__', None),
+            'git_revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'quick': config.quick}
+
+
+def run(config: Config, names: Optional[List[str]] = None, out=sys.stdout) -> Dict[str, Any]:
+    """
+    Run benchmarks and print a line for each as it finishes
+    :param config: settings for this run
+    :param names: if given, only run benchmarks whose names or groups contain one of these strings
+    :param out: stream for progress output
+    :return: the results in the form saved as JSON
+    """
+    results = {'version': RESULTS_VERSION, 'metadata': metadata(config), 'benchmarks': {}}
+    for bench in BENCHMARKS:
+        if names and not any(name in bench.name or name == bench.group for name in names):
+            continue
+        result = run_benchmark(bench, config)
+        if result is None:
+            print('{:<32} skipped'.format(bench.name), file=out)
+            continue
+        results['benchmarks'][bench.name] = result
+
+        median = format_seconds(result['median'])
+        line = '{:<32} {:>12} per op  {:>14,.0f} ops/sec'.format(bench.name, median, result['ops_per_sec'])
+        if 'bytes_per_op' in result:
+            line += '  {:>10,.1f} bytes/op'.format(result['bytes_per_op'])
+        print(line, file=out)
+    return results
+
+
+def save(results: Dict[str, Any], path: str) -> None:
+    """Save results as JSON"""
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path: str) -> Dict[str, Any]:
+    """Load results saved by save()"""
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError('{} has results format version {}, expected {}'.format(path, results.get('version'),
+                                                                                RESULTS_VERSION))
+    return results
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1,
+            out=sys.stdout) -> List[str]:
+    """
+    Print how the median time of each benchmark changed from a baseline
+    :param baseline: earlier results
+    :param current: new results
+    :param threshold: fraction a median can grow by before it counts as a regression
+    :param out: stream for the comparison
+    :return: names of the benchmarks which regressed
+    """
+    regressions = []
+    print('{:<32} {:>12} {:>12} {:>9}'.format('Benchmark', 'Baseline', 'Current', 'Change'), file=out)
+    for name, result in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            print('{:<32} {:>12} {:>12}'.format(name, '-', format_seconds(result['median'])), file=out)
+            continue
+
+        change = result['median'] / base['median'] - 1 if base['median'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        base_median = format_seconds(base['median'])
+        median = format_seconds(result['median'])
+        print('{:<32} {:>12} {:>12} {:>+8.1%}{}'.format(name, base_median, median, change, flag), file=out)
+    return regressions
+
+
+def format_seconds(seconds: float) -> str:
+    """Format a duration with units which keep it short"""
+    for scale, unit in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+        if seconds >= scale:
+            return '{:.3g} {}'.format(seconds / scale, unit)
+    return '{:.3g} ns'.format(seconds / 1e-9)
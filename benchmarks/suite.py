@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Benchmark suite covering cmd2's hot paths: parsing, dispatch, hooks, the command registry, output,
+tab completion, history, scripts, batches, transcript replay, and pyscript calls. Everything runs
+locally and offline.
+
+Usage: python benchmarks/suite.py [-k NAME ...] [--quick] [-o RESULTS.json] [--compare BASELINE.json]
+
+Results are saved as JSON with -o. Passing --compare prints how each benchmark changed from an earlier
+results file and exits with a status of 1 if any got slower by more than --threshold.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import attr  # noqa: E402
+from colorama import Fore  # noqa: E402
+
+import cmd2  # noqa: E402
+from cmd2 import history, parsing, plugin, pyscript_bridge, text_metrics, transcript, utils  # noqa: E402
+from cmd2.rl_utils import readline  # noqa: E402
+
+import harness  # noqa: E402
+from harness import benchmark  # noqa: E402
+
+PARSE_LINES = ['help',
+               'say hello world',
+               'speak "hello there" -p --repeat 3 > out.txt',
+               'multiline_command one two three;',
+               'shell ls -l | grep .py >> files.txt']
+
+
+class BenchApp(cmd2.Cmd):
+    """Application with a few commands for the benchmarks to run"""
+    sport_items = ['Bat', 'Basket', 'Basketball', 'Football', 'Space Ball']
+
+    base_parser = argparse.ArgumentParser(prog='base')
+    base_subparsers = base_parser.add_subparsers(title='sub-commands', help='sub-command help')
+
+    parser_foo = base_subparsers.add_parser('foo', help='foo help')
+    parser_foo.add_argument('-x', type=int, default=1, help='integer')
+    parser_foo.add_argument('y', type=float, help='float')
+
+    parser_sport = base_subparsers.add_parser('sport', help='sport help')
+    sport_arg = parser_sport.add_argument('sport', help='Enter name of a sport')
+    setattr(sport_arg, 'arg_choices', sport_items)
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, multiline_commands=['multiline_command'], **kwargs)
+        self.stdout = utils.StdSim(self.stdout)
+
+    def do_echo(self, statement):
+        """Print the arguments"""
+        self.poutput(statement.args)
+
+    def do_noop(self, statement):
+        """Do nothing"""
+        pass
+
+    def do_lines(self, statement):
+        """Print a number of lines, a thousand at a time"""
+        block = ''.join('line {}\n'.format(i) for i in range(1000))
+        for _ in range(int(statement.args) // 1000):
+            self.poutput(block, end='')
+
+    @cmd2.pipe_filter
+    def do_count(self, statement):
+        """Print the number of lines piped to this command"""
+        self.poutput(self.stdin.read().count('\n'))
+
+    @cmd2.with_argparser(base_parser)
+    def do_base(self, args):
+        """Command with sub-commands"""
+        pass
+
+
+class HookedApp(BenchApp):
+    """Application with hooks which return their data unchanged"""
+    def postparsing_hook(self, data: plugin.PostparsingData) -> plugin.PostparsingData:
+        return data
+
+    def precmd_hook(self, data: plugin.PrecommandData) -> plugin.PrecommandData:
+        return data
+
+    def postcmd_hook(self, data: plugin.PostcommandData) -> plugin.PostcommandData:
+        return data
+
+    def cmdfinalization_hook(self, data: plugin.CommandFinalizationData) -> plugin.CommandFinalizationData:
+        return data
+
+
+def _hooked_app(num_hooks: int) -> HookedApp:
+    """Return a HookedApp with num_hooks hooks registered for each stage"""
+    app = HookedApp()
+    app.exclude_from_history.append('noop')
+    for _ in range(num_hooks):
+        app.register_postparsing_hook(app.postparsing_hook)
+        app.register_precmd_hook(app.precmd_hook)
+        app.register_postcmd_hook(app.postcmd_hook)
+        app.register_cmdfinalization_hook(app.cmdfinalization_hook)
+    return app
+
+
+def _many_commands_app(num_commands: int) -> BenchApp:
+    """Return an application whose class has num_commands generated commands"""
+    def make_command(index):
+        def do_command(self, _):
+            """Generated command"""
+            self.poutput(index)
+        return do_command
+
+    attrs = {'do_gen{}'.format(i): make_command(i) for i in range(num_commands)}
+    return type('ManyCommandsApp', (BenchApp,), attrs)()
+
+
+def _make_history(size: int) -> history.History:
+    """Return a History with size items which share a handful of parsed statements"""
+    parser = parsing.StatementParser(aliases={'ll': 'shell ls -l'})
+    statements = [parser.parse(line) for line in PARSE_LINES + ['ll *.txt', 'alias create lls shell ls']]
+    hist = history.History()
+    for i in range(size):
+        hist.append(statements[i % len(statements)])
+    return hist
+
+
+#####
+#
+# Parsing
+#
+#####
+@benchmark('parsing', ops=len(PARSE_LINES))
+def parse(config):
+    """StatementParser.parse() with the parse cache disabled"""
+    parser = parsing.StatementParser(terminators=[';'], multiline_commands=['multiline_command'], cache_size=0)
+    yield lambda: [parser.parse(line) for line in PARSE_LINES]
+
+
+@benchmark('parsing', ops=len(PARSE_LINES))
+def parse_aliases(config):
+    """StatementParser.parse() expanding aliases with the parse cache disabled"""
+    aliases = {'alias{}'.format(i): 'say {}'.format(i) for i in range(100)}
+    aliases.update({line.split()[0]: line for line in PARSE_LINES})
+    parser = parsing.StatementParser(terminators=[';'], multiline_commands=['multiline_command'],
+                                     aliases=aliases, cache_size=0)
+    yield lambda: [parser.parse(line) for line in PARSE_LINES]
+
+
+@benchmark('parsing', ops=len(PARSE_LINES))
+def parse_cached(config):
+    """StatementParser.parse() of lines already in the parse cache"""
+    parser = parsing.StatementParser(terminators=[';'], multiline_commands=['multiline_command'])
+    yield lambda: [parser.parse(line) for line in PARSE_LINES]
+
+
+@benchmark('parsing', ops=len(PARSE_LINES))
+def tokenize(config):
+    """StatementParser.tokenize() without expanding aliases or shortcuts"""
+    parser = parsing.StatementParser(terminators=[';'], multiline_commands=['multiline_command'])
+    yield lambda: [parser.tokenize(line, expand=False) for line in PARSE_LINES]
+
+
+# Lines which expand an alias, follow a chain of aliases, match no alias, and expand a shortcut
+EXPAND_LINES = ['host9999', 'deploy now', 'not_an_alias arg1 arg2', '@@script.txt']
+
+
+@benchmark('parsing', ops=len(EXPAND_LINES))
+def expand_many_aliases(config):
+    """Expanding aliases and shortcuts with 10,000 aliases defined"""
+    aliases = {'host{}'.format(i): 'ssh host{}.example.com'.format(i) for i in range(10000)}
+    aliases.update({'deploy': 'stage prod', 'stage': 'push --stage', 'push': '!rsync'})
+    shortcuts = sorted(cmd2.Cmd.DEFAULT_SHORTCUTS.items(), reverse=True)
+    parser = parsing.StatementParser(aliases=aliases, shortcuts=shortcuts)
+    yield lambda: [parser._expand(line) for line in EXPAND_LINES]
+
+
+@benchmark('parsing')
+def macro_resolve(config):
+    """Macro.resolve() of a macro with 40 placeholders"""
+    app = BenchApp()
+    placeholders = ' '.join('--opt{0} {{{0}}}'.format(i) for i in range(1, 41))
+    app.onecmd_plus_hooks('macro create deploy echo {}'.format(placeholders))
+    macro = app.macros['deploy']
+    statement = app.statement_parser.parse('deploy ' + ' '.join('value{}'.format(i) for i in range(40)))
+    yield lambda: macro.resolve(statement)
+
+
+# A script of 10 multiline commands which are 200 lines long
+MULTILINE_SCRIPT = (['multiline_command start'] + ['more words on this line'] * 198 + ['last line;']) * 10
+
+
+@benchmark('parsing', ops=len(MULTILINE_SCRIPT))
+def parse_many_multiline(config):
+    """StatementParser.parse_many() of long multiline commands with the parse cache disabled"""
+    parser = parsing.StatementParser(terminators=[';'], multiline_commands=['multiline_command'], cache_size=0)
+    yield lambda: list(parser.parse_many(MULTILINE_SCRIPT))
+
+
+#####
+#
+# Dispatch
+#
+#####
+@benchmark('dispatch')
+def onecmd_stdsim(config):
+    """onecmd_plus_hooks() writing to a StdSim"""
+    app = BenchApp()
+    app.exclude_from_history.append('echo')
+
+    def run():
+        app.onecmd_plus_hooks('echo hello')
+        app.stdout.clear()
+    yield run
+
+
+@benchmark('dispatch')
+def onecmd_noop(config):
+    """onecmd_plus_hooks() of a command which does nothing"""
+    app = _hooked_app(0)
+    yield lambda: app.onecmd_plus_hooks('noop')
+
+
+@benchmark('dispatch')
+def onecmd_hooks(config):
+    """onecmd_plus_hooks() with one hook registered for each stage"""
+    app = _hooked_app(1)
+    yield lambda: app.onecmd_plus_hooks('noop')
+
+
+@benchmark('dispatch')
+def onecmd_10_hooks(config):
+    """onecmd_plus_hooks() with 10 hooks registered for each stage"""
+    app = _hooked_app(10)
+    yield lambda: app.onecmd_plus_hooks('noop')
+
+
+@benchmark('dispatch')
+def onecmd_collect_stats(config):
+    """onecmd_plus_hooks() collecting latency statistics"""
+    app = _hooked_app(0)
+    app.collect_stats = True
+    yield lambda: app.onecmd_plus_hooks('noop')
+
+
+@benchmark('dispatch')
+def terminal_restore(config):
+    """Restoring a pseudo-terminal's termios attributes as is done after each command"""
+    if not hasattr(os, 'openpty'):
+        yield None
+        return
+
+    master_fd, slave_fd = os.openpty()
+    try:
+        with os.fdopen(slave_fd, 'w', closefd=False) as slave:
+            state = utils.TerminalState.save(slave)
+        yield state.restore if state is not None else None
+    finally:
+        os.close(master_fd)
+        os.close(slave_fd)
+
+
+@benchmark('dispatch')
+def onecmd_redirect_file(config):
+    """onecmd_plus_hooks() redirecting output to a file"""
+    app = BenchApp()
+    app.exclude_from_history.append('echo')
+    temp_dir = tempfile.mkdtemp()
+    line = 'echo hello > {}'.format(os.path.join(temp_dir, 'out.txt'))
+    try:
+        yield lambda: app.onecmd_plus_hooks(line)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@benchmark('dispatch')
+def onecmd_pipe_filter(config):
+    """onecmd_plus_hooks() piping 100,000 lines to a filter command"""
+    app = BenchApp()
+    app.exclude_from_history.append('lines')
+
+    def run():
+        app.onecmd_plus_hooks('lines 100000 | count')
+        app.stdout.clear()
+    yield run
+
+
+@benchmark('dispatch')
+def onecmd_pipe_shell(config):
+    """onecmd_plus_hooks() piping 100,000 lines to a shell command"""
+    app = BenchApp()
+    app.exclude_from_history.append('lines')
+
+    def run():
+        app.onecmd_plus_hooks('lines 100000 | wc -l')
+        app.stdout.clear()
+    yield run
+
+
+@benchmark('dispatch')
+def pyscript_bridge_call(config):
+    """Calling a command through PyscriptBridge"""
+    app = BenchApp()
+    app.exclude_from_history.append('echo')
+    bridge = pyscript_bridge.PyscriptBridge(app)
+    yield lambda: bridge('echo hello')
+
+
+#####
+#
+# Command registry
+#
+#####
+@benchmark('registry')
+def get_all_commands(config):
+    """get_all_commands() in an application with 5,000 commands"""
+    yield _many_commands_app(config.scale(5000, 500)).get_all_commands
+
+
+@benchmark('registry')
+def get_visible_commands(config):
+    """get_visible_commands() in an application with 5,000 commands"""
+    yield _many_commands_app(config.scale(5000, 500)).get_visible_commands
+
+
+@benchmark('registry')
+def cmd_func_lookup(config):
+    """cmd_func() in an application with 5,000 commands"""
+    app = _many_commands_app(config.scale(5000, 500))
+    yield lambda: app.cmd_func('gen100')
+
+
+#####
+#
+# Output capture
+#
+#####
+@benchmark('capture', ops=1000)
+def stdsim_capture(config):
+    """StdSim.write() of 1,000 lines followed by getvalue()"""
+    stdsim = utils.StdSim(None)
+    lines = ['line {}\n'.format(i) for i in range(1000)]
+
+    def run():
+        for line in lines:
+            stdsim.write(line)
+        stdsim.getvalue()
+        stdsim.clear()
+    yield run
+
+
+@benchmark('capture', ops=1000)
+def stdsim_capture_limited(config):
+    """StdSim.write() of 1,000 lines keeping the last 4 KiB"""
+    stdsim = utils.StdSim(None, max_bytes=4096)
+    lines = ['line {}\n'.format(i) for i in range(1000)]
+
+    def run():
+        for line in lines:
+            stdsim.write(line)
+        stdsim.clear()
+    yield run
+
+
+#####
+#
+# Output
+#
+#####
+@benchmark('output', ops=1000)
+def poutput_file(config):
+    """poutput() of 1,000 rows to a file"""
+    app = BenchApp()
+    rows = ['row {}'.format(i) for i in range(1000)]
+    with open(os.devnull, 'w') as devnull:
+        app.stdout = devnull
+
+        def run():
+            for row in rows:
+                app.poutput(row)
+        yield run
+
+
+@benchmark('output', ops=1000)
+def poutput_many_file(config):
+    """poutput_many() of 1,000 rows to a file"""
+    app = BenchApp()
+    rows = ['row {}'.format(i) for i in range(1000)]
+    with open(os.devnull, 'w') as devnull:
+        app.stdout = devnull
+        yield lambda: app.poutput_many(rows)
+
+
+@benchmark('output', ops=1000)
+def perror_file(config):
+    """perror() of 1,000 messages to a file"""
+    app = BenchApp()
+    messages = ['error {}'.format(i) for i in range(1000)]
+    with open(os.devnull, 'w') as devnull, mock.patch('sys.stderr', devnull):
+        def run():
+            for message in messages:
+                app.perror(message, traceback_war=False)
+        yield run
+
+
+@benchmark('output', ops=1000)
+def poutput_color_stripped(config):
+    """poutput() of 1,000 colored rows to a file, which strips the colors"""
+    app = BenchApp()
+    rows = [Fore.GREEN + 'row {}'.format(i) + Fore.RESET for i in range(1000)]
+    with open(os.devnull, 'w') as devnull:
+        app.stdout = devnull
+
+        def run():
+            for row in rows:
+                app.poutput(row)
+        yield run
+
+
+#####
+#
+# Text metrics
+#
+#####
+PLAIN_TEXTS = ['command_{}'.format(i) for i in range(1000)]
+COLORED_TEXTS = [Fore.CYAN + text + Fore.RESET for text in PLAIN_TEXTS]
+WIDE_TEXTS = ['\u4e2d\u6587 {}'.format(text) for text in PLAIN_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def strip_ansi_plain(config):
+    """strip_ansi() of 1,000 strings without escape codes"""
+    yield lambda: [text_metrics.strip_ansi(text) for text in PLAIN_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def strip_ansi_colored(config):
+    """strip_ansi() of 1,000 colored strings"""
+    yield lambda: [text_metrics.strip_ansi(text) for text in COLORED_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def width_plain(config):
+    """width() of 1,000 plain ASCII strings"""
+    yield lambda: [text_metrics.width(text) for text in PLAIN_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def width_colored(config):
+    """width() of 1,000 colored strings which were measured before"""
+    yield lambda: [text_metrics.width(text) for text in COLORED_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def width_wide(config):
+    """width() of 1,000 strings with wide characters which were measured before"""
+    yield lambda: [text_metrics.width(text) for text in WIDE_TEXTS]
+
+
+@benchmark('text', ops=1000)
+def max_width_plain(config):
+    """max_width() of 1,000 plain ASCII strings"""
+    yield lambda: text_metrics.max_width(PLAIN_TEXTS)
+
+
+#####
+#
+# Completion
+#
+#####
+def _complete(app, line: str):
+    """Return a callable which runs complete() as readline would for a line"""
+    begidx = line.rfind(' ') + 1
+    endidx = len(line)
+    text = line[begidx:]
+
+    def run():
+        with mock.patch.object(readline, 'get_line_buffer', lambda: line), \
+                mock.patch.object(readline, 'get_begidx', lambda: begidx), \
+                mock.patch.object(readline, 'get_endidx', lambda: endidx):
+            return app.complete(text, 0)
+    return run
+
+
+@benchmark('completion')
+def complete_subcommand(config):
+    """complete() on a sub-command name of an argparse command"""
+    yield _complete(BenchApp(), 'base sp')
+
+
+@benchmark('completion')
+def complete_subcommand_arg(config):
+    """complete() on an argument of an argparse sub-command"""
+    yield _complete(BenchApp(), 'base sport Bas')
+
+
+@benchmark('completion')
+def path_complete_large_dir(config):
+    """path_complete() in a directory with 50,000 entries"""
+    app = BenchApp()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for i in range(config.scale(50000, 5000)):
+            open(os.path.join(temp_dir, 'file_{:05}'.format(i)), 'w').close()
+        text = os.path.join(temp_dir, 'file_01')
+        line = 'load {}'.format(text)
+        yield lambda: app.path_complete(text, line, len(line) - len(text), len(line))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+#####
+#
+# History
+#
+#####
+@benchmark('history')
+def history_str_search(config):
+    """History.str_search() over 1,000,000 items"""
+    hist = _make_history(config.scale(1000000, 10000))
+    yield lambda: hist.str_search('ls')
+
+
+@benchmark('history')
+def history_regex_search(config):
+    """History.regex_search() over 1,000,000 items"""
+    hist = _make_history(config.scale(1000000, 10000))
+    yield lambda: hist.regex_search('/s[a-z]+ .*txt/')
+
+
+@benchmark('history', ops=10000, memory=True)
+def statement_storage(config):
+    """Creating 10,000 Statements which share their strings, as History holds them"""
+    parsed = parsing.StatementParser().parse('say -r 3 "hello there" > out.txt')
+    fields = {a.name: getattr(parsed, a.name) for a in attr.fields(parsing.Statement)
+              if a.init and a.name != 'args'}
+
+    def run():
+        return [parsing.Statement(parsed.args, **{name: list(value) if isinstance(value, list) else value
+                                                  for name, value in fields.items()})
+                for _ in range(10000)]
+    yield run
+
+
+#####
+#
+# Scripts
+#
+#####
+def _script_file(num_lines: int) -> str:
+    """Write a UTF-8 script of num_lines commands to a temporary file and return its path"""
+    fd, path = tempfile.mkstemp(prefix='cmd2_bench', suffix='.txt')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for i in range(num_lines):
+            f.write('say line {} of the script \u03b3\u03bd\u03c9\u03c1\u03af\u03b6\u03c9\n'.format(i))
+    return path
+
+
+@benchmark('scripts')
+def read_script(config):
+    """utils.read_text_lines() of a 200,000 line script"""
+    path = _script_file(config.scale(200000, 20000))
+    try:
+        yield lambda: list(utils.read_text_lines(path))
+    finally:
+        os.remove(path)
+
+
+@benchmark('scripts')
+def read_script_mmap(config):
+    """utils.read_text_lines() of a 200,000 line script using mmap"""
+    path = _script_file(config.scale(200000, 20000))
+    try:
+        yield lambda: list(utils.read_text_lines(path, use_mmap=True))
+    finally:
+        os.remove(path)
+
+
+#####
+#
+# Batches
+#
+#####
+BATCH_COMMANDS = 10000
+
+
+def _batch(run_stream):
+    """Set up a file of commands and yield a callable which runs them with run_stream(app, stream)"""
+    app = BenchApp()
+    app.exclude_from_history.append('echo')
+    fd, path = tempfile.mkstemp(prefix='cmd2_bench', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        for i in range(BATCH_COMMANDS):
+            f.write('echo line {}\n'.format(i))
+    try:
+        with open(os.devnull, 'w', buffering=1) as devnull:
+            app.stdout = devnull
+
+            def run():
+                with open(path) as stream:
+                    run_stream(app, stream)
+            yield run
+    finally:
+        os.remove(path)
+
+
+@benchmark('batch', ops=BATCH_COMMANDS)
+def cmdloop_piped(config):
+    """cmdloop() running 10,000 commands piped to stdin"""
+    def run_stream(app, stream):
+        with mock.patch('sys.stdin', stream):
+            app._cmdloop()
+    yield from _batch(run_stream)
+
+
+@benchmark('batch', ops=BATCH_COMMANDS)
+def run_batch(config):
+    """run_batch() running 10,000 commands"""
+    yield from _batch(lambda app, stream: app.run_batch(stream))
+
+
+@benchmark('batch', ops=BATCH_COMMANDS)
+def run_batch_block_output(config):
+    """run_batch() running 10,000 commands with output written in 64 KiB blocks"""
+    yield from _batch(lambda app, stream: app.run_batch(stream, output_block_size=65536))
+
+
+#####
+#
+# Transcripts
+#
+#####
+@benchmark('transcript')
+def transcript_replay(config):
+    """Replaying a transcript of 200 commands"""
+    app = BenchApp()
+    temp_dir = tempfile.mkdtemp()
+    transcript_file = os.path.join(temp_dir, 'bench.txt')
+    with open(transcript_file, 'w') as f:
+        for i in range(100):
+            f.write('{}echo line {}\nline {}\n'.format(app.prompt, i, i))
+            f.write('{}echo word{}\n/w[a-z]+/{}\n'.format(app.prompt, i, i))
+    app.testfiles = [transcript_file]
+
+    class BenchTestCase(transcript.Cmd2TestCase):
+        cmdapp = app
+
+    def run():
+        test_case = BenchTestCase()
+        test_case.setUp()
+        test_case.runTest()
+        test_case.tearDown()
+        app.history.clear()
+
+    try:
+        yield run
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run cmd2's benchmark suite")
+    parser.add_argument('-k', dest='names', action='append',
+                        help='only run benchmarks whose name contains NAME or whose group is NAME')
+    parser.add_argument('--quick', action='store_true', help='use smaller data sets and fewer repeats')
+    parser.add_argument('-o', '--output', help='save results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare results to a JSON file saved with -o')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction a benchmark can slow down by before --compare fails (default: 0.1)')
+    parser.add_argument('-l', '--list', action='store_true', help='list benchmarks and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for bench in harness.BENCHMARKS:
+            print('{:<12} {:<28} {}'.format(bench.group, bench.name, bench.description))
+        return 0
+
+    baseline = harness.load(args.compare) if args.compare else None
+    results = harness.run(harness.Config(quick=args.quick), args.names)
+    if args.output:
+        harness.save(results, args.output)
+
+    if baseline is not None:
+        print()
+        regressions = harness.compare(baseline, results, args.threshold)
+        if regressions:
+            print('\n{} benchmark(s) slowed down by more than {:.0%}'.format(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,5 +11,6 @@ except DistributionNotFound:
     pass
 
 from .cmd2 import Cmd, Statement, EmptyStatement, categorize
-from .cmd2 import with_argument_list, with_argparser, with_argparser_and_unknown_args, with_category
+from .cmd2 import with_argument_list, with_argparser, with_argparser_and_unknown_args, with_category, thread_safe
+from .cmd2 import pipe_filter
 from .pyscript_bridge import CommandResult
@@ -61,6 +61,7 @@ Released under MIT license, see LICENSE file
 """
 
 import argparse
+import inspect
 import os
 import re as _re
 import sys
@@ -72,7 +73,7 @@ from typing import List, Dict, Tuple, Callable, Union
 from colorama import Fore
 
 from .rl_utils import rl_force_redisplay
-from .utils import ansi_safe_wcswidth
+from . import text_metrics
 
 # attribute that can optionally added to an argparse argument (called an Action) to
 # define the completion choices for the argument. You may provide a Collection or a Function.
@@ -592,14 +593,9 @@ class AutoCompleter(object):
                 completions.sort(key=self._cmd2_app.matches_sort_key)
                 self._cmd2_app.matches_sorted = True
 
-            token_width = ansi_safe_wcswidth(action.dest)
+            token_width = max(text_metrics.width(action.dest), text_metrics.max_width(completions))
             completions_with_desc = []
 
-            for item in completions:
-                item_width = ansi_safe_wcswidth(item)
-                if item_width > token_width:
-                    token_width = item_width
-
             term_size = os.get_terminal_size()
             fill_width = int(term_size.columns * .6) - (token_width + 2)
             for item in completions:
@@ -681,13 +677,13 @@ class AutoCompleter(object):
                 try:
                     # call the provided function differently depending on the provided positional and keyword arguments
                     if list_args is not None and kw_args is not None:
-                        return completer(text, line, begidx, endidx, *list_args, **kw_args)
+                        return self._await_result(completer(text, line, begidx, endidx, *list_args, **kw_args))
                     elif list_args is not None:
-                        return completer(text, line, begidx, endidx, *list_args)
+                        return self._await_result(completer(text, line, begidx, endidx, *list_args))
                     elif kw_args is not None:
-                        return completer(text, line, begidx, endidx, **kw_args)
+                        return self._await_result(completer(text, line, begidx, endidx, **kw_args))
                     else:
-                        return completer(text, line, begidx, endidx)
+                        return self._await_result(completer(text, line, begidx, endidx))
                 except TypeError:
                     # assume this is due to an incorrect function signature, return nothing.
                     return []
@@ -697,6 +693,12 @@ class AutoCompleter(object):
 
         return []
 
+    def _await_result(self, result):
+        """Run the result of an async completion function on the application's event loop"""
+        if inspect.isawaitable(result):
+            return self._cmd2_app.run_coroutine(result)
+        return result
+
     def _resolve_choices_for_arg(self, action: argparse.Action, used_values=()) -> List[str]:
         if action.dest in self._arg_choices:
             args = self._arg_choices[action.dest]
@@ -719,6 +721,7 @@ class AutoCompleter(object):
                         args = args()
                 except TypeError:
                     return []
+                args = self._await_result(args)
 
             try:
                 iter(args)
@@ -31,20 +31,29 @@ Git repository on GitHub at https://github.com/python-cmd2/cmd2
 # setting is True
 import argparse
 import cmd
+import contextlib
+import datetime
+import itertools
 import glob
 import inspect
 import os
 import re
+import stat
 import sys
 import threading
 from collections import namedtuple
-from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Type, Union, IO
+from typing import Any, Callable, Dict, Generator, Iterator, List, Mapping, Optional, TextIO, Tuple, Type
+from typing import Union, IO
 
 import colorama
 from colorama import Fore
 
 from . import constants
+from . import jobs
+from . import pipes
 from . import plugin
+from . import stats
+from . import text_metrics
 from . import utils
 from .argparse_completer import AutoCompleter, ACArgumentParser, ACTION_ARG_CHOICES
 from .clipboard import can_clip, get_paste_buffer, write_to_paste_buffer
@@ -121,6 +130,12 @@ except ImportError:  # pragma: no cover
 # optional attribute, when tagged on a function, allows cmd2 to categorize commands
 HELP_CATEGORY = 'help_category'
 
+# optional attribute, when tagged on a function, allows cmd2 to run the command in parallel with others
+THREAD_SAFE = 'thread_safe'
+
+# optional attribute, when tagged on a function, allows cmd2 to pipe other commands' output to it in-process
+PIPE_FILTER = 'pipe_filter'
+
 INTERNAL_COMMAND_EPILOG = ("Notes:\n"
                            "  This command is for internal use and is not intended to be called from the\n"
                            "  command line.")
@@ -131,6 +146,9 @@ COMMAND_FUNC_PREFIX = 'do_'
 # All help functions start with this
 HELP_FUNC_PREFIX = 'help_'
 
+# All command completer functions start with this
+COMPLETER_FUNC_PREFIX = 'complete_'
+
 # Sorting keys for strings
 ALPHABETICAL_SORT_KEY = utils.norm_fold
 NATURAL_SORT_KEY = utils.natural_keys
@@ -138,6 +156,9 @@ NATURAL_SORT_KEY = utils.natural_keys
 # Used as the command name placeholder in disabled command messages.
 COMMAND_NAME = "<COMMAND_NAME>"
 
+# Attributes with these prefixes are tracked by the command registry
+_COMMAND_ATTR_PREFIXES = (COMMAND_FUNC_PREFIX, HELP_FUNC_PREFIX, COMPLETER_FUNC_PREFIX)
+
 
 def categorize(func: Union[Callable, Iterable], category: str) -> None:
     """Categorize a function.
@@ -162,6 +183,29 @@ def with_category(category: str) -> Callable:
     return cat_decorator
 
 
+def thread_safe(func: Callable) -> Callable:
+    """A decorator to mark a command function as safe to run in a thread at the same time as other commands.
+
+    Commands marked this way can be run by the parallel command and Cmd.run_parallel(). They should only
+    write output with poutput() and its relatives and not change state which other commands use.
+    """
+    setattr(func, THREAD_SAFE, True)
+    return func
+
+
+def pipe_filter(func: Callable) -> Callable:
+    """A decorator to mark a command function as a filter which reads the output of commands piped to it.
+
+    When a command line pipes to a filter, as in ``command | filter args``, the filter runs in another thread
+    at the same time as the command and reads its output from self.stdin a line at a time or all at once. The
+    output passes between them in memory instead of through a shell process. Filters can be chained and the
+    last one can redirect its output as usual. A filter should only write output with poutput() and its
+    relatives, shouldn't change state which other commands use, and can't be an async command.
+    """
+    setattr(func, PIPE_FILTER, True)
+    return func
+
+
 def with_argument_list(*args: List[Callable], preserve_quotes: bool = False) -> Callable[[List], Optional[bool]]:
     """A decorator to alter the arguments passed to a do_* cmd2 method. Default passes a string of whatever the user
     typed. With this decorator, the decorated method will receive a list of arguments parsed from user input.
@@ -303,6 +347,26 @@ class EmptyStatement(Exception):
 DisabledCommand = namedtuple('DisabledCommand', ['command_function', 'help_function'])
 
 
+class CommandInfo(namedtuple('CommandInfo', ['function', 'help_function', 'completer'])):
+    """Contains the functions of a command in the command registry
+
+    function - the do_* method
+    help_function - the help_* method or None
+    completer - the complete_* method or None
+    """
+    __slots__ = ()
+
+    @property
+    def argparser(self) -> Optional[argparse.ArgumentParser]:
+        """The argparse parser if the command uses one of the argparse decorators, otherwise None"""
+        return getattr(self.function, 'argparser', None)
+
+    @property
+    def category(self) -> Optional[str]:
+        """The help category of the command or None"""
+        return getattr(self.function, HELP_CATEGORY, None)
+
+
 class Cmd(cmd.Cmd):
     """An easy but powerful framework for writing line-oriented command interpreters.
 
@@ -314,6 +378,12 @@ class Cmd(cmd.Cmd):
     DEFAULT_SHORTCUTS = {'?': 'help', '!': 'shell', '@': 'load', '@@': '_relative_load'}
     DEFAULT_EDITOR = utils.find_editor()
 
+    # The most streams decolorized_write() remembers whether to strip ANSI escape sequences for
+    _MAX_STRIP_ANSI_STREAMS = 8
+
+    # The number of messages poutput_many() joins into each write
+    _POUTPUT_MANY_BLOCK_ROWS = 1000
+
     def __init__(self, completekey: str = 'tab', stdin=None, stdout=None, persistent_history_file: str = '',
                  persistent_history_length: int = 1000, startup_script: Optional[str] = None, use_ipython: bool = False,
                  transcript_files: Optional[List[str]] = None, allow_redirection: bool = True,
@@ -347,6 +417,13 @@ class Cmd(cmd.Cmd):
         # needs to be done before we call __init__(0)
         self._initialize_plugin_system()
 
+        # While background jobs or pipe filters are running, this holds the stream each of their threads uses
+        # as self.stdout. Once a filter has run, _pipe_stdin holds the stream each filter's thread uses as
+        # self.stdin. They are set before cmd.Cmd.__init__() sets self.stdout and self.stdin.
+        self._job_stdout = None
+        self._pipe_stdin = None
+        self._running_pipelines = 0
+
         # Call super class constructor
         super().__init__(completekey=completekey, stdin=stdin, stdout=stdout)
 
@@ -363,11 +440,13 @@ class Cmd(cmd.Cmd):
         self.editor = self.DEFAULT_EDITOR
         self.feedback_to_output = False  # Do not include nonessentials in >, | output by default (things like timing)
         self.locals_in_py = False
+        self.collect_stats = False  # Record latency statistics for the stats command
         self.quiet = False  # Do not suppress nonessential output
         self.timing = False  # Prints elapsed time for each command
 
         # To make an attribute settable with the "do_set" command, add it to this ...
         self.settable = {'colors': 'Allow colorized output (valid values: Terminal, Always, Never)',
+                         'collect_stats': 'Record command latency statistics for the stats command',
                          'continuation_prompt': 'On 2nd+ line of input',
                          'debug': 'Show full error stack on error',
                          'echo': 'Echo command issued into output',
@@ -384,11 +463,21 @@ class Cmd(cmd.Cmd):
         # Commands to exclude from the history command
         self.exclude_from_history = '''history edit eof eos'''.split()
 
+        # How the terminal is fixed after each command when stdout is a terminal. TERMINAL_RESTORE_TERMIOS restores
+        # the termios attributes saved when cmdloop() started and falls back to TERMINAL_RESTORE_STTY, which runs
+        # "stty sane", if they weren't saved. TERMINAL_RESTORE_NEVER leaves the terminal alone.
+        self.terminal_restore = constants.TERMINAL_RESTORE_TERMIOS
+
+        # Compression level from 0 to 9 for output redirected to a .gz, .bz2, or .xz file.
+        # None uses the default of the format's command-line tool.
+        self.redirect_compress_level = None
+
         # Command aliases and macros
         self.macros = dict()
 
         self.initial_stdout = sys.stdout
         self.history = History()
+        self.command_stats = stats.StatsCollector()
         self.pystate = {}
         self.py_history = []
         self.pyscript_name = 'app'
@@ -418,6 +507,14 @@ class Cmd(cmd.Cmd):
         # Used load command to store the current script dir as a LIFO queue to support _relative_load command
         self._script_dir = []
 
+        # Scripts run by the load command which are at least this many bytes are read through a memory map.
+        # None means scripts are always read through a buffered file.
+        self.load_mmap_threshold = None
+
+        # Stack of iterators which supply commands waiting to run, like the lines of a script being loaded.
+        # The last source is read first. Commands in self.cmdqueue run once all of these are exhausted.
+        self._command_sources = []
+
         # Context manager used to protect critical sections in the main thread from stopping due to a KeyboardInterrupt
         self.sigint_protection = utils.ContextFlag()
 
@@ -425,6 +522,28 @@ class Cmd(cmd.Cmd):
         # Otherwise it will be None. Its used to know when a pipe process can be killed and/or waited upon.
         self.cur_pipe_proc_reader = None
 
+        # Terminal state saved by cmdloop() and restored after each command
+        self._terminal_state = None
+
+        # Event loop which runs async commands and completers. It is created when first needed and kept open
+        # between commands so things like connection pools can be reused.
+        self._event_loop = None
+        self._event_loop_thread = None
+
+        # Background jobs started by ending a command line with &
+        self.job_table = jobs.JobTable()
+
+        # ThreadLocalStreams which replace sys.stdout and sys.stderr while background jobs are running,
+        # so what each job prints goes to the job
+        self._job_streams = None
+
+        # The stream run_batch() writes output to and whether it is a tty, which is only checked once per batch
+        self._batch_stdout = None
+        self._batch_stdout_isatty = False
+
+        # Lines of input being run by run_batch(). Multiline commands are completed from these.
+        self._batch_lines = None
+
         # Used by complete() for readline tab completion
         self.completion_matches = []
 
@@ -546,6 +665,82 @@ class Cmd(cmd.Cmd):
         # values are DisabledCommand objects.
         self.disabled_commands = dict()
 
+    # -----  Command registry -----
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Keep the command registry current when command, help, or completer functions are set"""
+        super().__setattr__(name, value)
+        if name.startswith(_COMMAND_ATTR_PREFIXES):
+            self._update_command_registry(name)
+
+    def __delattr__(self, name: str) -> None:
+        """Keep the command registry current when command, help, or completer functions are deleted"""
+        super().__delattr__(name)
+        if name.startswith(_COMMAND_ATTR_PREFIXES):
+            self._update_command_registry(name)
+
+    @property
+    def _commands(self) -> Dict[str, CommandInfo]:
+        """The command registry, which maps command names to CommandInfo objects.
+
+        It is built from get_names() and this instance's attributes the first time it is needed and
+        then updated one command at a time whenever a do_*, help_*, or complete_* attribute is set or
+        deleted on this instance. This includes disable_command() and enable_command(). It is built
+        again once an attribute has been added to or deleted from one of this instance's classes.
+        """
+        registry = self.__dict__.get('_command_registry')
+        if registry is not None:
+            # The registry is current unless an attribute was added to or deleted from one of the classes,
+            # which changes the size of that class's __dict__
+            cls, class_dicts, sizes = self.__dict__['_command_registry_classes']
+            if cls is type(self) and list(map(len, class_dicts)) == sizes:
+                return registry
+
+        registry = dict()
+        help_topics = []
+        instance_names = [name for name in self.__dict__ if name.startswith(_COMMAND_ATTR_PREFIXES)]
+        for name in sorted(set(self.get_names()).union(instance_names)):
+            if name.startswith(COMMAND_FUNC_PREFIX):
+                self._register_command(registry, name[len(COMMAND_FUNC_PREFIX):])
+            elif name.startswith(HELP_FUNC_PREFIX) and callable(getattr(self, name, None)):
+                help_topics.append(name[len(HELP_FUNC_PREFIX):])
+
+        # Bypass __setattr__ since these aren't command functions. The __dict__ of each class is a live view.
+        class_dicts = [vars(base) for base in type(self).__mro__]
+        self.__dict__['_help_topics'] = help_topics
+        self.__dict__['_command_registry'] = registry
+        self.__dict__['_command_registry_classes'] = (type(self), class_dicts, list(map(len, class_dicts)))
+        return registry
+
+    def _register_command(self, registry: Dict[str, CommandInfo], command: str) -> None:
+        """Add, replace, or remove the registry entry for a command based on its current attributes"""
+        func = getattr(self, COMMAND_FUNC_PREFIX + command, None)
+        if not callable(func):
+            registry.pop(command, None)
+            return
+
+        help_func = getattr(self, HELP_FUNC_PREFIX + command, None)
+        completer = getattr(self, COMPLETER_FUNC_PREFIX + command, None)
+        registry[command] = CommandInfo(function=func,
+                                        help_function=help_func if callable(help_func) else None,
+                                        completer=completer if callable(completer) else None)
+
+    def _update_command_registry(self, attr_name: str) -> None:
+        """Update the registry entry of the command an attribute belongs to, if the registry has been built"""
+        registry = self.__dict__.get('_command_registry')
+        if registry is not None:
+            # All of the prefixes end with the first underscore in the attribute name
+            name = attr_name[attr_name.index('_') + 1:]
+            self._register_command(registry, name)
+
+            if attr_name.startswith(HELP_FUNC_PREFIX):
+                help_topics = self.__dict__['_help_topics']
+                if callable(getattr(self, attr_name, None)):
+                    if name not in help_topics:
+                        help_topics.append(name)
+                elif name in help_topics:
+                    help_topics.remove(name)
+
     # -----  Methods related to presenting output to the user -----
 
     @property
@@ -557,7 +752,7 @@ class Cmd(cmd.Cmd):
 
         :return: prompt stripped of any ANSI escape codes
         """
-        return utils.strip_ansi(self.prompt)
+        return text_metrics.strip_ansi(self.prompt)
 
     @property
     def aliases(self) -> Dict[str, str]:
@@ -579,17 +774,55 @@ class Cmd(cmd.Cmd):
         """Setter for the allow_redirection property that determines whether or not redirection of stdout is allowed."""
         self.statement_parser.allow_redirection = value
 
+    @property
+    def colors(self) -> str:
+        """Getter for the colors property that determines when ANSI escape sequences are written"""
+        return self._colors
+
+    @colors.setter
+    def colors(self, value: str) -> None:
+        """Setter for the colors property that determines when ANSI escape sequences are written"""
+        self._colors = value
+        self._strip_ansi_streams = {}
+
     def decolorized_write(self, fileobj: IO, msg: str) -> None:
         """Write a string to a fileobject, stripping ANSI escape sequences if necessary
 
         Honor the current colors setting, which requires us to check whether the
-        fileobject is a tty.
+        fileobject is a tty. The answer is kept for each stream until colors or self.stdout changes.
         """
-        if self.colors.lower() == constants.COLORS_NEVER.lower() or \
-                (self.colors.lower() == constants.COLORS_TERMINAL.lower() and not fileobj.isatty()):
-            msg = utils.strip_ansi(msg)
+        try:
+            strip = self._strip_ansi_streams[fileobj]
+        except (KeyError, TypeError):
+            strip = self._strips_ansi(fileobj)
+        if strip:
+            msg = text_metrics.strip_ansi(msg)
         fileobj.write(msg)
 
+    def _strips_ansi(self, stream: IO) -> bool:
+        """Return whether ANSI escape sequences are stripped from what is written to a stream and remember it"""
+        colors = self.colors.lower()
+        strip = colors == constants.COLORS_NEVER.lower() or \
+            (colors == constants.COLORS_TERMINAL.lower() and not self._isatty(stream))
+
+        # Whether a ThreadLocalStream is a tty depends on the thread writing to it
+        if not isinstance(stream, utils.ThreadLocalStream):
+            streams = self._strip_ansi_streams
+            if len(streams) >= self._MAX_STRIP_ANSI_STREAMS:
+                streams = self._strip_ansi_streams = {}
+            try:
+                streams[stream] = strip
+            except TypeError:
+                # The stream isn't hashable
+                pass
+        return strip
+
+    def _isatty(self, stream: IO) -> bool:
+        """Return whether a stream is a tty, reusing the answer run_batch() found for its output stream"""
+        if stream is self._batch_stdout:
+            return self._batch_stdout_isatty
+        return stream.isatty()
+
     def poutput(self, msg: Any, end: str = '\n', color: str = '') -> None:
         """Smarter self.stdout.write(); color aware and adds newline of not present.
 
@@ -603,7 +836,7 @@ class Cmd(cmd.Cmd):
         """
         if msg is not None and msg != '':
             try:
-                msg_str = '{}'.format(msg)
+                msg_str = msg if type(msg) is str else '{}'.format(msg)
                 if not msg_str.endswith(end):
                     msg_str += end
                 if color:
@@ -618,6 +851,108 @@ class Cmd(cmd.Cmd):
                 if self.broken_pipe_warning:
                     sys.stderr.write(self.broken_pipe_warning)
 
+    def poutput_many(self, msgs: Iterable[Any], end: str = '\n', color: str = '') -> None:
+        """Write many messages to self.stdout, each the way poutput() would write it.
+
+        The messages are joined into blocks which are each written at once, so this is much faster than calling
+        poutput() for every row of a large listing. The iterable is consumed a block at a time, so it can be a
+        generator producing more rows than fit in memory.
+
+        :param msgs: messages to print (anything convertible to a str with '{}'.format() is OK). None and empty
+                     messages are skipped like poutput() skips them.
+        :param end: (optional) string appended after the end of each message if not already present, default a newline
+        :param color: (optional) color escape to output each message with
+        """
+        rows = iter(msgs)
+        try:
+            while True:
+                block = []
+                count = 0
+                for msg in itertools.islice(rows, self._POUTPUT_MANY_BLOCK_ROWS):
+                    count += 1
+                    if msg is None or msg == '':
+                        continue
+                    msg_str = msg if type(msg) is str else '{}'.format(msg)
+                    if not msg_str.endswith(end):
+                        msg_str += end
+                    if color:
+                        msg_str = color + msg_str + Fore.RESET
+                    block.append(msg_str)
+                if block:
+                    self.decolorized_write(self.stdout, ''.join(block))
+                if count < self._POUTPUT_MANY_BLOCK_ROWS:
+                    break
+        except BrokenPipeError:
+            if self.broken_pipe_warning:
+                sys.stderr.write(self.broken_pipe_warning)
+
+    @contextlib.contextmanager
+    def buffered_output(self, block_size: int = 65536) -> Generator[TextIO, None, None]:
+        """Context manager which collects what is written to self.stdout and writes it in large blocks.
+
+        Many small writes to a terminal or pipe cost a system call each. Inside the with block, output is written
+        once at least block_size characters have been collected, when self.stdout.flush() is called, before a
+        subprocess writes to stdout, and when the block ends. Output which is already being collected this way,
+        like in run_batch() with output_block_size, is left as it is.
+
+        Example:
+            with self.buffered_output():
+                for row in rows:
+                    self.poutput(row)
+
+        :param block_size: the number of characters to collect before writing them
+        :return: the stream collecting the output
+        """
+        saved_stdout = self.stdout
+        if isinstance(saved_stdout, utils.BlockWriter):
+            yield saved_stdout
+            return
+
+        saved_sys_stdout = utils.thread_stream(sys.stdout)
+        writer = utils.BlockWriter(saved_stdout, block_size)
+
+        # Output printed by commands goes in the same blocks
+        self._set_stdout(writer, writer if saved_sys_stdout is saved_stdout else saved_sys_stdout)
+        try:
+            yield writer
+        finally:
+            try:
+                writer.flush()
+            finally:
+                self._set_stdout(saved_stdout, saved_sys_stdout)
+
+    def poutput_bytes(self, data: bytes) -> None:
+        """Write bytes to the binary buffer of self.stdout without converting them to text.
+
+        The bytes go as they are to the terminal, the file or pipe output was redirected to, or a StdSim,
+        without passing through the text layer. No newline or color is added. This suits large output and
+        output which is already encoded, which poutput() would otherwise have to decode and the stream encode again.
+
+        Also handles BrokenPipeError exceptions the same way poutput() does.
+
+        :param data: bytes to write
+        """
+        if not data:
+            return
+        try:
+            stream = self.stdout
+            buffer = getattr(stream, 'buffer', None)
+            if buffer is None:
+                # The stream only takes text, like an io.StringIO
+                stream.write(data.decode(getattr(stream, 'encoding', None) or 'utf-8', errors='replace'))
+                return
+
+            # Text already written has to reach the buffer first to keep output in order
+            stream.flush()
+            buffer.write(data)
+
+            # Show output on a terminal right away. A StdSim's buffer already flushes what it echoes.
+            if not isinstance(stream, utils.StdSim) and getattr(stream, 'line_buffering', False):
+                buffer.flush()
+        except BrokenPipeError:
+            if self.broken_pipe_warning:
+                sys.stderr.write(self.broken_pipe_warning)
+
     def perror(self, err: Union[str, Exception], traceback_war: bool = True, err_color: str = Fore.LIGHTRED_EX,
                war_color: str = Fore.LIGHTYELLOW_EX) -> None:
         """ Print error message to sys.stderr and if debug is true, print an exception Traceback if one exists.
@@ -687,7 +1022,7 @@ class Cmd(cmd.Cmd):
                 # Also only attempt to use a pager if actually running in a real fully functional terminal
                 if functional_terminal and not self.redirecting and not self._in_py and not self._script_dir:
                     if self.colors.lower() == constants.COLORS_NEVER.lower():
-                        msg_str = utils.strip_ansi(msg_str)
+                        msg_str = text_metrics.strip_ansi(msg_str)
 
                     pager = self.pager
                     if chop:
@@ -1258,7 +1593,10 @@ class Cmd(cmd.Cmd):
                     return []
 
         # Call the command's completer function
-        return compfunc(text, line, begidx, endidx)
+        matches = compfunc(text, line, begidx, endidx)
+        if inspect.isawaitable(matches):
+            matches = self.run_coroutine(matches)
+        return matches
 
     @staticmethod
     def _pad_matches_to_display(matches_to_display: List[str]) -> Tuple[List[str], int]:  # pragma: no cover
@@ -1298,12 +1636,7 @@ class Cmd(cmd.Cmd):
                 matches_to_display = self.display_matches
 
                 # Recalculate longest_match_length for display_matches
-                longest_match_length = 0
-
-                for cur_match in matches_to_display:
-                    cur_length = utils.ansi_safe_wcswidth(cur_match)
-                    if cur_length > longest_match_length:
-                        longest_match_length = cur_length
+                longest_match_length = text_metrics.max_width(matches_to_display)
             else:
                 matches_to_display = matches
 
@@ -1468,16 +1801,16 @@ class Cmd(cmd.Cmd):
                         begidx = actual_begidx
 
                 # Check if a valid command was entered
-                if command in self.get_all_commands():
+                command_info = self._commands.get(command)
+                if command_info is not None:
                     # Get the completer function for this command
-                    compfunc = getattr(self, 'complete_' + command, None)
+                    compfunc = command_info.completer
 
                     if compfunc is None:
                         # There's no completer function, next see if the command uses argparser
-                        func = self.cmd_func(command)
-                        if func and hasattr(func, 'argparser'):
+                        if command_info.argparser is not None:
                             compfunc = functools.partial(self._autocomplete_default,
-                                                         argparser=getattr(func, 'argparser'))
+                                                         argparser=command_info.argparser)
                         else:
                             compfunc = self.completedefault
 
@@ -1594,24 +1927,13 @@ class Cmd(cmd.Cmd):
 
     def get_all_commands(self) -> List[str]:
         """Returns a list of all commands."""
-        return [name[len(COMMAND_FUNC_PREFIX):] for name in self.get_names()
-                if name.startswith(COMMAND_FUNC_PREFIX) and callable(getattr(self, name))]
+        return list(self._commands)
 
     def get_visible_commands(self) -> List[str]:
         """Returns a list of commands that have not been hidden or disabled."""
-        commands = self.get_all_commands()
-
-        # Remove the hidden commands
-        for name in self.hidden_commands:
-            if name in commands:
-                commands.remove(name)
-
-        # Remove the disabled commands
-        for name in self.disabled_commands:
-            if name in commands:
-                commands.remove(name)
-
-        return commands
+        hidden_commands = set(self.hidden_commands)
+        return [command for command in self._commands
+                if command not in hidden_commands and command not in self.disabled_commands]
 
     def get_alias_names(self) -> List[str]:
         """Return list of current alias names"""
@@ -1634,8 +1956,9 @@ class Cmd(cmd.Cmd):
 
     def get_help_topics(self) -> List[str]:
         """ Returns a list of help topics """
-        return [name[len(HELP_FUNC_PREFIX):] for name in self.get_names()
-                if name.startswith(HELP_FUNC_PREFIX) and callable(getattr(self, name))]
+        # Building the command registry also finds the help topics
+        _ = self._commands
+        return list(self._help_topics)
 
     # noinspection PyUnusedLocal
     def sigint_handler(self, signum: int, frame) -> None:
@@ -1675,16 +1998,23 @@ class Cmd(cmd.Cmd):
         statement = self.statement_parser.parse_command_only(line)
         return statement.command, statement.args, statement.command_and_args
 
-    def onecmd_plus_hooks(self, line: str, pyscript_bridge_call: bool = False) -> bool:
+    def onecmd_plus_hooks(self, line: Union[Statement, str], pyscript_bridge_call: bool = False) -> bool:
         """Top-level function called by cmdloop() to handle parsing a line and running the command and all of its hooks.
 
-        :param line: line of text read from input
+        :param line: line of text read from input, or a complete Statement which was already parsed
         :param pyscript_bridge_call: This should only ever be set to True by PyscriptBridge to signify the beginning
                                      of an app() call in a pyscript. It is used to enable/disable the storage of the
                                      command's stdout.
         :return: True if cmdloop() should exit, False otherwise
         """
-        import datetime
+        # Handle background jobs which finished before this command, so scripts and batches report them too.
+        # Commands run by a job's thread leave this to the thread which started the job.
+        if self.job_table and (self._job_stdout is None or self._job_stdout.stream is None):
+            self._reap_jobs()
+
+        # Times the phases of this command when latency statistics are being collected
+        timer = stats.CommandTimer() if self.collect_stats else None
+        error = False
 
         stop = False
         try:
@@ -1696,113 +2026,174 @@ class Cmd(cmd.Cmd):
             self.perror("Invalid syntax: {}".format(ex), traceback_war=False)
             return stop
 
+        if timer is not None:
+            timer.mark(stats.PHASE_PARSE)
+
+        # A thread-safe command ending with & runs as a background job
+        if constants.BACKGROUND_CHAR in statement.raw:
+            background_statement = self._background_statement(statement)
+            if background_statement is not None:
+                return self._start_job(statement, background_statement)
+
         # now that we have a statement, run it with all the hooks
         try:
             # call the postparsing hooks
-            data = plugin.PostparsingData(False, statement)
-            for func in self._postparsing_hooks:
-                data = func(data)
-                if data.stop:
-                    break
-            # unpack the data object
-            statement = data.statement
-            stop = data.stop
-            if stop:
-                # we should not run the command, but
-                # we need to run the finalization hooks
-                raise EmptyStatement
-
-            # Keep track of whether or not we were already redirecting before this command
-            already_redirecting = self.redirecting
+            if self._postparsing_hook_chain is not None:
+                data = self._postparsing_hook_chain(plugin.PostparsingData(False, statement))
+                # unpack the data object
+                statement = data.statement
+                stop = data.stop
+                if timer is not None:
+                    timer.mark(stats.PHASE_POSTPARSING)
+                if stop:
+                    # we should not run the command, but
+                    # we need to run the finalization hooks
+                    raise EmptyStatement
+
+            if pyscript_bridge_call or (self.allow_redirection and (statement.pipe_to or statement.output)):
+                # Keep track of whether or not we were already redirecting before this command
+                already_redirecting = self.redirecting
+
+                # This will be a utils.RedirectionSavedState object for the command
+                saved_state = None
 
-            # This will be a utils.RedirectionSavedState object for the command
-            saved_state = None
-
-            try:
-                # Get sigint protection while we set up redirection
-                with self.sigint_protection:
-                    if pyscript_bridge_call:
-                        # Start saving command's stdout at this point
-                        self.stdout.pause_storage = False
-
-                    redir_error, saved_state = self._redirect_output(statement)
-                    self.cur_pipe_proc_reader = saved_state.pipe_proc_reader
-
-                # Do not continue if an error occurred while trying to redirect
-                if not redir_error:
-                    # See if we need to update self.redirecting
-                    if not already_redirecting:
-                        self.redirecting = saved_state.redirecting
-
-                    timestart = datetime.datetime.now()
-
-                    # precommand hooks
-                    data = plugin.PrecommandData(statement)
-                    for func in self._precmd_hooks:
-                        data = func(data)
-                    statement = data.statement
-
-                    # call precmd() for compatibility with cmd.Cmd
-                    statement = self.precmd(statement)
+                try:
+                    # Get sigint protection while we set up redirection
+                    with self.sigint_protection:
+                        if pyscript_bridge_call:
+                            # Start saving command's stdout at this point
+                            self.stdout.pause_storage = False
 
-                    # go run the command function
-                    stop = self.onecmd(statement)
+                        redir_error, saved_state = self._redirect_output(statement)
+                        self.cur_pipe_proc_reader = saved_state.pipe_proc_reader
 
-                    # postcommand hooks
-                    data = plugin.PostcommandData(stop, statement)
-                    for func in self._postcmd_hooks:
-                        data = func(data)
+                    if timer is not None:
+                        timer.mark(stats.PHASE_REDIRECTION)
 
-                    # retrieve the final value of stop, ignoring any statement modification from the hooks
-                    stop = data.stop
+                    # Do not continue if an error occurred while trying to redirect
+                    if redir_error:
+                        error = True
+                    else:
+                        # See if we need to update self.redirecting
+                        if not already_redirecting:
+                            self.redirecting = saved_state.redirecting
 
-                    # call postcmd() for compatibility with cmd.Cmd
-                    stop = self.postcmd(stop, statement)
+                        stop, statement = self._run_command(statement, timer)
+                finally:
+                    # Get sigint protection while we restore stuff
+                    with self.sigint_protection:
+                        if saved_state is not None:
+                            self._restore_output(statement, saved_state)
 
-                    if self.timing:
-                        self.pfeedback('Elapsed: {}'.format(datetime.datetime.now() - timestart))
-            finally:
-                # Get sigint protection while we restore stuff
-                with self.sigint_protection:
-                    if saved_state is not None:
-                        self._restore_output(statement, saved_state)
+                        if not already_redirecting:
+                            self.redirecting = False
 
-                    if not already_redirecting:
-                        self.redirecting = False
+                        if pyscript_bridge_call:
+                            # Stop saving command's stdout before command finalization hooks run
+                            self.stdout.pause_storage = True
 
-                    if pyscript_bridge_call:
-                        # Stop saving command's stdout before command finalization hooks run
-                        self.stdout.pause_storage = True
+                    if timer is not None:
+                        timer.mark(stats.PHASE_REDIRECTION)
+            else:
+                # Nothing needs redirecting, so skip saving and restoring the output streams. The command
+                # still runs without the pipe process of any command which is running it.
+                saved_pipe_proc_reader = self.cur_pipe_proc_reader
+                self.cur_pipe_proc_reader = None
+                try:
+                    stop, statement = self._run_command(statement, timer)
+                finally:
+                    self.cur_pipe_proc_reader = saved_pipe_proc_reader
 
         except EmptyStatement:
             # don't do anything, but do allow command finalization hooks to run
             pass
         except Exception as ex:
+            error = True
             self.perror(ex)
         finally:
-            return self._run_cmdfinalization_hooks(stop, statement)
+            stop = self._run_cmdfinalization_hooks(stop, statement)
+            if timer is not None:
+                timer.mark(stats.PHASE_FINALIZATION)
+                self.command_stats.record(statement.command, timer, error)
+            return stop
+
+    def _run_command(self, statement: Statement, timer: Optional[stats.CommandTimer] = None,
+                     add_to_history: bool = True) -> Tuple[bool, Statement]:
+        """Run a command once its output has been redirected, along with its precommand and postcommand hooks
+
+        :param statement: the statement being run
+        :param timer: if not None, the phases of the command are timed with this
+        :param add_to_history: if False, the command isn't added to history because the caller already added it
+        :return: True if cmdloop() should exit and the statement as modified by the precommand hooks and precmd()
+        """
+        timestart = datetime.datetime.now()
+
+        # precommand hooks
+        if self._precmd_hook_chain is not None:
+            statement = self._precmd_hook_chain(plugin.PrecommandData(statement)).statement
+
+        # call precmd() for compatibility with cmd.Cmd
+        statement = self.precmd(statement)
+        if timer is not None:
+            timer.mark(stats.PHASE_PRECMD)
+
+        # go run the command function
+        try:
+            if add_to_history:
+                stop = self.onecmd(statement)
+            else:
+                stop = self.onecmd(statement, add_to_history=False)
+        finally:
+            if timer is not None:
+                timer.mark(stats.PHASE_COMMAND)
+
+        # postcommand hooks
+        if self._postcmd_hook_chain is not None:
+            # retrieve the final value of stop, ignoring any statement modification from the hooks
+            stop = self._postcmd_hook_chain(plugin.PostcommandData(stop, statement)).stop
+
+        # call postcmd() for compatibility with cmd.Cmd
+        stop = self.postcmd(stop, statement)
+        if timer is not None:
+            timer.mark(stats.PHASE_POSTCMD)
+
+        if self.timing:
+            self.pfeedback('Elapsed: {}'.format(datetime.datetime.now() - timestart))
+        return stop, statement
 
     def _run_cmdfinalization_hooks(self, stop: bool, statement: Optional[Statement]) -> bool:
         """Run the command finalization hooks"""
 
-        with self.sigint_protection:
-            if not sys.platform.startswith('win') and self.stdout.isatty():
+        if not sys.platform.startswith('win') and self._isatty(self.stdout):
+            with self.sigint_protection:
                 # Before the next command runs, fix any terminal problems like those
                 # caused by certain binary characters having been printed to it.
-                import subprocess
-                proc = subprocess.Popen(['stty', 'sane'])
-                proc.communicate()
+                self._restore_terminal()
+
+        if self._cmdfinalization_hook_chain is None:
+            return stop
 
         try:
-            data = plugin.CommandFinalizationData(stop, statement)
-            for func in self._cmdfinalization_hooks:
-                data = func(data)
+            data = self._cmdfinalization_hook_chain(plugin.CommandFinalizationData(stop, statement))
             # retrieve the final value of stop, ignoring any
             # modifications to the statement
             return data.stop
         except Exception as ex:
             self.perror(ex)
 
+    def _restore_terminal(self) -> None:
+        """Restore the terminal's settings according to self.terminal_restore"""
+        if self.terminal_restore == constants.TERMINAL_RESTORE_NEVER:
+            return
+
+        if self.terminal_restore == constants.TERMINAL_RESTORE_TERMIOS and self._terminal_state is not None:
+            if self._terminal_state.restore():
+                return
+
+        import subprocess
+        proc = subprocess.Popen(['stty', 'sane'])
+        proc.communicate()
+
     def runcmds_plus_hooks(self, cmds: List[str]) -> bool:
         """Convenience method to run multiple commands by onecmd_plus_hooks.
 
@@ -1826,10 +2217,14 @@ class Cmd(cmd.Cmd):
 
         """
         stop = False
-        self.cmdqueue = list(cmds) + self.cmdqueue
+        # Multiline commands are completed from the commands which follow them
+        parsed_cmds = self.statement_parser.parse_many(list(cmds), keep_empty=True)
+        self._push_command_source(parsed.line for parsed in parsed_cmds)
         try:
-            while self.cmdqueue and not stop:
-                line = self.cmdqueue.pop(0)
+            while not stop:
+                line = self._next_queued_command()
+                if line is None:
+                    break
                 if self.echo and line != 'eos':
                     self.poutput('{}{}'.format(self.prompt, line))
 
@@ -1837,22 +2232,536 @@ class Cmd(cmd.Cmd):
         finally:
             # Clear out the command queue and script directory stack, just in
             # case we hit an error and they were not completed.
-            self.cmdqueue = []
-            self._script_dir = []
+            self._clear_command_queue()
             # NOTE: placing this return here inside the finally block will
             # swallow exceptions. This is consistent with what is done in
             # onecmd_plus_hooks and _cmdloop, although it may not be
             # necessary/desired here.
             return stop
 
-    def _complete_statement(self, line: str) -> Statement:
+    def run_batch(self, stream: Optional[TextIO] = None, *, output_block_size: int = 0) -> bool:
+        """Run commands read from a stream until it ends or a command stops the application.
+
+        This is a faster alternative to cmdloop() for input piped from another program. Prompts aren't printed,
+        the stream is read in chunks, and whether stdout is a tty is checked once instead of after every
+        command. Each command is run by onecmd_plus_hooks(), so hooks and error handling are the same as in
+        cmdloop(). Multiline commands are completed from the lines that follow them, commands queued by load
+        run before the next line is read, and eof runs when the stream ends.
+
+        Since the stream is read ahead, commands which read from it themselves won't see the lines following them.
+
+        Example: app.run_batch(open('commands.txt'))
+
+        :param stream: the stream to read commands from. Defaults to the stream cmdloop() would read.
+        :param output_block_size: if greater than 0, write self.stdout in blocks of at least this many characters
+                                  instead of as each command writes it. A block is also written before a
+                                  subprocess writes to stdout and when the batch ends.
+        :return: True implies the entire application should exit.
+        """
+        if stream is None:
+            stream = sys.stdin if self.use_rawinput else self.stdin
+
+        saved_stdout = self.stdout
+        saved_sys_stdout = sys.stdout
+        if output_block_size > 0:
+            self.stdout = utils.BlockWriter(saved_stdout, output_block_size)
+            # Output printed by commands goes in the same blocks
+            if saved_stdout is sys.stdout:
+                sys.stdout = self.stdout
+
+        self._batch_stdout = self.stdout
+        self._batch_stdout_isatty = saved_stdout.isatty()
+        self._batch_lines = utils.read_stream_lines(stream)
+
+        stop = False
+        try:
+            while not stop:
+                line = self._next_queued_command()
+                if line is None:
+                    try:
+                        line = next(self._batch_lines, None)
+                    except KeyboardInterrupt as ex:
+                        if self.quit_on_sigint:
+                            raise ex
+                        else:
+                            self.poutput('^C')
+                            line = ''
+
+                    if line is None:
+                        # The stream has ended
+                        self.onecmd_plus_hooks('eof')
+                        stop = True
+                        break
+                    line = line.strip()
+
+                if self.echo and line != 'eos':
+                    self.poutput('{}{}'.format(self.prompt, line))
+
+                stop = self.onecmd_plus_hooks(line)
+        finally:
+            self._batch_lines = None
+            self._batch_stdout = None
+            if output_block_size > 0:
+                self.stdout.flush()
+                self.stdout = saved_stdout
+                sys.stdout = saved_sys_stdout
+            self._clear_command_queue()
+
+        return stop
+
+    def run_parallel(self, cmds: Iterable[str], *, max_workers: Optional[int] = None, ordered: bool = True) -> bool:
+        """Run commands at the same time on a pool of threads.
+
+        Every command must be marked with the @thread_safe decorator and can't redirect its output. If any can't
+        be run in parallel, none of them run. The commands are parsed, their postparsing hooks run, and they are
+        added to history in the order given before any of them starts. Precommand and postcommand hooks run in
+        the command's thread. Each command's stdout and stderr are captured separately and written when it
+        finishes, followed by running its command finalization hooks.
+
+        Example: app.run_parallel(['status host1', 'status host2'], max_workers=2)
+
+        :param cmds: the command lines to run
+        :param max_workers: the most commands to run at once. Defaults to the concurrent.futures default.
+        :param ordered: if True, write the output of the commands in the order they were given. Otherwise write
+                        each command's output as soon as it finishes.
+        :return: True if any command returned True to stop the application
+        """
+        statements = []
+        errors = []
+        for line in cmds:
+            try:
+                statement = self.statement_parser.parse(line)
+            except ValueError as ex:
+                errors.append('Invalid syntax in {!r}: {}'.format(line, ex))
+                continue
+            if statement.command:
+                error = self._parallel_error(statement)
+                if error:
+                    errors.append(error)
+                else:
+                    statements.append(statement)
+
+        if errors:
+            for error in errors:
+                self.perror(error, traceback_war=False)
+            return False
+
+        # Postparsing hooks and history happen in order before anything runs
+        stop = False
+        to_run = []
+        for statement in statements:
+            try:
+                if self._postparsing_hook_chain is not None:
+                    data = self._postparsing_hook_chain(plugin.PostparsingData(False, statement))
+                    statement = data.statement
+                    if data.stop:
+                        stop = self._run_cmdfinalization_hooks(True, statement) or stop
+                        continue
+
+                # A postparsing hook could have changed the command
+                error = self._parallel_error(statement)
+                if error:
+                    raise ValueError(error)
+            except Exception as ex:
+                self.perror(ex)
+                stop = self._run_cmdfinalization_hooks(False, statement) or stop
+                continue
+
+            if statement.command not in self.exclude_from_history \
+                    and statement.command not in self.disabled_commands:
+                self.history.append(statement)
+            to_run.append(statement)
+
+        if not to_run:
+            return stop
+
+        # Each thread's output is sent to streams of its own while the commands run
+        saved_stdout = self.stdout
+        saved_sys_stdout = sys.stdout
+        saved_sys_stderr = sys.stderr
+        stdout_router = utils.ThreadLocalStream(saved_stdout)
+        sys_stdout_router = stdout_router if saved_sys_stdout is saved_stdout \
+            else utils.ThreadLocalStream(saved_sys_stdout)
+        sys_stderr_router = utils.ThreadLocalStream(saved_sys_stderr)
+
+        def run(statement_to_run: Statement) -> Tuple[bool, str, str]:
+            """Run one command in a worker thread and return its stop flag and output"""
+            out = utils.StdSim(saved_stdout)
+            err = utils.StdSim(saved_sys_stderr)
+            stdout_router.set_stream(out)
+            sys_stdout_router.set_stream(out)
+            sys_stderr_router.set_stream(err)
+            try:
+                try:
+                    cmd_stop, _ = self._run_command(statement_to_run, add_to_history=False)
+                except Exception as run_ex:
+                    cmd_stop = False
+                    self.perror(run_ex)
+                return cmd_stop, out.getvalue(), err.getvalue()
+            finally:
+                stdout_router.set_stream(None)
+                sys_stdout_router.set_stream(None)
+                sys_stderr_router.set_stream(None)
+
+        import concurrent.futures
+        self.stdout = stdout_router
+        sys.stdout = sys_stdout_router
+        sys.stderr = sys_stderr_router
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(run, statement) for statement in to_run]
+                future_statements = dict(zip(futures, to_run))
+                try:
+                    for future in futures if ordered else concurrent.futures.as_completed(futures):
+                        cmd_stop, out, err = future.result()
+                        if out:
+                            saved_stdout.write(out)
+                        if err:
+                            saved_sys_stderr.write(err)
+                        stop = self._run_cmdfinalization_hooks(cmd_stop, future_statements[future]) or stop
+                except BaseException:
+                    # Don't start commands which are still waiting
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            self.stdout = saved_stdout
+            sys.stdout = saved_sys_stdout
+            sys.stderr = saved_sys_stderr
+
+        return stop
+
+    def _parallel_error(self, statement: Statement) -> Optional[str]:
+        """Return why a statement can't be run by run_parallel() or None if it can"""
+        if statement.multiline_command and not statement.terminator:
+            return '{!r} is an unfinished multiline command'.format(statement.raw)
+        if statement.pipe_to or statement.output:
+            return "{!r} redirects its output, which commands run in parallel can't do".format(statement.raw)
+        return self._thread_safe_error(statement)
+
+    def _thread_safe_error(self, statement: Statement) -> Optional[str]:
+        """Return why a statement's command can't run outside of the main thread or None if it can"""
+        func = self.cmd_func(statement.command)
+        if not getattr(func, THREAD_SAFE, False):
+            return "{!r} isn't a thread-safe command".format(statement.command)
+        if inspect.iscoroutinefunction(inspect.unwrap(func)):
+            return "{!r} is an async command, which runs on the event loop instead of in another thread".format(
+                statement.command)
+        return None
+
+    def _background_statement(self, statement: Statement) -> Optional[Statement]:
+        """
+        If a statement ends with an unquoted &, and its command is thread-safe, return the statement without
+        the &. Otherwise return None, and the & is an ordinary argument, like for the shell command.
+        """
+        line = statement.raw.rstrip()
+        if not line.endswith(constants.BACKGROUND_CHAR):
+            return None
+        tokens, _ = self.statement_parser.lex(line)
+        if tokens[-1] != constants.BACKGROUND_CHAR:
+            return None
+        line = line[:-len(constants.BACKGROUND_CHAR)].rstrip()
+        background_statement = self.statement_parser.parse(line)
+        if not getattr(self.cmd_func(background_statement.command), THREAD_SAFE, False):
+            return None
+        return background_statement
+
+    def _start_job(self, statement: Statement, background_statement: Statement) -> bool:
+        """
+        Start running a command as a background job. Its postparsing hooks run and it is added to history
+        before it starts. Its command finalization hooks run once it has finished and the main thread notices.
+
+        :param statement: the statement which was entered, including the &
+        :param background_statement: the statement to run, without the &
+        :return: True if cmdloop() should exit
+        """
+        try:
+            if self._postparsing_hook_chain is not None:
+                data = self._postparsing_hook_chain(plugin.PostparsingData(False, background_statement))
+                background_statement = data.statement
+                if data.stop:
+                    return self._run_cmdfinalization_hooks(True, background_statement)
+        except Exception as ex:
+            self.perror(ex)
+            return self._run_cmdfinalization_hooks(False, background_statement)
+
+        error = self._job_error(background_statement)
+        if not error:
+            if background_statement.output_to:
+                # Compressed the same way as output redirected in the foreground
+                append = background_statement.output == constants.REDIRECTION_APPEND
+                try:
+                    stdout = utils.open_output_file(background_statement.output_to, append,
+                                                    self.redirect_compress_level)
+                except (OSError, ValueError) as ex:
+                    error = 'Failed to redirect because - {}'.format(ex)
+            else:
+                stdout = utils.StdSim(self.stdout)
+
+        if error:
+            self.perror(error, traceback_war=False)
+            return self._run_cmdfinalization_hooks(False, background_statement)
+
+        if statement.command not in self.exclude_from_history and statement.command not in self.disabled_commands:
+            self.history.append(statement)
+
+        if self._job_stdout is None:
+            self._job_stdout = jobs.JobStdout()
+        job = self.job_table.add(background_statement, stdout, utils.StdSim(sys.stderr))
+        job.thread = threading.Thread(target=self._run_job,
+                                      args=(job, self._job_stdout, self._install_job_streams()),
+                                      name='cmd2 job {}'.format(job.id))
+        job.thread.daemon = True
+        job.thread.start()
+        self.pfeedback('[{}] {}'.format(job.id, job.command_line))
+        return False
+
+    def _job_error(self, statement: Statement) -> Optional[str]:
+        """Return why a statement can't be run as a background job or None if it can"""
+        if self.redirecting or self._in_py:
+            return "Background jobs can't be started while output is redirected or from a pyscript"
+        if statement.pipe_to:
+            return "{!r} pipes its output, which background jobs can't do".format(statement.raw)
+        if statement.output and not statement.output_to:
+            return "{!r} redirects to the paste buffer, which background jobs can't do".format(statement.raw)
+        return self._thread_safe_error(statement)
+
+    def _install_job_streams(self) -> Tuple[utils.ThreadLocalStream, utils.ThreadLocalStream]:
+        """Replace sys.stdout and sys.stderr with streams which route background jobs' output and return them"""
+        if not self._job_streams_installed():
+            self._job_streams = (utils.ThreadLocalStream(sys.stdout), utils.ThreadLocalStream(sys.stderr))
+            sys.stdout, sys.stderr = self._job_streams
+        return self._job_streams
+
+    def _job_streams_installed(self) -> bool:
+        """Return whether the streams which route background jobs' output are still sys.stdout and sys.stderr"""
+        return self._job_streams is not None and (sys.stdout, sys.stderr) == self._job_streams
+
+    def _remove_job_streams(self) -> None:
+        """Put back the streams _install_job_streams() replaced once no background jobs or pipe filters are running"""
+        if self.job_table.running() or self._running_pipelines:
+            return
+        self._job_stdout = None
+        if self._job_streams is None:
+            return
+
+        # Leave the streams alone if they've been replaced or this thread is redirecting its output.
+        # They are removed after a later command.
+        sys_stdout_router, sys_stderr_router = self._job_streams
+        if self._job_streams_installed() and not sys_stdout_router.routed:
+            sys.stdout = sys_stdout_router.default_stream
+            sys.stderr = sys_stderr_router.default_stream
+            self._job_streams = None
+
+    @property
+    def stdout(self) -> TextIO:
+        """The stream commands write output to. Each background job has a stream of its own."""
+        if self._job_stdout is None:
+            return self._stdout
+        stream = self._job_stdout.stream
+        return self._stdout if stream is None else stream
+
+    @stdout.setter
+    def stdout(self, stream: TextIO) -> None:
+        # The stream whose tty status decided whether decolorized_write() strips ANSI escape sequences may be gone
+        self._strip_ansi_streams = {}
+        if self._job_stdout is None or self._job_stdout.stream is None:
+            self._stdout = stream
+        else:
+            self._job_stdout.stream = stream
+
+    @property
+    def stdin(self) -> TextIO:
+        """The stream commands read input from. A filter command reads the output piped to it from here."""
+        if self._pipe_stdin is None:
+            return self._stdin
+        stream = self._pipe_stdin.stream
+        return self._stdin if stream is None else stream
+
+    @stdin.setter
+    def stdin(self, stream: TextIO) -> None:
+        self._stdin = stream
+
+    def _run_job(self, job: jobs.Job, job_stdout: jobs.JobStdout,
+                 streams: Tuple[utils.ThreadLocalStream, utils.ThreadLocalStream]) -> None:
+        """Run a background job's command. This runs in the job's thread."""
+        sys_stdout_router, sys_stderr_router = streams
+        stop = False
+        try:
+            job_stdout.stream = job.stdout
+            sys_stdout_router.set_stream(job.stdout)
+            sys_stderr_router.set_stream(job.stderr)
+            try:
+                stop, _ = self._run_command(job.statement, add_to_history=False)
+                status = jobs.JOB_DONE
+            except Exception as ex:
+                self.perror(ex)
+                status = jobs.JOB_FAILED
+        except KeyboardInterrupt:
+            # The job was killed
+            status = jobs.JOB_KILLED
+
+        job.finish(status, stop)
+        job_stdout.stream = None
+        sys_stdout_router.set_stream(None)
+        sys_stderr_router.set_stream(None)
+
+        # Alert the user if they are sitting at the prompt. Otherwise the notice is printed before the next prompt.
+        if vt100_support and self.use_rawinput and self.terminal_lock.acquire(blocking=False):
+            try:
+                self.async_alert(str(job))
+                job.notified = True
+            finally:
+                self.terminal_lock.release()
+
+    def _reap_jobs(self) -> None:
+        """
+        Handle background jobs which have finished. Notices are printed for jobs the user hasn't been alerted
+        about, the jobs' command finalization hooks run, and jobs without output waiting for fg are removed.
+        """
+        for job in self.job_table:
+            if job.running or job.reaped:
+                continue
+            job.reaped = True
+            if not job.notified:
+                job.notified = True
+                self.pfeedback(str(job))
+
+            # A background command can't stop the application
+            self._run_cmdfinalization_hooks(job.stop, job.statement)
+            if not job.has_output():
+                self.job_table.remove(job.id)
+
+        self._remove_job_streams()
+
+    def get_job_ids(self) -> List[str]:
+        """Return the numbers of the background jobs"""
+        return [str(job.id) for job in self.job_table]
+
+    def _get_jobs(self, job_ids: Iterable[int]) -> Optional[List[jobs.Job]]:
+        """Look up jobs by number. If any don't exist, print an error and return None."""
+        job_list = []
+        for job_id in job_ids:
+            job = self.job_table.get(job_id)
+            if job is None:
+                self.perror('No such job: {}'.format(job_id), traceback_war=False)
+                return None
+            job_list.append(job)
+        return job_list
+
+    @property
+    def event_loop(self):
+        """The asyncio event loop which runs async commands and completers.
+
+        It is created the first time it's needed and stays open between commands, so objects bound to it, like
+        connection pools, can be reused by later commands. cmdloop() closes it when it exits.
+        """
+        if self._event_loop is None or self._event_loop.is_closed():
+            import asyncio
+            self._event_loop = asyncio.new_event_loop()
+            self._event_loop_thread = threading.current_thread()
+        return self._event_loop
+
+    def run_coroutine(self, coro) -> Any:
+        """Run a coroutine or other awaitable on the application's event loop and return its result.
+
+        If the awaitable is interrupted, for instance by Ctrl-C, it is cancelled before the exception is raised.
+
+        :param coro: the coroutine to run
+        :return: the coroutine's result
+        :raises RuntimeError: if the event loop is already running, like when called from inside an async command,
+                              or if called from a thread other than the one which created the event loop
+        """
+        import asyncio
+        loop = self.event_loop
+        error = None
+        if loop.is_running():
+            error = "The event loop is already running. Use 'await' to run coroutines from async code."
+        elif threading.current_thread() is not self._event_loop_thread:
+            error = 'Coroutines can only run in the thread which created the event loop'
+        if error is not None:
+            if inspect.iscoroutine(coro):
+                # Prevent a warning that the coroutine was never awaited
+                coro.close()
+            raise RuntimeError(error)
+
+        task = asyncio.ensure_future(coro, loop=loop)
+        try:
+            return loop.run_until_complete(task)
+        except BaseException:
+            if not task.done():
+                task.cancel()
+                try:
+                    loop.run_until_complete(task)
+                except (asyncio.CancelledError, Exception):
+                    pass
+            raise
+
+    def close_event_loop(self) -> None:
+        """Close the event loop which runs async commands. A new one is created if another async command runs."""
+        if self._event_loop is not None and not self._event_loop.is_closed():
+            # Asynchronous generators and shutdown_asyncgens() were added in Python 3.6
+            if hasattr(self._event_loop, 'shutdown_asyncgens'):
+                self._event_loop.run_until_complete(self._event_loop.shutdown_asyncgens())
+            self._event_loop.close()
+        self._event_loop = None
+        self._event_loop_thread = None
+
+    def _push_command_source(self, source: Iterable[str]) -> None:
+        """Queue an iterable of commands to run before anything already queued.
+
+        The iterable is consumed one command at a time, so it can lazily read from a file.
+
+        :param source: the commands to run
+        """
+        self._command_sources.append(iter(source))
+
+    def _next_queued_command(self) -> Optional[str]:
+        """Remove and return the next command waiting to run
+
+        :return: the command or None if nothing is queued
+        """
+        while True:
+            if self._command_sources:
+                source = self._command_sources[-1]
+                for line in source:
+                    return line
+
+                # This source is exhausted
+                self._command_sources.pop()
+            elif self.cmdqueue:
+                # Move everything in cmdqueue into a source at once so taking each
+                # command doesn't require shifting the rest of the list
+                self._command_sources.append(iter(self.cmdqueue))
+                self.cmdqueue = []
+            else:
+                return None
+
+    def _clear_command_queue(self) -> None:
+        """Discard all queued commands and the script directory stack. Open script files are closed."""
+        for source in self._command_sources:
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+        self._command_sources = []
+        self.cmdqueue = []
+        self._script_dir = []
+
+    def _complete_statement(self, line: Union[Statement, str]) -> Statement:
         """Keep accepting lines of input until the command is complete.
 
         There is some pretty hacky code here to handle some quirks of
         self.pseudo_raw_input(). It returns a literal 'eof' if the input
         pipe runs out. We can't refactor it because we need to retain
         backwards compatibility with the standard library version of cmd.
+
+        A Statement is taken to be complete already and is returned as it is.
         """
+        if isinstance(line, Statement):
+            if not line.command:
+                raise EmptyStatement()
+            return line
+
         while True:
             try:
                 statement = self.statement_parser.parse(line)
@@ -1910,16 +2819,25 @@ class Cmd(cmd.Cmd):
 
         redir_error = False
 
-        # Initialize the saved state
-        saved_state = utils.RedirectionSavedState(self.stdout, sys.stdout, self.cur_pipe_proc_reader)
+        # Initialize the saved state. While background jobs are running, sys.stdout is saved for this thread.
+        saved_state = utils.RedirectionSavedState(self.stdout, utils.thread_stream(sys.stdout),
+                                                  self.cur_pipe_proc_reader)
 
         if not self.allow_redirection:
             return redir_error, saved_state
 
         if statement.pipe_to:
+            filters = self._pipe_filters(statement)
+            if filters:
+                redir_error = self._redirect_to_filters(filters, saved_state)
+                return redir_error, saved_state
+
             # Create a pipe with read and write sides
             read_fd, write_fd = os.pipe()
 
+            # A larger pipe buffer lets large output, like that of poutput_bytes(), reach the process in fewer writes
+            utils.set_pipe_size(write_fd, constants.PIPE_BUFFER_SIZE)
+
             # Open each side of the pipe
             subproc_stdin = io.open(read_fd, 'r')
             new_stdout = io.open(write_fd, 'w')
@@ -1947,7 +2865,7 @@ class Cmd(cmd.Cmd):
 
                 saved_state.redirecting = True
                 saved_state.pipe_proc_reader = utils.ProcReader(proc, self.stdout, sys.stderr)
-                sys.stdout = self.stdout = new_stdout
+                self._set_stdout(new_stdout, new_stdout)
             except Exception as ex:
                 self.perror('Failed to open pipe because - {}'.format(ex), traceback_war=False)
                 subproc_stdin.close()
@@ -1962,30 +2880,36 @@ class Cmd(cmd.Cmd):
                 redir_error = True
 
             elif statement.output_to:
-                # going to a file
-                mode = 'w'
+                # going to a file, which is compressed if its name ends in .gz, .bz2, or .xz
                 # statement.output can only contain
                 # REDIRECTION_APPEND or REDIRECTION_OUTPUT
-                if statement.output == constants.REDIRECTION_APPEND:
-                    mode = 'a'
+                append = statement.output == constants.REDIRECTION_APPEND
                 try:
-                    new_stdout = open(statement.output_to, mode)
+                    new_stdout = utils.open_output_file(statement.output_to, append, self.redirect_compress_level)
                     saved_state.redirecting = True
-                    sys.stdout = self.stdout = new_stdout
-                except OSError as ex:
+                    self._set_stdout(new_stdout, new_stdout)
+                except (OSError, ValueError) as ex:
                     self.perror('Failed to redirect because - {}'.format(ex), traceback_war=False)
                     redir_error = True
             else:
                 # going to a paste buffer
                 new_stdout = tempfile.TemporaryFile(mode="w+")
                 saved_state.redirecting = True
-                sys.stdout = self.stdout = new_stdout
+                self._set_stdout(new_stdout, new_stdout)
 
                 if statement.output == constants.REDIRECTION_APPEND:
                     self.poutput(get_paste_buffer())
 
         return redir_error, saved_state
 
+    def _set_stdout(self, self_stdout: TextIO, sys_stdout: TextIO) -> None:
+        """Set self.stdout and sys.stdout. While background jobs are running, sys.stdout is set for this thread."""
+        self.stdout = self_stdout
+        if isinstance(sys.stdout, utils.ThreadLocalStream):
+            sys.stdout.set_stream(sys_stdout)
+        else:
+            sys.stdout = sys_stdout
+
     def _restore_output(self, statement: Statement, saved_state: utils.RedirectionSavedState) -> None:
         """Handles restoring state after output redirection as well as
         the actual pipe operation if present.
@@ -1994,33 +2918,159 @@ class Cmd(cmd.Cmd):
         :param saved_state: contains information needed to restore state data
         """
         if saved_state.redirecting:
-            # If we redirected output to the clipboard
-            if statement.output and not statement.output_to:
-                self.stdout.seek(0)
-                write_to_paste_buffer(self.stdout.read())
-
-            try:
-                # Close the file or pipe that stdout was redirected to
-                self.stdout.close()
-            except BrokenPipeError:
-                pass
+            redirect_stream = self.stdout
 
             # Restore the stdout values
-            self.stdout = saved_state.saved_self_stdout
-            sys.stdout = saved_state.saved_sys_stdout
+            self._set_stdout(saved_state.saved_self_stdout, saved_state.saved_sys_stdout)
 
-            # Check if we need to wait for the process being piped to
-            if self.cur_pipe_proc_reader is not None:
-                self.cur_pipe_proc_reader.wait()
+            self._close_redirection(statement, redirect_stream, self.cur_pipe_proc_reader)
 
         # Restore cur_pipe_proc_reader. This always is done, regardless of whether this command redirected.
         self.cur_pipe_proc_reader = saved_state.saved_pipe_proc_reader
 
+    def _close_redirection(self, statement: Statement, redirect_stream: TextIO,
+                           pipe_proc_reader: Optional[Union[utils.ProcReader, pipes.Pipeline]]) -> None:
+        """
+        Close the stream a command's output was redirected to and wait for what it was piped to
+        :param statement: the statement whose output was redirected
+        :param redirect_stream: the file, pipe, or paste buffer file its output was redirected to
+        :param pipe_proc_reader: the process or filter commands its output was piped to, if any
+        """
+        # If we redirected output to the clipboard
+        if statement.output and not statement.output_to:
+            redirect_stream.seek(0)
+            write_to_paste_buffer(redirect_stream.read())
+
+        try:
+            # Close the file or pipe that stdout was redirected to
+            redirect_stream.close()
+        except BrokenPipeError:
+            pass
+
+        # Check if we need to wait for the process being piped to
+        if pipe_proc_reader is not None:
+            pipe_proc_reader.wait()
+
+    def _pipe_filters(self, statement: Statement) -> List[Statement]:
+        """
+        Return the filter commands a statement pipes its output to in-process, ending before the first command
+        which isn't a filter. The list is empty if the statement pipes to a shell command.
+        """
+        filters = []
+        while statement.pipe_to:
+            try:
+                # Take what follows the first pipe once aliases are expanded, since an alias can contain a
+                # pipe of its own. Unlike pipe_to, these tokens keep their quotes.
+                tokens = self.statement_parser.tokenize(statement.raw)
+                line = ' '.join(tokens[tokens.index(constants.REDIRECTION_PIPE) + 1:])
+            except ValueError:
+                line = ' '.join(utils.quote_string_if_needed(token) for token in statement.pipe_to)
+
+            try:
+                statement = self.statement_parser.parse(line)
+            except ValueError:
+                break
+            if not getattr(self.cmd_func(statement.command), PIPE_FILTER, False):
+                break
+            filters.append(statement)
+        return filters
+
+    def _redirect_to_filters(self, filters: List[Statement], saved_state: utils.RedirectionSavedState) -> bool:
+        """
+        Start the filter commands of an in-process pipe, each in a thread of its own, and send stdout to the first.
+        The last filter's output goes wherever its own redirection sends it.
+
+        :param filters: the filter commands from _pipe_filters()
+        :param saved_state: the saved state of the command whose output is being piped
+        :return: True if an error occurred
+        """
+        for statement in filters:
+            if inspect.iscoroutinefunction(inspect.unwrap(self.cmd_func(statement.command))):
+                self.perror("{!r} is an async command, which can't be a filter".format(statement.command),
+                            traceback_war=False)
+                return True
+
+        # Redirect the output of the last filter first. It only takes effect in the filter's thread.
+        last_filter = filters[-1]
+        redir_error, last_saved_state = self._redirect_output(last_filter)
+        if redir_error:
+            return True
+        last_stdout = self.stdout
+        self._set_stdout(last_saved_state.saved_self_stdout, last_saved_state.saved_sys_stdout)
+
+        if self._job_stdout is None:
+            self._job_stdout = jobs.JobStdout()
+        if self._pipe_stdin is None:
+            self._pipe_stdin = pipes.PipeStdin()
+        streams = self._install_job_streams()
+
+        # Each filter reads from a pipe and writes to the next filter's pipe, except for the last one
+        filter_pipes = [pipes.Pipe() for _ in filters]
+        outputs = [pipe.writer for pipe in filter_pipes[1:]] + [last_stdout]
+        threads = []
+        for statement, pipe, output in zip(filters, filter_pipes, outputs):
+            thread = threading.Thread(target=self._run_pipe_filter,
+                                      args=(statement, pipe.reader, output, self._job_stdout, self._pipe_stdin,
+                                            streams),
+                                      name='cmd2 filter {}'.format(statement.command))
+            thread.daemon = True
+            threads.append(thread)
+
+        def finish() -> None:
+            """Close what the last filter's output was redirected to once the filters have finished"""
+            self._running_pipelines -= 1
+            if last_saved_state.redirecting:
+                self._close_redirection(last_filter, last_stdout, last_saved_state.pipe_proc_reader)
+            self._remove_job_streams()
+
+        self._running_pipelines += 1
+        for thread in threads:
+            thread.start()
+
+        saved_state.redirecting = True
+        saved_state.pipe_proc_reader = pipes.Pipeline(threads, finish)
+        first_writer = filter_pipes[0].writer
+        self._set_stdout(first_writer, first_writer)
+        return False
+
+    def _run_pipe_filter(self, statement: Statement, stdin: pipes.PipeReader, stdout: TextIO,
+                         job_stdout: jobs.JobStdout, pipe_stdin: pipes.PipeStdin,
+                         streams: Tuple[utils.ThreadLocalStream, utils.ThreadLocalStream]) -> None:
+        """Run a filter command of an in-process pipe. This runs in the filter's thread."""
+        sys_stdout_router, _ = streams
+        job_stdout.stream = stdout
+        pipe_stdin.stream = stdin
+        sys_stdout_router.set_stream(stdout)
+        try:
+            try:
+                self._run_command(statement, add_to_history=False)
+            except Exception as ex:
+                self.perror(ex)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # The command feeding this one can't write any more, and the next one has all of its input
+            stdin.close()
+            if isinstance(stdout, pipes.PipeWriter):
+                try:
+                    stdout.close()
+                except BrokenPipeError:
+                    pass
+            job_stdout.stream = None
+            pipe_stdin.stream = None
+            sys_stdout_router.set_stream(None)
+
     def cmd_func(self, command: str) -> Optional[Callable]:
         """
         Get the function for a command
         :param command: the name of the command
         """
+        info = self._commands.get(command)
+        if info is not None:
+            return info.function
+
+        # Fall back to an attribute lookup for functions which aren't in the registry,
+        # like ones set on this instance before the registry was built
         func_name = self.cmd_func_name(command)
         if func_name:
             return getattr(self, func_name)
@@ -2032,15 +3082,18 @@ class Cmd(cmd.Cmd):
         :return: method name which implements the given command
         """
         target = COMMAND_FUNC_PREFIX + command
+        if command in self._commands:
+            return target
         return target if callable(getattr(self, target, None)) else ''
 
-    def onecmd(self, statement: Union[Statement, str]) -> bool:
+    def onecmd(self, statement: Union[Statement, str], add_to_history: bool = True) -> bool:
         """ This executes the actual do_* method for a command.
 
         If the command provided doesn't exist, then it executes default() instead.
 
         :param statement: intended to be a Statement instance parsed command from the input stream, alternative
                           acceptance of a str is present only for backward compatibility with cmd
+        :param add_to_history: if False, the command isn't added to history because the caller already added it
         :return: a flag indicating whether the interpretation of commands should stop
         """
         # For backwards compatibility with cmd, allow a str to be passed in
@@ -2054,12 +3107,16 @@ class Cmd(cmd.Cmd):
             func = self.cmd_func(statement.command)
             if func:
                 # Check to see if this command should be stored in history
-                if statement.command not in self.exclude_from_history \
+                if add_to_history and statement.command not in self.exclude_from_history \
                         and statement.command not in self.disabled_commands:
                     self.history.append(statement)
 
                 stop = func(statement)
 
+                # async def commands return a coroutine to run
+                if inspect.isawaitable(stop):
+                    stop = self.run_coroutine(stop)
+
             else:
                 stop = self.default(statement)
 
@@ -2075,8 +3132,6 @@ class Cmd(cmd.Cmd):
         :param statement: the parsed statement from the command line
         :return: a flag indicating whether the interpretation of commands should stop
         """
-        from itertools import islice
-
         if statement.command not in self.macros.keys():
             raise KeyError('{} is not a macro'.format(statement.command))
 
@@ -2089,25 +3144,7 @@ class Cmd(cmd.Cmd):
                         traceback_war=False)
             return False
 
-        # Resolve the arguments in reverse and read their values from statement.argv since those
-        # are unquoted. Macro args should have been quoted when the macro was created.
-        resolved = macro.value
-        reverse_arg_list = sorted(macro.arg_list, key=lambda ma: ma.start_index, reverse=True)
-
-        for arg in reverse_arg_list:
-            if arg.is_escaped:
-                to_replace = '{{' + arg.number_str + '}}'
-                replacement = '{' + arg.number_str + '}'
-            else:
-                to_replace = '{' + arg.number_str + '}'
-                replacement = statement.argv[int(arg.number_str)]
-
-            parts = resolved.rsplit(to_replace, maxsplit=1)
-            resolved = parts[0] + replacement + parts[1]
-
-        # Append extra arguments and use statement.arg_list since these arguments need their quotes preserved
-        for arg in islice(statement.arg_list, macro.minimum_arg_count, None):
-            resolved += ' ' + arg
+        resolved = macro.resolve(statement)
 
         # Run the resolved command
         return self.onecmd_plus_hooks(resolved)
@@ -2132,7 +3169,16 @@ class Cmd(cmd.Cmd):
         - accounts for changed stdin, stdout
         - if input is a pipe (instead of a tty), look at self.echo
           to decide whether to print the prompt and the input
+        - during run_batch(), returns the next line of the batch
         """
+        if self._batch_lines is not None:
+            line = next(self._batch_lines, None)
+            if line is None:
+                return 'eof'
+            if self.echo:
+                self.poutput('{}{}'.format(prompt, line))
+            return line.strip()
+
         if self.use_rawinput:
             try:
                 if sys.stdin.isatty():
@@ -2218,14 +3264,15 @@ class Cmd(cmd.Cmd):
         stop = False
         try:
             while not stop:
-                if self.cmdqueue:
-                    # Run command out of cmdqueue if nonempty (populated by load command or commands at invocation)
-                    line = self.cmdqueue.pop(0)
-
+                # Run queued commands first (populated by load command or commands at invocation)
+                line = self._next_queued_command()
+                if line is not None:
                     if self.echo and line != 'eos':
                         self.poutput('{}{}'.format(self.prompt, line))
                 else:
-                    # Otherwise, read a command from stdin
+                    # Otherwise, read a command from stdin once background jobs which finished have been handled
+                    if self.job_table:
+                        self._reap_jobs()
                     try:
                         line = self.pseudo_raw_input(self.prompt)
                     except KeyboardInterrupt as ex:
@@ -2251,8 +3298,7 @@ class Cmd(cmd.Cmd):
                     # noinspection PyUnresolvedReferences
                     readline.rl.mode._display_completions = orig_pyreadline_display
 
-            self.cmdqueue.clear()
-            self._script_dir.clear()
+            self._clear_command_queue()
 
             return stop
 
@@ -2395,7 +3441,7 @@ class Cmd(cmd.Cmd):
             self.perror("Invalid macro name: {}".format(errmsg), traceback_war=False)
             return
 
-        if args.name in self.get_all_commands():
+        if args.name in self._commands:
             self.perror("Macro cannot have the same name as a command", traceback_war=False)
             return
 
@@ -2673,8 +3719,7 @@ class Cmd(cmd.Cmd):
     def _help_menu(self, verbose: bool = False) -> None:
         """Show a list of commands which help can be displayed for.
         """
-        # Get a sorted list of help topics
-        help_topics = utils.alphabetical_sort(self.get_help_topics())
+        help_topics = set(self.get_help_topics())
 
         # Get a sorted list of visible command names
         visible_commands = utils.alphabetical_sort(self.get_visible_commands())
@@ -2689,7 +3734,7 @@ class Cmd(cmd.Cmd):
 
             if command in help_topics:
                 # Prevent the command from showing as both a command and help topic in the output
-                help_topics.remove(command)
+                help_topics.discard(command)
 
                 # Non-argparse commands can have help_functions for their documentation
                 if not hasattr(func, 'argparser'):
@@ -2704,6 +3749,9 @@ class Cmd(cmd.Cmd):
             else:
                 cmds_undoc.append(command)
 
+        # Get a sorted list of help topics
+        help_topics = utils.alphabetical_sort(help_topics)
+
         if len(cmds_cats) == 0:
             # No categories found, fall back to standard behavior
             self.poutput("{}\n".format(str(self.doc_leader)))
@@ -2728,12 +3776,8 @@ class Cmd(cmd.Cmd):
                 self.print_topics(header, cmds, 15, 80)
             else:
                 self.stdout.write('{}\n'.format(str(header)))
-                widest = 0
                 # measure the commands
-                for command in cmds:
-                    width = utils.ansi_safe_wcswidth(command)
-                    if width > widest:
-                        widest = width
+                widest = text_metrics.max_width(cmds)
                 # add a 4-space pad
                 widest += 4
                 if widest < 20:
@@ -2743,7 +3787,7 @@ class Cmd(cmd.Cmd):
                     self.stdout.write('{:{ruler}<{width}}\n'.format('', ruler=self.ruler, width=80))
 
                 # Try to get the documentation string for each command
-                topics = self.get_help_topics()
+                topics = set(self.get_help_topics())
 
                 for command in cmds:
                     cmd_func = self.cmd_func(command)
@@ -3359,10 +4403,11 @@ class Cmd(cmd.Cmd):
                 self.perror("If this is what you want to do, specify '1:' as the range of history.",
                             traceback_war=False)
             else:
-                for runme in history:
-                    self.pfeedback(runme)
-                    if runme:
-                        self.onecmd_plus_hooks(runme)
+                # Parse the commands again in case aliases or settings have changed since they were run
+                lines = itertools.chain.from_iterable(item.split('\n') for item in history)
+                for parsed in self.statement_parser.parse_many(lines):
+                    self.pfeedback(parsed.line)
+                    self.onecmd_plus_hooks(parsed.statement if parsed.statement is not None else parsed.line)
         elif args.edit:
             import tempfile
             fd, fname = tempfile.mkstemp(suffix='.txt', text=True)
@@ -3471,6 +4516,264 @@ class Cmd(cmd.Cmd):
             msg = '{} {} saved to transcript file {!r}'
             self.pfeedback(msg.format(len(history), plural, transcript_file))
 
+    stats_description = ("Show latency statistics for the commands which have run\n"
+                         "\n"
+                         "Statistics are only recorded while the collect_stats setting is True.\n"
+                         "Latencies are estimated from histograms whose buckets are at most 25% wide.\n"
+                         "The parse phase includes waiting for the remaining lines of multiline commands.")
+
+    stats_parser = ACArgumentParser(description=stats_description)
+    stats_parser.add_argument('-s', '--sort', choices=['name', 'calls', 'errors', 'p50', 'p95', 'p99', 'max'],
+                              default='name', help='order of the commands, largest first except for name')
+    stats_parser.add_argument('-p', '--phases', action='store_true', help='also show the latency of each phase')
+    stats_parser.add_argument('-r', '--reset', action='store_true', help='discard all statistics')
+    setattr(stats_parser.add_argument('command', nargs='*', help='only show statistics for these commands'),
+            ACTION_ARG_CHOICES, get_commands_aliases_and_macros_for_completion)
+
+    @with_argparser(stats_parser)
+    def do_stats(self, args: argparse.Namespace) -> None:
+        """Show latency statistics for the commands which have run"""
+        if args.reset:
+            self.command_stats.reset()
+            return
+
+        if args.command:
+            items = [(name, self.command_stats.get(name)) for name in args.command]
+            items = [(name, command_stats) for name, command_stats in items if command_stats is not None]
+        else:
+            items = list(self.command_stats.items())
+
+        if not items:
+            if not self.collect_stats:
+                self.pfeedback('No statistics have been recorded. Set collect_stats to True to record them.')
+            return
+
+        sort_keys = {'name': lambda item: item[0],
+                     'calls': lambda item: item[1].calls,
+                     'errors': lambda item: item[1].errors,
+                     'p50': lambda item: item[1].latency.percentile(50),
+                     'p95': lambda item: item[1].latency.percentile(95),
+                     'p99': lambda item: item[1].latency.percentile(99),
+                     'max': lambda item: item[1].latency.max}
+        items.sort(key=sort_keys[args.sort], reverse=args.sort != 'name')
+
+        rows = [('Command', 'Calls', 'Errors', 'p50', 'p95', 'p99', 'Max')]
+        for name, command_stats in items:
+            rows.append(self._stats_row(name, command_stats.calls, command_stats.errors, command_stats.latency))
+            if args.phases:
+                for phase in stats.phase_order(list(command_stats.phases)):
+                    histogram = command_stats.phases[phase]
+                    rows.append(self._stats_row('  ' + phase, histogram.count, '', histogram))
+
+        widths = [text_metrics.max_width([row[col] for row in rows]) for col in range(len(rows[0]))]
+        for row in rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            self.poutput('  '.join(cells).rstrip())
+
+    @staticmethod
+    def _stats_row(name: str, calls: int, errors: Union[int, str], histogram: stats.LatencyHistogram) -> Tuple:
+        """Format a row of the stats command's table"""
+        return (name, str(calls), str(errors),
+                stats.format_duration(histogram.percentile(50)),
+                stats.format_duration(histogram.percentile(95)),
+                stats.format_duration(histogram.percentile(99)),
+                stats.format_duration(histogram.max))
+
+    profile_description = ("Run a command under a profiler and report where it spent its time\n"
+                           "\n"
+                           "The command runs with its hooks like any other command. Redirection on the line\n"
+                           "applies to this command's report. To include redirection in what is profiled,\n"
+                           "quote the whole command line:\n"
+                           "\n"
+                           "  profile \"history > history.txt\"")
+
+    profile_parser = ACArgumentParser(description=profile_description)
+    profile_parser.add_argument('-n', '--limit', type=int, default=20,
+                                help='number of functions or allocation sites to report')
+    profile_parser.add_argument('-s', '--sort', choices=['cumulative', 'tottime', 'calls'], default='cumulative',
+                                help='order of the functions reported')
+    profile_mode_group = profile_parser.add_mutually_exclusive_group()
+    setattr(profile_mode_group.add_argument('-o', '--output-file', metavar='FILE',
+                                            help='save the profile to a .pstats file instead of reporting it'),
+            ACTION_ARG_CHOICES, ('path_complete',))
+    profile_mode_group.add_argument('-m', '--memory', action='store_true',
+                                    help='report the lines which allocated the most memory using tracemalloc')
+    setattr(profile_parser.add_argument('command', help='the command to profile'),
+            ACTION_ARG_CHOICES, get_commands_aliases_and_macros_for_completion)
+    profile_parser.add_argument('command_args', nargs=argparse.REMAINDER, help='arguments to pass to command')
+
+    # Preserve quotes since the command line is parsed again when it runs
+    @with_argparser(profile_parser, preserve_quotes=True)
+    def do_profile(self, args: argparse.Namespace) -> Optional[bool]:
+        """Run a command under a profiler and report where it spent its time"""
+        line = ' '.join([args.command] + args.command_args)
+
+        # A quoted command line is unquoted so it can include redirection
+        if not args.command_args and args.command and args.command[0] in constants.QUOTES:
+            line = utils.strip_quotes(args.command)
+
+        if args.memory:
+            return self._profile_memory(line, args.limit)
+
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            stop = self.onecmd_plus_hooks(line)
+        finally:
+            profiler.disable()
+
+        if args.output_file:
+            output_file = os.path.abspath(os.path.expanduser(args.output_file))
+            try:
+                profiler.dump_stats(output_file)
+            except OSError as ex:
+                self.perror('Failed to save profile: {}'.format(ex), traceback_war=False)
+            else:
+                self.pfeedback('Profile saved to {!r}'.format(output_file))
+        else:
+            pstats.Stats(profiler, stream=self.stdout).sort_stats(args.sort).print_stats(args.limit)
+        return stop
+
+    def _profile_memory(self, line: str, limit: int) -> bool:
+        """Run a command line and report the lines which allocated the most memory that is still in use"""
+        import tracemalloc
+
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            stop = self.onecmd_plus_hooks(line)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+
+        # Leave out memory allocated by tracemalloc itself
+        ignore_tracemalloc = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        before = before.filter_traces(ignore_tracemalloc)
+        after = after.filter_traces(ignore_tracemalloc)
+        differences = after.compare_to(before, 'lineno')
+        differences = [difference for difference in differences if difference.size_diff or difference.count_diff]
+
+        self.poutput('Top {} lines by memory allocated and still in use'.format(limit))
+        for difference in differences[:limit]:
+            self.poutput(str(difference))
+        return stop
+
+    parallel_description = ("Run thread-safe commands at the same time\n"
+                            "\n"
+                            "Each command runs in its own thread with its output captured, which is printed\n"
+                            "when the command finishes. Only commands marked with the @thread_safe decorator\n"
+                            "can run in parallel, and they can't redirect their output. Enclose each command\n"
+                            "in quotes:\n"
+                            "\n"
+                            "  parallel \"status host1\" \"status host2\" \"status host3\"")
+
+    parallel_parser = ACArgumentParser(description=parallel_description)
+    parallel_parser.add_argument('-j', '--jobs', type=int, help='the most commands to run at once')
+    parallel_parser.add_argument('-u', '--unordered', action='store_true',
+                                 help="print each command's output as soon as it finishes instead of "
+                                      "in the order the commands were given")
+    parallel_parser.add_argument('commands', nargs='+', help='the commands to run')
+
+    @with_argparser(parallel_parser)
+    def do_parallel(self, args: argparse.Namespace) -> Optional[bool]:
+        """Run thread-safe commands at the same time"""
+        if args.jobs is not None and args.jobs < 1:
+            self.perror('--jobs must be at least 1', traceback_war=False)
+            return
+        return self.run_parallel(args.commands, max_workers=args.jobs, ordered=not args.unordered)
+
+    jobs_description = ("List background jobs\n"
+                        "\n"
+                        "End a command line with & to run a thread-safe command as a background job.\n"
+                        "Its output is kept until the job is brought to the foreground with fg, unless\n"
+                        "it is redirected to a file.")
+
+    @with_argparser(ACArgumentParser(description=jobs_description))
+    def do_jobs(self, _: argparse.Namespace) -> None:
+        """List background jobs"""
+        for job in self.job_table:
+            finished = not job.running
+            self.poutput(str(job))
+            if finished:
+                job.notified = True
+        self._reap_jobs()
+
+    wait_parser = ACArgumentParser(description="Wait for background jobs to finish")
+    setattr(wait_parser.add_argument('job_ids', nargs='*', type=int, metavar='job_id',
+                                     help='jobs to wait for (default: all running jobs)'),
+            ACTION_ARG_CHOICES, get_job_ids)
+
+    @with_argparser(wait_parser)
+    def do_wait(self, args: argparse.Namespace) -> None:
+        """Wait for background jobs to finish"""
+        job_list = self._get_jobs(args.job_ids) if args.job_ids else self.job_table.running()
+        if job_list is None:
+            return
+        for job in job_list:
+            job.wait()
+        self._reap_jobs()
+
+    fg_description = ("Wait for a background job to finish and print its output\n"
+                      "\n"
+                      "Pressing Ctrl-C while waiting kills the job.")
+
+    fg_parser = ACArgumentParser(description=fg_description)
+    setattr(fg_parser.add_argument('job_id', nargs='?', type=int, help='the job (default: the most recent job)'),
+            ACTION_ARG_CHOICES, get_job_ids)
+
+    @with_argparser(fg_parser)
+    def do_fg(self, args: argparse.Namespace) -> None:
+        """Wait for a background job to finish and print its output"""
+        if args.job_id is None:
+            job = self.job_table.latest()
+            if job is None:
+                self.perror('There are no background jobs', traceback_war=False)
+                return
+        else:
+            job_list = self._get_jobs([args.job_id])
+            if job_list is None:
+                return
+            job = job_list[0]
+
+        try:
+            job.wait()
+        except KeyboardInterrupt:
+            job.kill()
+            job.wait()
+
+        # Only mention how the job finished if it didn't finish normally
+        job.notified = job.status == jobs.JOB_DONE
+        self._reap_jobs()
+        self.job_table.remove(job.id)
+        if job.captures_output:
+            self.poutput(job.stdout.getvalue(), end='')
+        self.decolorized_write(sys.stderr, job.stderr.getvalue())
+
+    kill_description = ("Kill background jobs\n"
+                        "\n"
+                        "KeyboardInterrupt is raised in the job's thread, like when Ctrl-C is pressed.\n"
+                        "A job blocked in a system call stops once the call returns.")
+
+    kill_parser = ACArgumentParser(description=kill_description)
+    setattr(kill_parser.add_argument('job_ids', nargs='+', type=int, metavar='job_id', help='jobs to kill'),
+            ACTION_ARG_CHOICES, get_job_ids)
+
+    @with_argparser(kill_parser)
+    def do_kill(self, args: argparse.Namespace) -> None:
+        """Kill background jobs"""
+        job_list = self._get_jobs(args.job_ids)
+        if job_list is None:
+            return
+        for job in job_list:
+            if not job.kill():
+                self.perror('Job {} is not running'.format(job.id), traceback_war=False)
+
     edit_description = ("Edit a file in a text editor\n"
                         "\n"
                         "The editor used is determined by a settable parameter. To set it:\n"
@@ -3533,42 +4836,75 @@ class Cmd(cmd.Cmd):
         expanded_path = os.path.abspath(os.path.expanduser(args.script_path))
 
         # Make sure the path exists and we can access it
-        if not os.path.exists(expanded_path):
+        try:
+            file_stat = os.stat(expanded_path)
+        except OSError:
             self.perror("'{}' does not exist or cannot be accessed".format(expanded_path), traceback_war=False)
             return
 
         # Make sure expanded_path points to a file
-        if not os.path.isfile(expanded_path):
+        if not stat.S_ISREG(file_stat.st_mode):
             self.perror("'{}' is not a file".format(expanded_path), traceback_war=False)
             return
 
         # Make sure the file is not empty
-        if os.path.getsize(expanded_path) == 0:
+        if file_stat.st_size == 0:
             self.perror("'{}' is empty".format(expanded_path), traceback_war=False)
             return
 
-        # Make sure the file is ASCII or UTF-8 encoded text
-        if not utils.is_text_file(expanded_path):
-            self.perror("'{}' is not an ASCII or UTF-8 encoded text file".format(expanded_path), traceback_war=False)
-            return
+        use_mmap = self.load_mmap_threshold is not None and file_stat.st_size >= self.load_mmap_threshold
+        script_lines = utils.read_text_lines(expanded_path, use_mmap=use_mmap)
 
+        # Read the first line now so files which aren't text are rejected before anything is queued.
+        # The rest of the file is validated as its lines are read.
         try:
-            # Read all lines of the script and insert into the head of the
-            # command queue. Add an "end of script (eos)" command to cleanup the
-            # self._script_dir list when done.
-            with open(expanded_path, encoding='utf-8') as target:
-                script_commands = target.read().splitlines()
+            first_line = next(script_lines)
+        except StopIteration:  # pragma: no cover
+            # The file was truncated after it was checked
+            self.perror("'{}' is empty".format(expanded_path), traceback_war=False)
+            return
+        except UnicodeDecodeError:
+            self.perror("'{}' is not an ASCII or UTF-8 encoded text file".format(expanded_path), traceback_war=False)
+            return
         except OSError as ex:  # pragma: no cover
             self.perror("Problem accessing script from '{}': {}".format(expanded_path, ex))
             return
 
         if args.transcript:
+            try:
+                script_commands = [first_line]
+                script_commands.extend(script_lines)
+            except UnicodeDecodeError as ex:
+                self.perror("'{}' is not an ASCII or UTF-8 encoded text file: {}".format(expanded_path, ex.reason),
+                            traceback_war=False)
+                return
             self._generate_transcript(script_commands, os.path.expanduser(args.transcript))
             return
 
-        self.cmdqueue = script_commands + ['eos'] + self.cmdqueue
+        # Run the lines of the script before anything else in the queue. They are read from the
+        # file as they are needed. The script is followed by an "end of script (eos)" command to
+        # cleanup the self._script_dir list when done.
+        self._push_command_source(self._read_script_commands(expanded_path, first_line, script_lines))
         self._script_dir.append(os.path.dirname(expanded_path))
 
+    def _read_script_commands(self, script_path: str, first_line: str, script_lines: Generator) -> Iterator[str]:
+        """Yield the commands of a script followed by 'eos'. An encoding error ends the script early.
+
+        The lines of each multiline command are joined into one command. Blank lines and comments are kept so
+        the command hooks still run for them.
+        """
+        try:
+            lines = itertools.chain([first_line], script_lines)
+            for parsed in self.statement_parser.parse_many(lines, keep_empty=True):
+                yield parsed.line
+        except UnicodeDecodeError as ex:
+            self.perror("'{}' is not an ASCII or UTF-8 encoded text file: {}".format(script_path, ex.reason),
+                        traceback_war=False)
+        finally:
+            # Close the file if the script is abandoned before it's exhausted
+            script_lines.close()
+        yield 'eos'
+
     relative_load_description = load_description
     relative_load_description += ("\n\n"
                                   "If this is called from within an already-running script, the filename will be\n"
@@ -3663,14 +4999,14 @@ class Cmd(cmd.Cmd):
                 # That will be included in the input lines calculations since that is where the cursor is.
                 num_prompt_terminal_lines = 0
                 for line in prompt_lines[:-1]:
-                    line_width = utils.ansi_safe_wcswidth(line)
+                    line_width = text_metrics.width(line)
                     num_prompt_terminal_lines += int(line_width / terminal_size.columns) + 1
 
                 # Now calculate how many terminal lines are take up by the input
                 last_prompt_line = prompt_lines[-1]
-                last_prompt_line_width = utils.ansi_safe_wcswidth(last_prompt_line)
+                last_prompt_line_width = text_metrics.width(last_prompt_line)
 
-                input_width = last_prompt_line_width + utils.ansi_safe_wcswidth(readline.get_line_buffer())
+                input_width = last_prompt_line_width + text_metrics.width(readline.get_line_buffer())
 
                 num_input_terminal_lines = int(input_width / terminal_size.columns) + 1
 
@@ -3875,11 +5211,15 @@ class Cmd(cmd.Cmd):
         original_sigint_handler = signal.getsignal(signal.SIGINT)
         signal.signal(signal.SIGINT, self.sigint_handler)
 
+        batch = False
         if self.allow_cli_args:
             parser = argparse.ArgumentParser()
             parser.add_argument('-t', '--test', action="store_true",
                                 help='Test against transcript(s) in FILE (wildcards OK)')
+            parser.add_argument('--batch', action="store_true",
+                                help='Run commands piped to stdin in batch mode without prompting for them')
             callopts, callargs = parser.parse_known_args()
+            batch = callopts.batch
 
             # If transcript testing was called for, use other arguments as transcript files
             if callopts.test:
@@ -3889,6 +5229,10 @@ class Cmd(cmd.Cmd):
             if callargs:
                 self.cmdqueue.extend(callargs)
 
+        # Save the terminal's settings so they can be restored after each command. "stty sane" works on stdin.
+        if self.terminal_restore == constants.TERMINAL_RESTORE_TERMIOS:
+            self._terminal_state = utils.TerminalState.save(sys.stdin)
+
         # Grab terminal lock before the prompt has been drawn by readline
         self.terminal_lock.acquire()
 
@@ -3909,8 +5253,11 @@ class Cmd(cmd.Cmd):
             if self.intro is not None:
                 self.poutput(str(self.intro) + "\n")
 
-            # And then call _cmdloop() to enter the main loop
-            self._cmdloop()
+            # And then enter the main loop, or run the commands on stdin in batch mode
+            if batch:
+                self.run_batch()
+            else:
+                self._cmdloop()
 
         # Run the postloop() no matter what
         for func in self._postloop_hooks:
@@ -3924,6 +5271,10 @@ class Cmd(cmd.Cmd):
         # Restore the original signal handler
         signal.signal(signal.SIGINT, original_sigint_handler)
 
+        self._terminal_state = None
+
+        self.close_event_loop()
+
         if self.exit_code is not None:
             sys.exit(self.exit_code)
 
@@ -3941,6 +5292,12 @@ class Cmd(cmd.Cmd):
         self._postcmd_hooks = []
         self._cmdfinalization_hooks = []
 
+        # Each stage's hooks combined into one callable by plugin.compile_hooks(). None when a stage has no hooks.
+        self._postparsing_hook_chain = None
+        self._precmd_hook_chain = None
+        self._postcmd_hook_chain = None
+        self._cmdfinalization_hook_chain = None
+
     @classmethod
     def _validate_callable_param_count(cls, func: Callable, count: int) -> None:
         """Ensure a function has the given number of parameters."""
@@ -3994,6 +5351,7 @@ class Cmd(cmd.Cmd):
         """Register a function to be called after parsing user input but before running the command"""
         self._validate_postparsing_callable(func)
         self._postparsing_hooks.append(func)
+        self._postparsing_hook_chain = plugin.compile_hooks(self._postparsing_hooks, stop_early=True)
 
     @classmethod
     def _validate_prepostcmd_hook(cls, func: Callable, data_type: Type) -> None:
@@ -4027,11 +5385,13 @@ class Cmd(cmd.Cmd):
         """Register a hook to be called before the command function."""
         self._validate_prepostcmd_hook(func, plugin.PrecommandData)
         self._precmd_hooks.append(func)
+        self._precmd_hook_chain = plugin.compile_hooks(self._precmd_hooks)
 
     def register_postcmd_hook(self, func: Callable[[plugin.PostcommandData], plugin.PostcommandData]) -> None:
         """Register a hook to be called after the command function."""
         self._validate_prepostcmd_hook(func, plugin.PostcommandData)
         self._postcmd_hooks.append(func)
+        self._postcmd_hook_chain = plugin.compile_hooks(self._postcmd_hooks)
 
     @classmethod
     def _validate_cmdfinalization_callable(cls, func: Callable[[plugin.CommandFinalizationData],
@@ -4052,3 +5412,4 @@ class Cmd(cmd.Cmd):
         """Register a hook to be called after a command is completed, whether it completes successfully or not."""
         self._validate_cmdfinalization_callable(func)
         self._cmdfinalization_hooks.append(func)
+        self._cmdfinalization_hook_chain = plugin.compile_hooks(self._cmdfinalization_hooks)
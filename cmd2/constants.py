@@ -15,6 +15,17 @@ REDIRECTION_TOKENS = [REDIRECTION_PIPE, REDIRECTION_OUTPUT, REDIRECTION_APPEND]
 COMMENT_CHAR = '#'
 MULTILINE_TERMINATOR = ';'
 
+# Ends a command line which runs as a background job
+BACKGROUND_CHAR = '&'
+
+# Size requested for the OS buffer of a pipe which output is redirected to
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+# values for the overflow argument of utils.StdSim
+OVERFLOW_TRUNCATE_HEAD = 'truncate_head'
+OVERFLOW_TRUNCATE_TAIL = 'truncate_tail'
+OVERFLOW_SPILL = 'spill'
+
 # Regular expression to match ANSI escape codes
 ANSI_ESCAPE_RE = re.compile(r'\x1b[^m]*m')
 
@@ -24,3 +35,8 @@ LINE_FEED = '\n'
 COLORS_NEVER = 'Never'
 COLORS_TERMINAL = 'Terminal'
 COLORS_ALWAYS = 'Always'
+
+# values for terminal_restore setting
+TERMINAL_RESTORE_TERMIOS = 'termios'
+TERMINAL_RESTORE_STTY = 'stty'
+TERMINAL_RESTORE_NEVER = 'never'
@@ -0,0 +1,190 @@
+# coding=utf-8
+"""
+Background jobs, which are commands started by ending a command line with &
+"""
+import threading
+from collections import OrderedDict
+from typing import Iterator, List, Optional, TextIO, Union
+
+from . import utils
+from .parsing import Statement
+
+# The statuses of a job
+JOB_RUNNING = 'Running'
+JOB_DONE = 'Done'
+JOB_FAILED = 'Failed'
+JOB_KILLED = 'Killed'
+
+
+def _raise_in_thread(thread: threading.Thread, exception_type: type) -> bool:
+    """
+    Raise an exception in another thread the next time it runs Python code. This is how CPython delivers
+    KeyboardInterrupt, so code which handles Ctrl-C handles this the same way.
+
+    :return: True if the exception was set, False if the thread isn't running or this isn't supported
+    """
+    import ctypes
+    set_async_exc = getattr(getattr(ctypes, 'pythonapi', None), 'PyThreadState_SetAsyncExc', None)
+    if set_async_exc is None or thread.ident is None:
+        return False
+    return set_async_exc(ctypes.c_ulong(thread.ident), ctypes.py_object(exception_type)) == 1
+
+
+class JobStdout(threading.local):
+    """Holds the stream which a background job's thread uses as Cmd.stdout"""
+    # None in threads which aren't running a job. Defining it here keeps reads from raising AttributeError.
+    stream = None
+
+
+class Job(object):
+    """A command running in a background thread"""
+
+    def __init__(self, job_id: int, statement: Statement, stdout: Union[utils.StdSim, TextIO],
+                 stderr: utils.StdSim) -> None:
+        """
+        Initializer
+        :param job_id: the number which identifies the job
+        :param statement: the command being run, without the trailing &
+        :param stdout: where the command's output goes, either a StdSim which captures it or a file
+        :param stderr: StdSim which captures the command's error output
+        """
+        self.id = job_id
+        self.statement = statement
+        self.stdout = stdout
+        self.stderr = stderr
+        self.status = JOB_RUNNING
+
+        # The thread running the command, once it has been started
+        self.thread = None
+
+        # The command's return value, which is passed to the command finalization hooks
+        self.stop = False
+
+        # Set once the job has been announced as finished, either by an alert or at the next prompt
+        self.notified = False
+
+        # Set once the job's finish has been handled in the main thread
+        self.reaped = False
+
+        self._finished = threading.Event()
+
+        # Guards against killing the job while its thread is finishing
+        self._lock = threading.Lock()
+        self._kill_sent = False
+
+        # Set once the command has finished and its output file is being closed, which can't be interrupted
+        self._closing = False
+
+    @property
+    def command_line(self) -> str:
+        """The command line which started the job"""
+        return '{} &'.format(self.statement.expanded_command_line)
+
+    @property
+    def running(self) -> bool:
+        """True while the command is still running"""
+        return not self._finished.is_set()
+
+    @property
+    def captures_output(self) -> bool:
+        """True if the command's output is being kept until the job is brought to the foreground"""
+        return isinstance(self.stdout, utils.StdSim)
+
+    def has_output(self) -> bool:
+        """Return whether the job captured any output which hasn't been shown"""
+        return bool((self.captures_output and self.stdout.size) or self.stderr.size)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the command to finish
+        :param timeout: the most seconds to wait or None to wait until it finishes
+        :return: True if the command has finished
+        """
+        return self._finished.wait(timeout)
+
+    def kill(self) -> bool:
+        """
+        Interrupt the command by raising KeyboardInterrupt in its thread. A command blocked in a system call
+        stops once the call returns.
+
+        :return: True if the command was interrupted, False if it had already finished or was already killed
+        """
+        with self._lock:
+            if self._kill_sent or self._closing or not self.running or self.thread is None:
+                return False
+            self._kill_sent = _raise_in_thread(self.thread, KeyboardInterrupt)
+            return self._kill_sent
+
+    def finish(self, status: str, stop: bool) -> None:
+        """Called by the job's thread when its command has finished"""
+        # Close a file the output was redirected to, so it is complete once the job is seen as finished.
+        # A compressed file only writes its last block when closed.
+        if not self.captures_output:
+            while True:
+                try:
+                    with self._lock:
+                        self._closing = True
+                    break
+                except KeyboardInterrupt:
+                    # kill() interrupted the command just as it finished
+                    continue
+            self.stdout.close()
+
+        while True:
+            try:
+                with self._lock:
+                    self.status = JOB_KILLED if self._kill_sent else status
+                    self.stop = stop
+                    self._finished.set()
+                break
+            except KeyboardInterrupt:
+                # kill() interrupted the command just as it finished
+                continue
+
+    def __str__(self) -> str:
+        return '[{}] {:<8} {}'.format(self.id, self.status, self.command_line)
+
+
+class JobTable(object):
+    """The background jobs which are running or have output waiting to be shown"""
+
+    def __init__(self) -> None:
+        # Jobs keyed by number, in the order they were added
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, statement: Statement, stdout: Union[utils.StdSim, TextIO], stderr: utils.StdSim) -> Job:
+        """
+        Add a job with the next free number. Numbering starts over at 1 once the table is empty.
+        :return: the new Job
+        """
+        with self._lock:
+            job_id = max(self._jobs) + 1 if self._jobs else 1
+            job = self._jobs[job_id] = Job(job_id, statement, stdout, stderr)
+            return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """Return the job with a number or None if there isn't one"""
+        return self._jobs.get(job_id)
+
+    def latest(self) -> Optional[Job]:
+        """Return the most recently started job or None if the table is empty"""
+        with self._lock:
+            job_id = next(reversed(self._jobs), None)
+            return None if job_id is None else self._jobs[job_id]
+
+    def remove(self, job_id: int) -> None:
+        """Remove a job from the table if it's there"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def running(self) -> List[Job]:
+        """Return the jobs which are still running"""
+        return [job for job in self if job.running]
+
+    def __iter__(self) -> Iterator[Job]:
+        with self._lock:
+            return iter(list(self._jobs.values()))
+
+    def __len__(self) -> int:
+        return len(self._jobs)
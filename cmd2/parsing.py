@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 """Statement parsing classes for cmd2"""
 
+import collections
 import os
 import re
 import shlex
-from typing import Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 
 import attr
 
@@ -23,6 +24,16 @@ def shlex_split(str_to_split: str) -> List[str]:
     return shlex.split(str_to_split, comments=False, posix=False)
 
 
+# Matches one token in a single left-to-right scan of a command line. This mirrors the rules
+# shlex.split() follows when called with posix=False and comments=False:
+#     - only space, tab, carriage return and line feed are whitespace
+#     - a quote only begins a quoted token at the start of a token, and that token ends at the
+#       matching closing quote even if no whitespace follows it
+#     - a quote in the middle of an unquoted word is an ordinary character
+# A word starting with a quote can only match when the quote is never closed.
+_TOKEN_PATTERN = re.compile(r'''[ \t\r\n]*(?:("[^"]*"|'[^']*')|([^ \t\r\n]+))''')
+
+
 @attr.s(frozen=True)
 class MacroArg:
     """
@@ -71,8 +82,60 @@ class Macro:
     # Used to fill in argument placeholders in the macro
     arg_list = attr.ib(default=attr.Factory(list), validator=attr.validators.instance_of(list))
 
+    # The value split into literal strings and the argv indexes of normal arguments.
+    # This is built once when the macro is created so resolving it is a single join.
+    _segments = attr.ib(default=None, init=False, repr=False, cmp=False)
+
+    def __attrs_post_init__(self) -> None:
+        """Compile the macro value into segments"""
+        segments = []
+        last_end = 0
+        for arg in sorted(self.arg_list, key=lambda ma: ma.start_index):
+            if arg.is_escaped:
+                placeholder_len = len(arg.number_str) + 4
+                literal = '{' + arg.number_str + '}'
+            else:
+                placeholder_len = len(arg.number_str) + 2
+                literal = None
 
-@attr.s(frozen=True)
+            segments.append(self.value[last_end:arg.start_index])
+            if literal is None:
+                segments.append(int(arg.number_str))
+            else:
+                segments.append(literal)
+            last_end = arg.start_index + placeholder_len
+
+        segments.append(self.value[last_end:])
+
+        # merge adjacent literal strings
+        compiled = []
+        for segment in segments:
+            if isinstance(segment, str) and compiled and isinstance(compiled[-1], str):
+                compiled[-1] += segment
+            elif segment != '':
+                compiled.append(segment)
+        object.__setattr__(self, '_segments', tuple(compiled))
+
+    def resolve(self, statement: 'Statement') -> str:
+        """
+        Fill in the argument placeholders of this macro
+
+        Normal arguments are read from statement.argv since those are unquoted. Macro args should have been
+        quoted when the macro was created. Any extra arguments are appended using statement.arg_list since
+        these arguments need their quotes preserved.
+
+        :param statement: the parsed statement which invoked the macro
+        :return: the resolved command line
+        """
+        argv = statement.argv
+        parts = [argv[segment] if isinstance(segment, int) else segment for segment in self._segments]
+        for arg in statement.arg_list[self.minimum_arg_count:]:
+            parts.append(' ')
+            parts.append(arg)
+        return ''.join(parts)
+
+
+@attr.s(frozen=True, slots=True)
 class Statement(str):
     """String subclass with additional attributes to store the results of parsing.
 
@@ -138,6 +201,11 @@ class Statement(str):
 
     3. If you don't want to have to worry about quoted arguments, use
        argv[1:], which strips them all off for you.
+
+    Statements use __slots__ instead of a __dict__ to keep them small since History
+    holds on to one for every command run. The derived values command_and_args,
+    expanded_command_line, and argv are computed the first time they are accessed
+    and then reused.
     """
     # the arguments, but not the command, nor the output redirection clauses.
     args = attr.ib(default='', validator=attr.validators.instance_of(str))
@@ -169,6 +237,11 @@ class Statement(str):
     # if output was redirected, the destination file
     output_to = attr.ib(default='', validator=attr.validators.instance_of(str))
 
+    # caches for the derived properties, filled in on first access
+    _command_and_args = attr.ib(default=None, init=False, repr=False, cmp=False)
+    _expanded_command_line = attr.ib(default=None, init=False, repr=False, cmp=False)
+    _argv = attr.ib(default=None, init=False, repr=False, cmp=False)
+
     def __new__(cls, value: object, *pos_args, **kw_args):
         """Create a new instance of Statement.
 
@@ -181,6 +254,27 @@ class Statement(str):
         stmt = super().__new__(cls, value)
         return stmt
 
+    def _getstate(self) -> Tuple:
+        """Return the values of the attributes for pickling. The str value is supplied by str.__getnewargs__()."""
+        return tuple(getattr(self, a.name) for a in attr.fields(Statement) if a.init)
+
+    def _setstate(self, state: Union[Tuple, Dict[str, Any]]) -> None:
+        """Restore the attributes of an unpickled Statement.
+
+        Statements pickled before they used __slots__ have a dictionary as their state.
+        """
+        init_attrs = [a for a in attr.fields(Statement) if a.init]
+        if isinstance(state, dict):
+            values = [state.get(a.name, a.default) for a in init_attrs]
+            values = [value.factory() if isinstance(value, attr.Factory) else value for value in values]
+        else:
+            values = state
+        for a, value in zip(init_attrs, values):
+            object.__setattr__(self, a.name, value)
+        for a in attr.fields(Statement):
+            if not a.init:
+                object.__setattr__(self, a.name, None)
+
     @property
     def command_and_args(self) -> str:
         """Combine command and args with a space separating them.
@@ -188,36 +282,39 @@ class Statement(str):
         Quoted arguments remain quoted. Output redirection and piping are
         excluded, as are any multiline command terminators.
         """
-        if self.command and self.args:
-            rtn = '{} {}'.format(self.command, self.args)
-        elif self.command:
-            # there were no arguments to the command
-            rtn = self.command
-        else:
-            rtn = ''
-        return rtn
+        if self._command_and_args is None:
+            if self.command and self.args:
+                rtn = '{} {}'.format(self.command, self.args)
+            elif self.command:
+                # there were no arguments to the command
+                rtn = self.command
+            else:
+                rtn = ''
+            object.__setattr__(self, '_command_and_args', rtn)
+        return self._command_and_args
 
     @property
     def expanded_command_line(self) -> str:
         """Contains command_and_args plus any ending terminator, suffix, and redirection chars"""
-        rtn = self.command_and_args
-        if self.multiline_command:
-            rtn += constants.MULTILINE_TERMINATOR
-        elif self.terminator:
-            rtn += self.terminator
-
-        if self.suffix:
-            rtn += ' ' + self.suffix
-
-        if self.pipe_to:
-            rtn += ' | ' + ' '.join(self.pipe_to)
-
-        if self.output:
-            rtn += ' ' + self.output
-            if self.output_to:
-                rtn += ' ' + self.output_to
-
-        return rtn
+        if self._expanded_command_line is None:
+            rtn = self.command_and_args
+            if self.multiline_command:
+                rtn += constants.MULTILINE_TERMINATOR
+            elif self.terminator:
+                rtn += self.terminator
+
+            if self.suffix:
+                rtn += ' ' + self.suffix
+
+            if self.pipe_to:
+                rtn += ' | ' + ' '.join(self.pipe_to)
+
+            if self.output:
+                rtn += ' ' + self.output
+                if self.output_to:
+                    rtn += ' ' + self.output_to
+            object.__setattr__(self, '_expanded_command_line', rtn)
+        return self._expanded_command_line
 
     @property
     def argv(self) -> List[str]:
@@ -225,15 +322,71 @@ class Statement(str):
 
         Quotes, if any, are removed from the elements of the list, and aliases
         and shortcuts are expanded
+
+        A new list is returned each time so callers are free to modify it.
         """
-        if self.command:
-            rtn = [utils.strip_quotes(self.command)]
-            for cur_token in self.arg_list:
-                rtn.append(utils.strip_quotes(cur_token))
-        else:
-            rtn = []
+        if self._argv is None:
+            if self.command:
+                rtn = [utils.strip_quotes(self.command)]
+                rtn.extend(utils.strip_quotes(cur_token) for cur_token in self.arg_list)
+            else:
+                rtn = []
+            object.__setattr__(self, '_argv', tuple(rtn))
+        return list(self._argv)
 
-        return rtn
+
+# attrs generates pickling methods for slotted classes which can't restore a Statement that was
+# pickled with a __dict__, so replace them with ones that handle both formats
+Statement.__getstate__ = Statement._getstate
+Statement.__setstate__ = Statement._setstate
+
+# Statistics about a StatementParser's parse cache
+ParseCacheInfo = collections.namedtuple('ParseCacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# One result of StatementParser.parse_many()
+#     line_number - 1-based number of the first source line of the statement
+#     line - the text which was parsed, including all lines of a multiline command
+#     statement - the parsed Statement or None if parsing failed
+#     error - the ValueError raised when parsing failed or None
+ParsedLine = collections.namedtuple('ParsedLine', ['line_number', 'line', 'statement', 'error'])
+
+
+class _ObservedDict(dict):
+    """A dictionary which calls a function whenever its contents are changed"""
+    def __init__(self, on_change: Callable[[], None], *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._on_change = on_change
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self._on_change()
+
+    def __delitem__(self, key) -> None:
+        super().__delitem__(key)
+        self._on_change()
+
+    def clear(self) -> None:
+        super().clear()
+        self._on_change()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._on_change()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._on_change()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._on_change()
+        return value
+
+    def update(self, *args, **kwargs) -> None:
+        super().update(*args, **kwargs)
+        self._on_change()
 
 
 class StatementParser:
@@ -241,13 +394,20 @@ class StatementParser:
 
     Shortcuts is a list of tuples with each tuple containing the shortcut and
     the expansion.
+
+    Parsed statements are kept in a least recently used cache keyed on the line and
+    whether aliases and shortcuts were expanded. Since the same Statement object is
+    returned for repeated lines, its attributes must never be modified. The cache is
+    cleared whenever aliases, shortcuts, terminators, multiline_commands, or
+    allow_redirection change.
     """
     def __init__(self,
                  allow_redirection: bool = True,
                  terminators: Optional[Iterable[str]] = None,
                  multiline_commands: Optional[Iterable[str]] = None,
                  aliases: Optional[Dict[str, str]] = None,
-                 shortcuts: Optional[Iterable[Tuple[str, str]]] = None) -> None:
+                 shortcuts: Optional[Iterable[Tuple[str, str]]] = None,
+                 cache_size: int = 1024) -> None:
         """Initialize an instance of StatementParser.
 
         The following will get converted to an immutable tuple before storing internally:
@@ -260,25 +420,89 @@ class StatementParser:
         :param multiline_commands: (optional) iterable containing the names of commands that accept multiline input
         :param aliases: (optional) dictionary contaiing aliases
         :param shortcuts (optional) an iterable of tuples with each tuple containing the shortcut and the expansion
+        :param cache_size: (optional) maximum number of parsed statements to keep in the parse cache.
+                           Set this to 0 to disable caching.
         """
-        self.allow_redirection = allow_redirection
+        # Least recently used cache of parsed statements
+        self._parse_cache = collections.OrderedDict()
+        self._parse_cache_size = cache_size
+        self._parse_cache_hits = 0
+        self._parse_cache_misses = 0
+
+        self._allow_redirection = allow_redirection
         if terminators is None:
-            self.terminators = (constants.MULTILINE_TERMINATOR,)
+            self._terminators = (constants.MULTILINE_TERMINATOR,)
         else:
-            self.terminators = tuple(terminators)
+            self._terminators = tuple(terminators)
         if multiline_commands is None:
-            self.multiline_commands = tuple()
-        else:
-            self.multiline_commands = tuple(multiline_commands)
-        if aliases is None:
-            self.aliases = dict()
+            self._multiline_commands = tuple()
         else:
-            self.aliases = aliases
+            self._multiline_commands = tuple(multiline_commands)
+        self._aliases = _ObservedDict(self.clear_parse_cache)
+        if aliases is not None:
+            self._aliases.update(aliases)
         if shortcuts is None:
-            self.shortcuts = tuple()
+            self._shortcuts = tuple()
         else:
-            self.shortcuts = tuple(shortcuts)
+            self._shortcuts = tuple(shortcuts)
 
+        self._build_patterns()
+        self._build_shortcut_lookup()
+
+    @property
+    def allow_redirection(self) -> bool:
+        """Should redirection and pipes be allowed?"""
+        return self._allow_redirection
+
+    @allow_redirection.setter
+    def allow_redirection(self, value: bool) -> None:
+        self._allow_redirection = value
+        self.clear_parse_cache()
+
+    @property
+    def terminators(self) -> Tuple[str, ...]:
+        """Strings which terminate multiline commands"""
+        return self._terminators
+
+    @terminators.setter
+    def terminators(self, value: Iterable[str]) -> None:
+        self._terminators = tuple(value)
+        self._build_patterns()
+        self.clear_parse_cache()
+
+    @property
+    def multiline_commands(self) -> Tuple[str, ...]:
+        """Names of commands that accept multiline input"""
+        return self._multiline_commands
+
+    @multiline_commands.setter
+    def multiline_commands(self, value: Iterable[str]) -> None:
+        self._multiline_commands = tuple(value)
+        self.clear_parse_cache()
+
+    @property
+    def aliases(self) -> Dict[str, str]:
+        """Dictionary of aliases. Changing its contents clears the parse cache."""
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, value: Dict[str, str]) -> None:
+        self._aliases = _ObservedDict(self.clear_parse_cache, value)
+        self.clear_parse_cache()
+
+    @property
+    def shortcuts(self) -> Tuple[Tuple[str, str], ...]:
+        """Tuples with each tuple containing the shortcut and the expansion"""
+        return self._shortcuts
+
+    @shortcuts.setter
+    def shortcuts(self, value: Iterable[Tuple[str, str]]) -> None:
+        self._shortcuts = tuple(value)
+        self._build_shortcut_lookup()
+        self.clear_parse_cache()
+
+    def _build_patterns(self) -> None:
+        """Compile the regular expressions which depend on the terminators"""
         # commands have to be a word, so make a regular expression
         # that matches the first word in the line. This regex has three
         # parts:
@@ -311,6 +535,51 @@ class StatementParser:
         expr = r'\A\s*(\S*?)({})'.format(second_group)
         self._command_pattern = re.compile(expr)
 
+        # Patterns used by the lexer to break unquoted words on punctuation. Which one is used
+        # depends on the value of allow_redirection at the time a line is lexed.
+        punctuation = list(self.terminators)
+        self._punctuation_pattern = self._build_punctuation_pattern(punctuation)
+        punctuation.extend(constants.REDIRECTION_CHARS)
+        self._redirection_punctuation_pattern = self._build_punctuation_pattern(punctuation)
+
+    def clear_parse_cache(self) -> None:
+        """Discard all cached statements. This happens automatically when any parsing setting changes."""
+        self._parse_cache.clear()
+
+    def parse_cache_info(self) -> ParseCacheInfo:
+        """Report statistics about the parse cache
+
+        :return: a ParseCacheInfo containing the hits, misses, maxsize, and currsize of the cache
+        """
+        return ParseCacheInfo(self._parse_cache_hits, self._parse_cache_misses,
+                              self._parse_cache_size, len(self._parse_cache))
+
+    def _cached_parse(self, key: Tuple[str, bool, bool], parse_func: Callable[[], Statement]) -> Statement:
+        """Return the cached Statement for key, calling parse_func to create it on a miss
+
+        :param key: tuple of the line being parsed, the expand flag, and whether only the command is being parsed
+        :param parse_func: function which parses the line when it is not in the cache
+        :return: the parsed Statement
+        """
+        if self._parse_cache_size <= 0:
+            return parse_func()
+
+        try:
+            statement = self._parse_cache[key]
+        except KeyError:
+            self._parse_cache_misses += 1
+        else:
+            self._parse_cache_hits += 1
+            self._parse_cache.move_to_end(key)
+            return statement
+
+        # Exceptions like unclosed quotes propagate without being cached
+        statement = parse_func()
+        self._parse_cache[key] = statement
+        if len(self._parse_cache) > self._parse_cache_size:
+            self._parse_cache.popitem(last=False)
+        return statement
+
     def is_valid_command(self, word: str) -> Tuple[bool, str]:
         """Determine whether a word is a valid name for a command.
 
@@ -375,12 +644,56 @@ class StatementParser:
         if line.lstrip().startswith(constants.COMMENT_CHAR):
             return []
 
-        # split on whitespace
-        tokens = shlex_split(line)
+        return self._lex(line)[0]
+
+    def lex(self, line: str) -> Tuple[List[str], List[str]]:
+        """
+        Lex a string into tokens without expanding shortcuts and aliases or removing comments.
+
+        Whitespace splitting, quote handling and breaking on punctuation are done in one pass over
+        the line. The tokens produced are identical to running shlex_split() on the line followed
+        by _split_on_punctuation().
+
+        :param line: the command line being lexed
+        :return: A tuple containing:
+                    The list of tokens with quoted tokens still quoted
+                    The same list of tokens with outer quotes removed
+        :raises ValueError if there are unclosed quotation marks.
+        """
+        return self._lex(line, unquote=True)
+
+    def _lex(self, line: str, unquote: bool = False) -> Tuple[List[str], List[str]]:
+        """Implementation of lex(). The unquoted list is only built when unquote is True."""
+        if self.allow_redirection:
+            punctuation_pattern = self._redirection_punctuation_pattern
+        else:
+            punctuation_pattern = self._punctuation_pattern
+
+        tokens = []
+        unquoted_tokens = []
+
+        for match in _TOKEN_PATTERN.finditer(line):
+            quoted, word = match.groups()
+            if quoted is not None:
+                tokens.append(quoted)
+                if unquote:
+                    unquoted_tokens.append(quoted[1:-1])
+                continue
+
+            if word[0] in constants.QUOTES:
+                # The quoted token pattern failed, so this quote is never closed
+                raise ValueError('No closing quotation')
+
+            if len(word) > 1 and punctuation_pattern is not None and punctuation_pattern.search(word):
+                pieces = [piece.group() for piece in punctuation_pattern.finditer(word)]
+            else:
+                pieces = [word]
+
+            tokens.extend(pieces)
+            if unquote:
+                unquoted_tokens.extend(utils.strip_quotes(piece) for piece in pieces)
 
-        # custom lexing
-        tokens = self._split_on_punctuation(tokens)
-        return tokens
+        return tokens, unquoted_tokens
 
     def parse(self, line: str, expand: bool = True) -> Statement:
         """
@@ -396,6 +709,10 @@ class StatementParser:
         :return: A parsed Statement
         :raises ValueError if there are unclosed quotation marks
         """
+        return self._cached_parse((line, expand, False), lambda: self._parse(line, expand))
+
+    def _parse(self, line: str, expand: bool) -> Statement:
+        """Implementation of parse() which bypasses the parse cache"""
 
         # handle the special case/hardcoded terminator of a blank line
         # we have to do this before we tokenize because tokenizing
@@ -556,6 +873,10 @@ class StatementParser:
         within args. However, it does ensure args has no leading or trailing
         whitespace.
         """
+        return self._cached_parse((rawinput, True, True), lambda: self._parse_command_only(rawinput))
+
+    def _parse_command_only(self, rawinput: str) -> Statement:
+        """Implementation of parse_command_only() which bypasses the parse cache"""
         # expand shortcuts and aliases
         line = self._expand(rawinput)
 
@@ -590,6 +911,87 @@ class StatementParser:
                               )
         return statement
 
+    def parse_many(self, lines: Iterable[str], keep_empty: bool = False) -> Iterator[ParsedLine]:
+        """
+        Parse the lines of a script or history replay into statements.
+
+        Multiline commands are completed from the lines which follow them the same way Cmd
+        completes them from user input. A multiline command left unfinished at the end of
+        the input is terminated as if a blank line followed it. Blank lines and comments
+        produce no results unless keep_empty is True.
+
+        A multiline command is only parsed again when the line added to it could finish it,
+        so the time taken grows with the length of the command rather than its square.
+
+        Each statement is parsed when it is requested, using the parser settings in effect
+        at that time. Callers which run each statement before requesting the next therefore
+        see aliases defined by earlier statements. Call list() on the result to parse all
+        lines ahead of running them.
+
+        :param lines: the lines to parse. Trailing line endings are removed, so an open file works too.
+        :param keep_empty: if True, blank lines and comments outside of a multiline command produce results
+                           with an empty statement, so each one can still be run through the command hooks
+        :return: a generator of ParsedLine tuples in the order of the input
+        """
+        pending = []  # lines of an unfinished multiline command
+        pending_line_number = 0
+        pending_quoted = False  # whether the unfinished multiline command has unclosed quotation marks
+
+        for line_number, line in enumerate(lines, start=1):
+            line = line.rstrip('\r\n')
+            if pending:
+                pending.append(line)
+                if self._continues_multiline(line, pending_quoted):
+                    continue
+                line = '\n'.join(pending)
+                pending = []
+            else:
+                pending_line_number = line_number
+
+            try:
+                statement = self.parse(line)
+            except ValueError as ex:
+                # unclosed quotation marks are allowed in a multiline command which isn't finished
+                if self.parse_command_only(line).multiline_command:
+                    pending = [line]
+                    pending_quoted = True
+                else:
+                    yield ParsedLine(pending_line_number, line, None, ex)
+                continue
+
+            if statement.multiline_command and not statement.terminator:
+                pending = [line]
+                pending_quoted = False
+            elif statement.command or keep_empty:
+                yield ParsedLine(pending_line_number, line, statement, None)
+
+        if pending:
+            # terminate the multiline command with a blank line
+            line = '{}\n{}'.format('\n'.join(pending), constants.LINE_FEED)
+            try:
+                statement = self.parse(line)
+            except ValueError as ex:
+                yield ParsedLine(pending_line_number, line, None, ex)
+            else:
+                yield ParsedLine(pending_line_number, line, statement, None)
+
+    def _continues_multiline(self, line: str, quoted: bool) -> bool:
+        """
+        Return whether a line added to an unfinished multiline command is sure to leave it unfinished,
+        in which case the command doesn't need to be parsed again
+
+        :param line: the line being added
+        :param quoted: whether the command has unclosed quotation marks before the line is added
+        """
+        if any(quote in line for quote in constants.QUOTES):
+            return False
+        if quoted:
+            # Nothing can end the command until its quotation marks are closed
+            return True
+
+        # A terminator or a blank line ends the command
+        return bool(line) and not any(terminator in line for terminator in self.terminators)
+
     def get_command_arg_list(self, command_name: str, to_parse: Union[Statement, str],
                              preserve_quotes: bool) -> Tuple[Statement, List[str]]:
         """
@@ -623,37 +1025,51 @@ class StatementParser:
         """Expand shortcuts and aliases"""
 
         # expand aliases
-        # make a copy of aliases so we can edit it
-        tmp_aliases = list(self.aliases.keys())
-        keep_expanding = bool(tmp_aliases)
-        while keep_expanding:
-            for cur_alias in tmp_aliases:
-                keep_expanding = False
-                # apply our regex to line
+        # each alias is expanded at most once so chains that loop back on themselves terminate
+        if self.aliases:
+            expanded_aliases = set()
+            while True:
+                # the command pattern always matches, even on an empty line
                 match = self._command_pattern.search(line)
-                if match:
-                    # we got a match, extract the command
-                    command = match.group(1)
-                    if command and command == cur_alias:
-                        # rebuild line with the expanded alias
-                        line = self.aliases[cur_alias] + match.group(2) + line[match.end(2):]
-                        tmp_aliases.remove(cur_alias)
-                        keep_expanding = bool(tmp_aliases)
-                        break
+                command = match.group(1)
+                if not command or command in expanded_aliases:
+                    break
+                try:
+                    expansion = self.aliases[command]
+                except KeyError:
+                    break
+                # rebuild line with the expanded alias
+                line = expansion + match.group(2) + line[match.end(2):]
+                expanded_aliases.add(command)
 
         # expand shortcuts
-        for (shortcut, expansion) in self.shortcuts:
-            if line.startswith(shortcut):
-                # If the next character after the shortcut isn't a space, then insert one
-                shortcut_len = len(shortcut)
-                if len(line) == shortcut_len or line[shortcut_len] != ' ':
-                    expansion += ' '
-
-                # Expand the shortcut
-                line = line.replace(shortcut, expansion, 1)
-                break
+        # of the shortcuts the line starts with, the one listed first in self.shortcuts wins
+        found = None
+        for shortcut_len in self._shortcut_lengths:
+            candidate = self._shortcut_lookup.get(line[:shortcut_len])
+            if candidate is not None and len(line) >= shortcut_len and (found is None or candidate < found):
+                found = candidate
+
+        if found is not None:
+            _, shortcut, expansion = found
+
+            # If the next character after the shortcut isn't a space, then insert one
+            shortcut_len = len(shortcut)
+            if len(line) == shortcut_len or line[shortcut_len] != ' ':
+                expansion += ' '
+
+            # Expand the shortcut
+            line = expansion + line[shortcut_len:]
         return line
 
+    def _build_shortcut_lookup(self) -> None:
+        """Index the shortcuts by their text so _expand() only has to check one prefix of the line per length"""
+        self._shortcut_lookup = dict()
+        for priority, (shortcut, expansion) in enumerate(self.shortcuts):
+            # keep the first occurrence of a duplicate shortcut, since that's the one which would match
+            self._shortcut_lookup.setdefault(shortcut, (priority, shortcut, expansion))
+        self._shortcut_lengths = sorted({len(shortcut) for shortcut in self._shortcut_lookup}, reverse=True)
+
     @staticmethod
     def _command_and_args(tokens: List[str]) -> Tuple[str, str]:
         """Given a list of tokens, return a tuple of the command
@@ -670,6 +1086,22 @@ class StatementParser:
 
         return command, args
 
+    @staticmethod
+    def _build_punctuation_pattern(punctuation: List[str]) -> Optional[Pattern]:
+        """Build the pattern the lexer uses to split a word into runs of non-punctuation
+        characters and runs of a single repeated punctuation character.
+
+        Only single characters act as punctuation, which matches how _split_on_punctuation()
+        compares one character at a time.
+
+        :param punctuation: the punctuation strings
+        :return: the compiled pattern or None if there is no punctuation
+        """
+        punctuation_chars = ''.join(sorted({re.escape(x) for x in punctuation if len(x) == 1}))
+        if not punctuation_chars:
+            return None
+        return re.compile(r'[^{0}]+|([{0}])\1*'.format(punctuation_chars))
+
     def _split_on_punctuation(self, tokens: List[str]) -> List[str]:
         """Further splits tokens from a command line using punctuation characters
 
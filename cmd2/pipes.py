@@ -0,0 +1,233 @@
+# coding=utf-8
+"""
+In-process pipes, which connect a command's output to the input of filter commands running in other threads
+"""
+import collections
+import queue
+import threading
+from typing import Callable, Iterator, List, Optional
+
+from . import jobs
+
+
+class PipeStdin(threading.local):
+    """Holds the stream which a filter command's thread uses as Cmd.stdin"""
+    # None in threads which aren't running a filter. Defining it here keeps reads from raising AttributeError.
+    stream = None
+
+
+class Pipe(object):
+    """
+    Carries text from a writer in one thread to a reader in another. Written strings are passed along as they
+    are, a batch at a time, through a bounded queue. A writer which gets too far ahead of the reader blocks.
+    """
+    # Written strings are collected until they add up to this many characters and then sent as a batch
+    BATCH_SIZE = 65536
+
+    # The most batches which can wait to be read
+    MAX_BATCHES = 16
+
+    def __init__(self) -> None:
+        self._queue = queue.Queue(self.MAX_BATCHES)
+        self.writer = PipeWriter(self)
+        self.reader = PipeReader(self)
+
+        # Set once the reader is closed, after which writing raises BrokenPipeError
+        self.reader_closed = False
+
+    def send(self, batch: Optional[List[str]]) -> None:
+        """Send a batch of strings to the reader or None to end the input"""
+        if self.reader_closed:
+            raise BrokenPipeError('the command reading the pipe has finished')
+        self._queue.put(batch)
+
+    def receive(self) -> Optional[List[str]]:
+        """Wait for the next batch of strings, which is None at the end of the input"""
+        return self._queue.get()
+
+    def discard(self) -> None:
+        """Drop any batches which are waiting, so a writer blocked on a full queue can continue"""
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class PipeWriter(object):
+    """The writing end of a Pipe, which a command uses as its stdout"""
+    def __init__(self, pipe: Pipe) -> None:
+        self._pipe = pipe
+        self._batch = []
+        self._batch_len = 0
+        self.closed = False
+
+    def write(self, s: str) -> None:
+        """Add str to the current batch and send the batch once it is full"""
+        if not isinstance(s, str):
+            raise TypeError('write() argument must be str, not {}'.format(type(s)))
+        if self.closed:
+            raise ValueError('write to closed pipe')
+        if s:
+            self._batch.append(s)
+            self._batch_len += len(s)
+            if self._batch_len >= Pipe.BATCH_SIZE:
+                self.flush()
+
+    def flush(self) -> None:
+        """Send what has been written so far"""
+        if self._batch:
+            batch = self._batch
+            self._batch = []
+            self._batch_len = 0
+            self._pipe.send(batch)
+
+    def close(self) -> None:
+        """Send what has been written so far and end the reader's input"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            self._batch = []
+            if not self._pipe.reader_closed:
+                self._pipe.send(None)
+
+    def isatty(self) -> bool:
+        return False
+
+    @property
+    def line_buffering(self) -> bool:
+        return False
+
+
+class PipeReader(object):
+    """
+    The reading end of a Pipe, which a filter command reads from as its stdin. Like a text file, it can be read
+    whole with read() or a line at a time with readline() or iteration, where lines keep their line endings.
+    """
+    def __init__(self, pipe: Pipe) -> None:
+        self._pipe = pipe
+        self._strings = collections.deque()  # Strings received but not read yet
+        self._lines = collections.deque()  # Lines split from those strings but not read yet
+        self._partial = []  # Start of a line whose end hasn't been received
+        self._at_eof = False
+        self.closed = False
+
+    def _next_string(self) -> Optional[str]:
+        """Return the next string which was written or None at the end of the input"""
+        while not self._strings:
+            if self._at_eof:
+                return None
+            batch = self._pipe.receive()
+            if batch is None:
+                self._at_eof = True
+            else:
+                self._strings.extend(batch)
+        return self._strings.popleft()
+
+    def readline(self) -> str:
+        """Read the next line, including its line ending. Returns '' at the end of the input."""
+        while not self._lines:
+            s = self._next_string()
+            if s is None:
+                line = ''.join(self._partial)
+                self._partial = []
+                return line
+
+            # A string which is exactly one line, like those written by poutput(), is passed along without a copy
+            end = s.find('\n')
+            if end == len(s) - 1 and not self._partial:
+                return s
+            self._split_lines(s, end)
+        return self._lines.popleft()
+
+    def _split_lines(self, s: str, end: int) -> None:
+        """Split a string into lines, the first of which ends at index end, or -1 if the string has no newline"""
+        start = 0
+        while end >= 0:
+            line = s[start:end + 1]
+            if self._partial:
+                self._partial.append(line)
+                line = ''.join(self._partial)
+                self._partial = []
+            self._lines.append(line)
+            start = end + 1
+            end = s.find('\n', start)
+        if start < len(s):
+            self._partial.append(s[start:] if start else s)
+
+    def read(self, size: int = -1) -> str:
+        """Read the rest of the input. Reading a limited number of characters isn't supported."""
+        if size is not None and size >= 0:
+            raise ValueError('PipeReader only supports reading all of the input')
+        pieces = list(self._lines)
+        self._lines.clear()
+        pieces.extend(self._partial)
+        self._partial = []
+        while True:
+            s = self._next_string()
+            if s is None:
+                return ''.join(pieces)
+            pieces.append(s)
+
+    def readlines(self) -> List[str]:
+        """Read the remaining lines"""
+        return list(self)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the remaining lines. This inlines readline() for strings which are already waiting."""
+        lines = self._lines
+        strings = self._strings
+        while True:
+            if lines:
+                yield lines.popleft()
+            elif strings and not self._partial:
+                s = strings.popleft()
+                end = s.find('\n')
+                if end == len(s) - 1:
+                    yield s
+                else:
+                    self._split_lines(s, end)
+            else:
+                line = self.readline()
+                if not line:
+                    return
+                yield line
+
+    def close(self) -> None:
+        """Stop reading. Writing to the pipe afterward raises BrokenPipeError."""
+        self.closed = True
+        self._pipe.reader_closed = True
+        self._pipe.discard()
+
+    def isatty(self) -> bool:
+        return False
+
+
+class Pipeline(object):
+    """
+    The filter commands an in-process pipe runs, each in a thread of its own. It stands in for the ProcReader
+    of a pipe to a shell command, so Cmd can wait for it and forward Ctrl-C to it the same way.
+    """
+    def __init__(self, threads: List[threading.Thread], finish: Callable[[], None]) -> None:
+        """
+        Initializer
+        :param threads: the started threads running the filter commands
+        :param finish: called once the filters have finished to close what the last one's output went to
+        """
+        self.threads = threads
+        self._finish = finish
+
+    def send_sigint(self) -> None:
+        """Interrupt the filter commands by raising KeyboardInterrupt in their threads"""
+        for thread in self.threads:
+            if thread.is_alive():
+                jobs._raise_in_thread(thread, KeyboardInterrupt)
+
+    def wait(self) -> None:
+        """Wait for the filter commands to finish, once the writer feeding the first one has been closed"""
+        for thread in self.threads:
+            thread.join()
+        self._finish()
@@ -1,6 +1,8 @@
 #
 # coding=utf-8
 """Classes for the cmd2 plugin system"""
+from typing import Any, Callable, Optional, Sequence
+
 import attr
 
 
@@ -25,3 +27,32 @@ class PostcommandData:
 class CommandFinalizationData:
     stop = attr.ib()
     statement = attr.ib()
+
+
+def compile_hooks(hooks: Sequence[Callable[[Any], Any]], stop_early: bool = False) -> Optional[Callable[[Any], Any]]:
+    """Combine the hooks of one stage into a single callable which passes a data object through each hook in order.
+
+    :param hooks: the hook functions registered for the stage in the order they run
+    :param stop_early: if True, the remaining hooks are skipped once one returns data whose stop attribute is True
+    :return: the combined callable or None if there are no hooks, in which case callers can skip creating
+             the data object altogether
+    """
+    hooks = tuple(hooks)
+    if not hooks:
+        return None
+    if len(hooks) == 1:
+        return hooks[0]
+
+    if stop_early:
+        def run_hooks(data: Any) -> Any:
+            for func in hooks:
+                data = func(data)
+                if data.stop:
+                    break
+            return data
+    else:
+        def run_hooks(data: Any) -> Any:
+            for func in hooks:
+                data = func(data)
+            return data
+    return run_hooks
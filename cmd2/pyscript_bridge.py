@@ -67,10 +67,15 @@ class PyscriptBridge(object):
         self._cmd2_app = cmd2_app
         self.cmd_echo = False
 
+        # The most bytes of stdout and of stderr kept from each command, or None for no limit.
+        # Once a command's output goes past this, its oldest output is discarded.
+        self.max_capture_bytes = None
+
     def __dir__(self):
         """Return a custom set of attribute names"""
         attributes = []
         attributes.insert(0, 'cmd_echo')
+        attributes.insert(1, 'max_capture_bytes')
         return attributes
 
     def __call__(self, command: str, echo: Optional[bool] = None) -> CommandResult:
@@ -85,13 +90,13 @@ class PyscriptBridge(object):
             echo = self.cmd_echo
 
         # This will be used to capture _cmd2_app.stdout and sys.stdout
-        copy_cmd_stdout = StdSim(self._cmd2_app.stdout, echo)
+        copy_cmd_stdout = StdSim(self._cmd2_app.stdout, echo, max_bytes=self.max_capture_bytes)
 
         # Pause the storing of stdout until onecmd_plus_hooks enables it
         copy_cmd_stdout.pause_storage = True
 
         # This will be used to capture sys.stderr
-        copy_stderr = StdSim(sys.stderr, echo)
+        copy_stderr = StdSim(sys.stderr, echo, max_bytes=self.max_capture_bytes)
 
         self._cmd2_app._last_result = None
 
@@ -105,6 +110,6 @@ class PyscriptBridge(object):
 
         # Save the output. If stderr is empty, set it to None.
         result = CommandResult(stdout=copy_cmd_stdout.getvalue(),
-                               stderr=copy_stderr.getvalue() if copy_stderr.getvalue() else None,
+                               stderr=copy_stderr.getvalue() if copy_stderr.size else None,
                                data=self._cmd2_app._last_result)
         return result
@@ -0,0 +1,203 @@
+# coding=utf-8
+"""
+Latency statistics for commands run by cmd2.Cmd.onecmd_plus_hooks()
+"""
+import time
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    from time import perf_counter_ns as clock_ns
+except ImportError:  # pragma: no cover
+    # Python 3.6 and earlier
+    def clock_ns() -> int:
+        """Return the value of a performance counter in nanoseconds"""
+        return int(time.perf_counter() * 1000000000)
+
+# Phases of a command which are timed, in the order they run
+PHASE_PARSE = 'parse'
+PHASE_POSTPARSING = 'postparsing'
+PHASE_REDIRECTION = 'redirection'
+PHASE_PRECMD = 'precmd'
+PHASE_COMMAND = 'command'
+PHASE_POSTCMD = 'postcmd'
+PHASE_FINALIZATION = 'finalization'
+PHASES = (PHASE_PARSE, PHASE_POSTPARSING, PHASE_REDIRECTION, PHASE_PRECMD, PHASE_COMMAND, PHASE_POSTCMD,
+          PHASE_FINALIZATION)
+
+# Name statistics are kept under once the maximum number of commands are being tracked
+OTHER_COMMANDS = '<other>'
+
+# Each power of two is split into 2 ** _SUB_BUCKET_BITS buckets, so a bucket's width is at most a quarter
+# of its lower bound. Durations of 2 ** 40 ns (about 18 minutes) or more all go in the last bucket.
+_SUB_BUCKET_BITS = 2
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_MAX_EXPONENT = 40 - _SUB_BUCKET_BITS
+_NUM_BUCKETS = (_MAX_EXPONENT + 2) * _SUB_BUCKETS
+
+
+def _bucket_index(duration: int) -> int:
+    """Return the index of the histogram bucket a duration in nanoseconds falls in"""
+    if duration < _SUB_BUCKETS:
+        return max(duration, 0)
+    exponent = duration.bit_length() - 1 - _SUB_BUCKET_BITS
+    if exponent > _MAX_EXPONENT:
+        return _NUM_BUCKETS - 1
+    return exponent * _SUB_BUCKETS + (duration >> exponent)
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """Return the lower bound and exclusive upper bound in nanoseconds of a histogram bucket"""
+    if index < 2 * _SUB_BUCKETS:
+        return index, index + 1
+    exponent = index // _SUB_BUCKETS - 1
+    mantissa = index - exponent * _SUB_BUCKETS
+    return mantissa << exponent, (mantissa + 1) << exponent
+
+
+class LatencyHistogram(object):
+    """Histogram of durations in nanoseconds which uses a fixed number of logarithmic buckets"""
+    __slots__ = ['count', 'total', 'min', 'max', '_buckets']
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self._buckets = [0] * _NUM_BUCKETS
+
+    def add(self, duration: int) -> None:
+        """Add a duration in nanoseconds"""
+        if self.count:
+            if duration < self.min:
+                self.min = duration
+            elif duration > self.max:
+                self.max = duration
+        else:
+            self.min = self.max = duration
+        self.count += 1
+        self.total += duration
+
+        # _bucket_index() inlined since this runs for every phase of every command
+        exponent = duration.bit_length() - 1 - _SUB_BUCKET_BITS
+        if exponent <= 0:
+            index = max(duration, 0)
+        elif exponent > _MAX_EXPONENT:
+            index = _NUM_BUCKETS - 1
+        else:
+            index = exponent * _SUB_BUCKETS + (duration >> exponent)
+        self._buckets[index] += 1
+
+    def percentile(self, percent: float) -> int:
+        """
+        Estimate a percentile of the durations
+        :param percent: the percentile from 0 to 100
+        :return: the midpoint of the bucket the percentile falls in, limited to the smallest and largest durations
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, bucket_count in enumerate(self._buckets):
+            seen += bucket_count
+            if seen >= rank:
+                lower, upper = _bucket_bounds(index)
+                return int(min(max((lower + upper - 1) // 2, self.min), self.max))
+        return self.max  # pragma: no cover
+
+
+class CommandStats(object):
+    """Call and error counts and latency histograms for one command"""
+    __slots__ = ['calls', 'errors', 'latency', 'phases']
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+
+        # Time spent running the whole command
+        self.latency = LatencyHistogram()
+
+        # Time spent in each phase which has run, keyed by phase name
+        self.phases = {}
+
+
+class CommandTimer(object):
+    """Times the phases of one command as it runs"""
+    __slots__ = ['_last', 'phases']
+
+    def __init__(self) -> None:
+        self._last = clock_ns()
+
+        # Nanoseconds spent in each phase, keyed by phase name
+        self.phases = {}
+
+    def mark(self, phase: str) -> None:
+        """Charge the time since the last mark, or since the timer was created, to a phase"""
+        now = clock_ns()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+        self._last = now
+
+
+class StatsCollector(object):
+    """Latency statistics for each command run, which use a bounded amount of memory"""
+
+    def __init__(self, max_commands: int = 1000) -> None:
+        """
+        :param max_commands: the most commands to keep separate statistics for. After this, new commands
+                             are combined under OTHER_COMMANDS.
+        """
+        self.max_commands = max_commands
+
+        # CommandStats keyed by command name
+        self._commands = {}
+
+    def record(self, command: str, timer: CommandTimer, error: bool = False) -> None:
+        """
+        Add a command which has finished running
+        :param command: the name of the command
+        :param timer: the timer which timed the command's phases
+        :param error: True if the command failed with an exception
+        """
+        command_stats = self._commands.get(command)
+        if command_stats is None:
+            if len(self._commands) >= self.max_commands:
+                command = OTHER_COMMANDS
+            command_stats = self._commands.setdefault(command, CommandStats())
+
+        command_stats.calls += 1
+        if error:
+            command_stats.errors += 1
+
+        for phase, duration in timer.phases.items():
+            histogram = command_stats.phases.get(phase)
+            if histogram is None:
+                histogram = command_stats.phases[phase] = LatencyHistogram()
+            histogram.add(duration)
+        command_stats.latency.add(sum(timer.phases.values()))
+
+    def get(self, command: str) -> Optional[CommandStats]:
+        """Return the statistics for a command or None if it hasn't been recorded"""
+        return self._commands.get(command)
+
+    def items(self) -> Iterator[Tuple[str, CommandStats]]:
+        """Iterate over the recorded commands and their statistics"""
+        return iter(list(self._commands.items()))
+
+    def reset(self) -> None:
+        """Discard all statistics"""
+        self._commands.clear()
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+
+def format_duration(duration: int) -> str:
+    """Format a duration in nanoseconds with units which keep it short"""
+    for divisor, unit in ((1000000000, 's'), (1000000, 'ms'), (1000, 'us')):
+        if duration >= divisor:
+            return '{:.3g} {}'.format(duration / divisor, unit)
+    return '{} ns'.format(duration)
+
+
+def phase_order(phases: List[str]) -> List[str]:
+    """Sort phase names into the order the phases run"""
+    return sorted(phases, key=lambda phase: PHASES.index(phase) if phase in PHASES else len(PHASES))
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+Measuring text as it is displayed in a terminal. Most text cmd2 writes is plain ASCII without ANSI escape
+sequences, so those cases are handled without running a regular expression or measuring each character.
+"""
+import functools
+import re
+from typing import Iterable, List
+
+from wcwidth import wcswidth
+
+from . import constants
+
+# Starts every ANSI escape sequence
+ESC = '\x1b'
+
+# The number of strings width() remembers the width of when they aren't plain ASCII. Completion matches,
+# command names, and prompts are measured over and over, and wcswidth() looks up every character.
+WIDTH_CACHE_SIZE = 4096
+
+if hasattr(str, 'isascii'):
+    def is_plain_ascii(text: str) -> bool:
+        """Return whether a string only contains printable ASCII characters, which are one column wide each"""
+        return text.isascii() and text.isprintable()
+else:  # pragma: no cover
+    _PLAIN_ASCII_RE = re.compile(r'[\x20-\x7e]*\Z')
+
+    def is_plain_ascii(text: str) -> bool:
+        """Return whether a string only contains printable ASCII characters, which are one column wide each"""
+        return _PLAIN_ASCII_RE.match(text) is not None
+
+
+def strip_ansi(text: str) -> str:
+    """Strip ANSI escape codes from a string. A string without any is returned as it is.
+
+    :param text: string which may contain ANSI escape codes
+    :return: the same string with any ANSI escape codes removed
+    """
+    if ESC not in text:
+        return text
+    return constants.ANSI_ESCAPE_RE.sub('', text)
+
+
+@functools.lru_cache(maxsize=WIDTH_CACHE_SIZE)
+def _cached_width(text: str) -> int:
+    """Measure a string which has ANSI escape codes or isn't plain ASCII"""
+    text = strip_ansi(text)
+    if is_plain_ascii(text):
+        return len(text)
+    return wcswidth(text)
+
+
+def width(text: str) -> int:
+    """Return the number of columns a string takes up in a terminal, ignoring ANSI escape codes.
+
+    :param text: the string being measured
+    :return: the width, or -1 if the string contains a non-printable character, like wcswidth()
+    """
+    if ESC not in text and is_plain_ascii(text):
+        return len(text)
+    return _cached_width(text)
+
+
+def widths(texts: Iterable[str]) -> List[int]:
+    """Return the width of each string, as width() would measure it.
+
+    When all of the strings are plain ASCII, which is checked once for all of them, their lengths are returned.
+    """
+    texts = list(texts)
+    joined = ''.join(texts)
+    if ESC not in joined and is_plain_ascii(joined):
+        return list(map(len, texts))
+    return [width(text) for text in texts]
+
+
+def max_width(texts: Iterable[str], default: int = 0) -> int:
+    """Return the width of the widest string, or default if there are none"""
+    return max(widths(texts), default=default)
+
+
+def width_cache_info():
+    """Return the hits, misses, maxsize, and currsize of the cache width() uses, as functools.lru_cache reports them"""
+    return _cached_width.cache_info()
@@ -1,18 +1,24 @@
 # coding=utf-8
 """Shared utility functions"""
 
+import bz2
+import codecs
 import collections
+import contextlib
+import gzip
+import io
+import lzma
 import os
 import re
 import subprocess
 import sys
 import threading
 import unicodedata
-from typing import Any, Iterable, List, Optional, TextIO, Union
-
-from wcwidth import wcswidth
+import zlib
+from typing import Any, IO, Iterable, Iterator, List, Optional, TextIO, Union
 
 from . import constants
+from . import text_metrics
 
 
 def strip_ansi(text: str) -> str:
@@ -21,17 +27,16 @@ def strip_ansi(text: str) -> str:
     :param text: string which may contain ANSI escape codes
     :return: the same string with any ANSI escape codes removed
     """
-    return constants.ANSI_ESCAPE_RE.sub('', text)
+    return text_metrics.strip_ansi(text)
 
 
 def ansi_safe_wcswidth(text: str) -> int:
     """
-    Wraps wcswidth to make it compatible with colored strings
+    Wraps wcswidth to make it compatible with colored strings. See text_metrics.width().
 
     :param text: the string being measured
     """
-    # Strip ANSI escape codes since they cause wcswidth to return -1
-    return wcswidth(strip_ansi(text))
+    return text_metrics.width(text)
 
 
 def is_quoted(arg: str) -> bool:
@@ -155,37 +160,69 @@ def is_text_file(file_path: str) -> bool:
     :param file_path: path to the file being checked
     :return: True if the file is a text file, False if it is binary.
     """
-    import codecs
-
     expanded_path = os.path.abspath(os.path.expanduser(file_path.strip()))
     valid_text_file = False
 
-    # Check if the file is ASCII
     try:
-        with codecs.open(expanded_path, encoding='ascii', errors='strict') as f:
-            # Make sure the file has at least one line of text
-            # noinspection PyUnusedLocal
-            if sum(1 for line in f) > 0:
-                valid_text_file = True
-    except OSError:  # pragma: no cover
+        # ASCII is a subset of UTF-8, so one pass validates both. Make sure the file has at least one line of text.
+        for _ in read_text_lines(expanded_path):
+            valid_text_file = True
+    except OSError:
         pass
     except UnicodeDecodeError:
-        # The file is not ASCII. Check if it is UTF-8.
-        try:
-            with codecs.open(expanded_path, encoding='utf-8', errors='strict') as f:
-                # Make sure the file has at least one line of text
-                # noinspection PyUnusedLocal
-                if sum(1 for line in f) > 0:
-                    valid_text_file = True
-        except OSError:  # pragma: no cover
-            pass
-        except UnicodeDecodeError:
-            # Not UTF-8
-            pass
+        valid_text_file = False
 
     return valid_text_file
 
 
+def read_text_lines(file_path: str, *, use_mmap: bool = False) -> Iterator[str]:
+    """Yield the lines of an ASCII or UTF-8 encoded text file without their line endings.
+
+    Each byte of the file is read once and the encoding is validated one line at a time as the lines are
+    yielded, so large files are never held in memory. Lines are split the same way str.splitlines() splits them.
+
+    :param file_path: path to the file being read
+    :param use_mmap: if True, read the file through a read-only memory map instead of a buffered file
+    :raises OSError: if the file can't be opened
+    :raises UnicodeDecodeError: if a line isn't valid UTF-8. Its reason gives the 1-based line number.
+    """
+    with open(file_path, 'rb') as f:
+        if use_mmap:
+            import mmap
+            # Empty files can't be memory-mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with contextlib.closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as mapped:
+                yield from _decode_lines(iter(mapped.readline, b''))
+        else:
+            yield from _decode_lines(f)
+
+
+def _decode_lines(raw_lines: Iterable[bytes]) -> Iterator[str]:
+    """Decode lines of UTF-8 bytes split at newline bytes and yield their text split with str.splitlines()"""
+    # A newline byte never occurs inside a multi-byte UTF-8 sequence, so each line can be decoded on its own
+    for line_number, raw_line in enumerate(raw_lines, start=1):
+        try:
+            line = raw_line.decode('utf-8')
+        except UnicodeDecodeError as ex:
+            raise UnicodeDecodeError(ex.encoding, ex.object, ex.start, ex.end,
+                                     'invalid text on line {}'.format(line_number)) from None
+        yield from line.splitlines()
+
+
+def read_stream_lines(stream: TextIO) -> Iterator[str]:
+    """Yield the lines of a text stream without their line endings.
+
+    Lines are read through the stream's text layer, so text it has already buffered is included and its newline
+    translation applies. A stream from open() or sys.stdin reads whatever input is available in chunks, so lines
+    arriving slowly through a pipe are still yielded as soon as they are complete.
+
+    :param stream: the stream being read
+    """
+    for line in stream:
+        yield line.rstrip('\r\n')
+
+
 def remove_duplicates(list_to_prune: List) -> List:
     """Removes duplicates from a list while preserving order of the items.
 
@@ -288,26 +325,47 @@ def find_editor() -> str:
     return editor
 
 
+_OVERFLOW_POLICIES = (constants.OVERFLOW_TRUNCATE_HEAD, constants.OVERFLOW_TRUNCATE_TAIL, constants.OVERFLOW_SPILL)
+
+
 class StdSim(object):
     """
     Class to simulate behavior of sys.stdout or sys.stderr.
     Stores contents in internal buffer and optionally echos to the inner stream it is simulating.
+
+    The contents are kept in chunks, so they grow without being copied and are decoded only as they are read.
+    Setting max_bytes caps how many bytes are kept in memory. What happens to output beyond the cap depends on
+    overflow:
+
+    - constants.OVERFLOW_TRUNCATE_HEAD discards the oldest output to keep the most recent max_bytes
+    - constants.OVERFLOW_TRUNCATE_TAIL keeps the first max_bytes and discards the rest
+    - constants.OVERFLOW_SPILL moves the contents to a temporary file and keeps everything there
     """
     def __init__(self, inner_stream, echo: bool = False,
-                 encoding: str = 'utf-8', errors: str = 'replace') -> None:
+                 encoding: str = 'utf-8', errors: str = 'replace', *,
+                 max_bytes: Optional[int] = None, overflow: str = constants.OVERFLOW_TRUNCATE_HEAD) -> None:
         """
         Initializer
         :param inner_stream: the wrapped stream. Should be a TextIO or StdSim instance.
         :param echo: if True, then all input will be echoed to inner_stream
         :param encoding: codec for encoding/decoding strings (defaults to utf-8)
         :param errors: how to handle encoding/decoding errors (defaults to replace)
+        :param max_bytes: the most bytes to keep in memory or None for no limit
+        :param overflow: what to do with output beyond max_bytes, one of the constants.OVERFLOW_* values
+        :raises ValueError: if overflow isn't a known policy or max_bytes is negative
         """
+        if overflow not in _OVERFLOW_POLICIES:
+            message = "overflow must be one of '{}', '{}', or '{}'".format(*_OVERFLOW_POLICIES)
+            raise ValueError(message)
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError('max_bytes must not be negative')
+
         self.inner_stream = inner_stream
         self.echo = echo
         self.encoding = encoding
         self.errors = errors
         self.pause_storage = False
-        self.buffer = ByteBuf(self)
+        self.buffer = ByteBuf(self, max_bytes, overflow)
 
     def write(self, s: str) -> None:
         """Add str to internal bytes buffer and if echo is True, echo contents to inner stream"""
@@ -315,17 +373,32 @@ class StdSim(object):
             raise TypeError('write() argument must be str, not {}'.format(type(s)))
 
         if not self.pause_storage:
-            self.buffer.byte_buf += s.encode(encoding=self.encoding, errors=self.errors)
+            self.buffer.store(s.encode(encoding=self.encoding, errors=self.errors))
         if self.echo:
             self.inner_stream.write(s)
 
     def getvalue(self) -> str:
-        """Get the internal contents as a str"""
-        return self.buffer.byte_buf.decode(encoding=self.encoding, errors=self.errors)
+        """Get the internal contents as a str. Only what was written since the last call is decoded."""
+        return self.buffer._decode()
 
     def getbytes(self) -> bytes:
         """Get the internal contents as bytes"""
-        return bytes(self.buffer.byte_buf)
+        return self.buffer.byte_buf
+
+    def iter_lines(self) -> Iterator[str]:
+        """Yield the lines of the internal contents without their line endings, decoding one chunk at a time"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(self.errors)
+        pending = ''
+        for chunk in self.buffer._iter_chunks():
+            text = decoder.decode(chunk)
+            if text:
+                lines = (pending + text).split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line.rstrip('\r')
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending.rstrip('\r')
 
     def read(self) -> str:
         """Read from the internal contents as a str and then clear them out"""
@@ -341,7 +414,22 @@ class StdSim(object):
 
     def clear(self) -> None:
         """Clear the internal contents"""
-        self.buffer.byte_buf.clear()
+        self.buffer._clear()
+
+    @property
+    def size(self) -> int:
+        """The number of bytes in the internal contents"""
+        return self.buffer.size
+
+    @property
+    def truncated(self) -> int:
+        """The number of bytes discarded because of max_bytes since the contents were last cleared"""
+        return self.buffer.truncated
+
+    @property
+    def spilled(self) -> bool:
+        """True if the internal contents have been moved to a temporary file"""
+        return self.buffer.spill_file is not None
 
     def isatty(self) -> bool:
         """StdSim only considered an interactive stream if `echo` is True and `inner_stream` is a tty."""
@@ -368,6 +456,117 @@ class StdSim(object):
             return getattr(self.inner_stream, item)
 
 
+class BlockWriter(object):
+    """
+    Wraps a text stream and passes what is written to it in blocks of at least a given size.
+    The block being collected is flushed before anything else can write to the stream through
+    its file descriptor or binary buffer.
+    """
+    def __init__(self, inner_stream: TextIO, block_size: int = 65536) -> None:
+        """
+        Initializer
+        :param inner_stream: the wrapped stream
+        :param block_size: the number of characters to collect before writing them to inner_stream
+        """
+        self.inner_stream = inner_stream
+        self.block_size = block_size
+        self._block = []
+        self._block_len = 0
+
+    def write(self, s: str) -> None:
+        """Add str to the current block and write the block to the inner stream once it is full"""
+        if not isinstance(s, str):
+            raise TypeError('write() argument must be str, not {}'.format(type(s)))
+        self._block.append(s)
+        self._block_len += len(s)
+        if self._block_len >= self.block_size:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        """Write the current block to the inner stream"""
+        if self._block:
+            block = ''.join(self._block)
+            self._block = []
+            self._block_len = 0
+            self.inner_stream.write(block)
+
+    def flush(self) -> None:
+        """Write the current block and flush the inner stream"""
+        self._write_block()
+        self.inner_stream.flush()
+
+    def fileno(self) -> int:
+        """Flush and return the inner stream's file descriptor, which something is about to write to directly"""
+        self.flush()
+        return self.inner_stream.fileno()
+
+    @property
+    def buffer(self):
+        """Flush and return the inner stream's binary buffer, which something is about to write to directly"""
+        self.flush()
+        return self.inner_stream.buffer
+
+    def __getattr__(self, item: str):
+        return getattr(self.inner_stream, item)
+
+
+class _ThreadStream(threading.local):
+    """The stream a thread set with ThreadLocalStream.set_stream()"""
+    # Defined here so threads which haven't set a stream read None without raising AttributeError
+    stream = None
+
+
+class ThreadLocalStream(object):
+    """
+    Stream which sends what each thread writes to the stream that thread set with set_stream(),
+    or to a default stream for threads which haven't set one.
+    """
+    def __init__(self, default_stream) -> None:
+        """
+        Initializer
+        :param default_stream: the stream used by threads which haven't set their own
+        """
+        self.default_stream = default_stream
+        self._local = _ThreadStream()
+
+    def set_stream(self, stream) -> None:
+        """Set the stream the current thread writes to. None returns the thread to the default stream."""
+        self._local.stream = None if stream is self.default_stream else stream
+
+    @property
+    def routed(self) -> bool:
+        """True if the current thread has set a stream of its own"""
+        return self._local.stream is not None
+
+    @property
+    def current_stream(self):
+        """The stream the current thread writes to"""
+        stream = self._local.stream
+        return self.default_stream if stream is None else stream
+
+    def write(self, s: str) -> None:
+        """Write to the current thread's stream"""
+        self.current_stream.write(s)
+
+    def flush(self) -> None:
+        """Flush the current thread's stream"""
+        self.current_stream.flush()
+
+    def isatty(self) -> bool:
+        """Return whether the current thread's stream is a tty"""
+        return self.current_stream.isatty()
+
+    def __getattr__(self, item: str):
+        return getattr(self.current_stream, item)
+
+
+def thread_stream(stream):
+    """Return the stream the current thread's writes to a stream end up in, looking through a ThreadLocalStream"""
+    if isinstance(stream, ThreadLocalStream):
+        return stream.current_stream
+    return stream
+
+
 class ByteBuf(object):
     """
     Used by StdSim to write binary data and stores the actual bytes written
@@ -375,16 +574,60 @@ class ByteBuf(object):
     # Used to know when to flush the StdSim
     NEWLINES = [b'\n', b'\r']
 
-    def __init__(self, std_sim_instance: StdSim) -> None:
-        self.byte_buf = bytearray()
+    # Small writes are collected into chunks of this many bytes
+    CHUNK_SIZE = 65536
+
+    def __init__(self, std_sim_instance: StdSim, max_bytes: Optional[int] = None,
+                 overflow: str = constants.OVERFLOW_TRUNCATE_HEAD) -> None:
         self.std_sim_instance = std_sim_instance
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+
+        # The number of bytes discarded because of max_bytes
+        self.truncated = 0
+
+        # Once the contents outgrow max_bytes with the spill policy, they are all kept in this file
+        self._spill_file = None
+
+        # Full chunks, which are never modified, followed by the chunk being filled. The size of the full chunks
+        # is tracked so small writes only have to add to the tail. Once spilled, it is the size of the file.
+        self._chunks = collections.deque()
+        self._chunks_size = 0
+        self._tail = bytearray()
+
+        # The last text returned by _decode() and the size of the contents it was decoded from
+        self._value = ''
+        self._value_size = 0
+
+        # Once the contents span several chunks, _decode() keeps the text of the first _decoded_size bytes
+        # and a decoder holding any incomplete character which follows them
+        self._text = ''
+        self._decoded_size = 0
+        self._decoder = None
+
+    @property
+    def size(self) -> int:
+        """The number of bytes stored"""
+        return self._chunks_size + len(self._tail)
+
+    @property
+    def spill_file(self) -> Optional[IO[bytes]]:
+        """The temporary file holding the contents once they outgrow max_bytes with the spill policy, otherwise None"""
+        return self._spill_file
+
+    @property
+    def byte_buf(self) -> bytes:
+        """A copy of the stored bytes"""
+        if not self._chunks and self._spill_file is None:
+            return bytes(self._tail)
+        return b''.join(self._iter_chunks())
 
     def write(self, b: bytes) -> None:
         """Add bytes to internal bytes buffer and if echo is True, echo contents to inner stream."""
         if not isinstance(b, bytes):
             raise TypeError('a bytes-like object is required, not {}'.format(type(b)))
         if not self.std_sim_instance.pause_storage:
-            self.byte_buf += b
+            self.store(b)
         if self.std_sim_instance.echo:
             self.std_sim_instance.inner_stream.buffer.write(b)
 
@@ -396,12 +639,230 @@ class ByteBuf(object):
                 if any(newline in b for newline in ByteBuf.NEWLINES):
                     self.std_sim_instance.flush()
 
+    def store(self, b: bytes) -> None:
+        """Store bytes without echoing them, applying the overflow policy once max_bytes is reached"""
+        # Fast path for the usual small write without a limit
+        if self.max_bytes is None and len(b) < ByteBuf.CHUNK_SIZE:
+            tail = self._tail
+            tail += b
+            if len(tail) >= ByteBuf.CHUNK_SIZE:
+                self._chunks.append(tail)
+                self._chunks_size += len(tail)
+                self._tail = bytearray()
+            return
+
+        if self._spill_file is not None:
+            self._spill_file.seek(0, os.SEEK_END)
+            self._spill_file.write(b)
+            self._chunks_size += len(b)
+            return
+
+        if self.max_bytes is not None and self.size + len(b) > self.max_bytes:
+            if self.overflow == constants.OVERFLOW_SPILL:
+                self._spill()
+                self.store(b)
+                return
+
+            if self.overflow == constants.OVERFLOW_TRUNCATE_TAIL:
+                keep = self.max_bytes - self.size
+                self.truncated += len(b) - keep
+                if not keep:
+                    return
+                b = b[:keep]
+            else:
+                self._append(b)
+                self._drop_head(self.size - self.max_bytes)
+                return
+
+        self._append(b)
+
+    def _append(self, b: bytes) -> None:
+        """Add bytes to the chunks in memory"""
+        if len(b) >= self.CHUNK_SIZE:
+            # Large writes become chunks of their own without being copied
+            if self._tail:
+                self._chunks.append(self._tail)
+                self._chunks_size += len(self._tail)
+                self._tail = bytearray()
+            self._chunks.append(b)
+            self._chunks_size += len(b)
+        else:
+            self._tail += b
+            if len(self._tail) >= self.CHUNK_SIZE:
+                self._chunks.append(self._tail)
+                self._chunks_size += len(self._tail)
+                self._tail = bytearray()
+
+    def _drop_head(self, count: int) -> None:
+        """Discard the oldest bytes in memory"""
+        self.truncated += count
+        while count:
+            if not self._chunks:
+                del self._tail[:count]
+                break
+            first = self._chunks[0]
+            if len(first) <= count:
+                self._chunks.popleft()
+                self._chunks_size -= len(first)
+                count -= len(first)
+            else:
+                self._chunks[0] = first[count:]
+                self._chunks_size -= count
+                break
+        self._reset_text()
+
+    def _spill(self) -> None:
+        """Move the chunks in memory to a temporary file"""
+        import tempfile
+        spill_file = tempfile.TemporaryFile()
+        size = self.size
+        for chunk in self._iter_chunks():
+            spill_file.write(chunk)
+        self._chunks.clear()
+        self._chunks_size = size
+        self._tail = bytearray()
+        self._spill_file = spill_file
+
+    def _iter_chunks(self, start: int = 0) -> Iterator[Union[bytes, bytearray]]:
+        """Yield the stored bytes in chunks, beginning at an offset"""
+        if self._spill_file is not None:
+            end = self.size
+            while start < end:
+                self._spill_file.seek(start)
+                chunk = self._spill_file.read(min(self.CHUNK_SIZE, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+            return
+
+        # Work from a snapshot in case another thread writes while this is iterating
+        chunks = list(self._chunks)
+        chunks.append(bytes(self._tail))
+        for chunk in chunks:
+            if start >= len(chunk):
+                start -= len(chunk)
+                continue
+            yield chunk[start:] if start else chunk
+            start = 0
+
+    def _decode(self) -> str:
+        """Return the stored bytes as text, decoding only the bytes stored since the last call"""
+        size = self.size
+        if size == self._value_size:
+            return self._value
+
+        sim = self.std_sim_instance
+        if not self._chunks and self._spill_file is None:
+            # Contents which fit in one chunk are quicker to decode whole
+            value = self._tail.decode(sim.encoding, sim.errors)
+        else:
+            if self._decoder is None:
+                self._decoder = codecs.getincrementaldecoder(sim.encoding)(sim.errors)
+
+            new_bytes = b''.join(self._iter_chunks(self._decoded_size))
+            self._text += self._decoder.decode(new_bytes)
+            self._decoded_size += len(new_bytes)
+            size = self._decoded_size
+
+            # An incomplete character at the end is decoded as if nothing will follow it
+            incomplete = self._decoder.getstate()[0]
+            value = self._text + incomplete.decode(sim.encoding, sim.errors) if incomplete else self._text
+
+        self._value = value
+        self._value_size = size
+        return value
+
+    def _reset_text(self) -> None:
+        """Forget the decoded text, which no longer matches the stored bytes"""
+        self._value = ''
+        self._value_size = 0
+        self._text = ''
+        self._decoded_size = 0
+        self._decoder = None
+
+    def _clear(self) -> None:
+        """Discard the stored bytes"""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        if self._chunks_size:
+            self._chunks.clear()
+            self._chunks_size = 0
+        self._tail = bytearray()
+        self.truncated = 0
+        if self._value_size or self._decoder is not None:
+            self._reset_text()
+
+
+class GzipOutputFile(gzip.GzipFile):
+    """GzipFile whose flush() doesn't end a compressed block, which would make the file grow"""
+    def flush(self, zlib_mode: int = zlib.Z_NO_FLUSH) -> None:
+        super().flush(zlib_mode)
+
+
+def open_output_file(path: str, append: bool = False, compress_level: Optional[int] = None) -> TextIO:
+    """
+    Open a text file for writing output. A file ending in .gz, .bz2, or .xz is compressed as it is written.
+    Appending to one adds a new compressed stream, which the command-line tools and Python's gzip, bz2, and lzma
+    modules read back as part of the same file.
+
+    The returned stream's binary buffer writes through the compressor, so bytes written to it are compressed too.
+
+    :param path: path of the file
+    :param append: if True, add to the end of the file instead of replacing it
+    :param compress_level: 0 to 9, where higher compresses more but more slowly. None uses the default of the
+                           format's command-line tool.
+    :return: the opened text stream
+    :raises OSError: if the file can't be opened
+    :raises ValueError: if compress_level isn't valid for the format
+    """
+    mode = 'ab' if append else 'wb'
+    extension = os.path.splitext(path)[1].lower()
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise ValueError('compression level must be from 0 to 9')
+
+    if extension == '.gz':
+        binary_file = GzipOutputFile(path, mode, compresslevel=6 if compress_level is None else compress_level)
+    elif extension == '.bz2':
+        binary_file = bz2.BZ2File(path, mode, compresslevel=9 if compress_level is None else compress_level)
+    elif extension == '.xz':
+        binary_file = lzma.LZMAFile(path, mode, preset=compress_level)
+    else:
+        return open(path, mode[0])
+
+    return io.TextIOWrapper(binary_file)
+
+
+def set_pipe_size(fd: int, size: int) -> bool:
+    """
+    Ask the OS to give a pipe a buffer of a given size, which lets large writes to the pipe go through with
+    fewer switches between the writing and reading processes. This is only supported on Linux.
+
+    :param fd: file descriptor of either end of the pipe
+    :param size: the buffer size in bytes. Unprivileged processes can't exceed /proc/sys/fs/pipe-max-size.
+    :return: True if the buffer size was set
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+
+    import fcntl
+    # fcntl.F_SETPIPE_SZ was added in Python 3.10
+    try:
+        fcntl.fcntl(fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), size)
+    except OSError:
+        return False
+    return True
+
 
 class ProcReader(object):
     """
     Used to captured stdout and stderr from a Popen process if any of those were set to subprocess.PIPE.
     If neither are pipes, then the process will run normally and no output will be captured.
     """
+    # The most bytes read from a pipe at once
+    READ_SIZE = 65536
+
     def __init__(self, proc: subprocess.Popen, stdout: Union[StdSim, TextIO],
                  stderr: Union[StdSim, TextIO]) -> None:
         """
@@ -414,11 +875,13 @@ class ProcReader(object):
         self._stdout = stdout
         self._stderr = stderr
 
+        # The threads are daemons so a process left running by the pipe command, which could keep a pipe open,
+        # doesn't stop the application from exiting
         self._out_thread = threading.Thread(name='out_thread', target=self._reader_thread_func,
-                                            kwargs={'read_stdout': True})
+                                            kwargs={'read_stdout': True}, daemon=True)
 
-        self._err_thread = threading.Thread(name='out_thread', target=self._reader_thread_func,
-                                            kwargs={'read_stdout': False})
+        self._err_thread = threading.Thread(name='err_thread', target=self._reader_thread_func,
+                                            kwargs={'read_stdout': False}, daemon=True)
 
         # Start the reader threads for pipes only
         if self._proc.stdout is not None:
@@ -470,13 +933,15 @@ class ProcReader(object):
         # The thread should have been started only if this stream was a pipe
         assert read_stream is not None
 
-        # Run until process completes
-        while self._proc.poll() is None:
-            # noinspection PyUnresolvedReferences
-            available = read_stream.peek()
-            if available:
-                read_stream.read(len(available))
-                self._write_bytes(write_stream, available)
+        # Each read blocks until the process writes more output or closes the pipe, and returns whatever
+        # is available. The thread sleeps while the process is quiet instead of polling it.
+        read = getattr(read_stream, 'read1', read_stream.read)
+        while True:
+            available = read(self.READ_SIZE)
+            # An empty read means the pipe was closed. Anything other than bytes isn't a real pipe.
+            if not available or not isinstance(available, bytes):
+                break
+            self._write_bytes(write_stream, available)
 
     @staticmethod
     def _write_bytes(stream: Union[StdSim, TextIO], to_write: bytes) -> None:
@@ -492,6 +957,48 @@ class ProcReader(object):
             pass
 
 
+class TerminalState(object):
+    """Snapshot of a terminal's termios attributes which can be restored without spawning a process"""
+    def __init__(self, fd: int, attributes: List[Any]) -> None:
+        """
+        Use TerminalState.save() instead of creating a TerminalState directly
+        :param fd: file descriptor of the terminal
+        :param attributes: termios attributes returned by termios.tcgetattr()
+        """
+        self.fd = fd
+        self.attributes = attributes
+
+    @classmethod
+    def save(cls, stream: Any) -> Optional['TerminalState']:
+        """
+        Snapshot the termios attributes of the terminal a stream is connected to
+        :param stream: the stream whose terminal is saved
+        :return: the saved state or None if the platform has no termios or the stream isn't a terminal
+        """
+        try:
+            import termios
+        except ImportError:  # pragma: no cover
+            return None
+
+        try:
+            fd = stream.fileno()
+            return cls(fd, termios.tcgetattr(fd))
+        except (AttributeError, OSError, ValueError, termios.error):
+            return None
+
+    def restore(self) -> bool:
+        """
+        Restore the saved termios attributes once pending output has been written
+        :return: True if the terminal was restored, False if this failed
+        """
+        import termios
+        try:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.attributes)
+        except (OSError, termios.error):
+            return False
+        return True
+
+
 class ContextFlag(object):
     """A context manager which is also used as a boolean flag value within the default sigint handler.
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+A simple example demonstrating commands and completers written with async def.
+
+cmd2 runs them on an asyncio event loop which stays open between commands, so objects bound to the loop,
+like the simulated connection pool below, are created once and reused by every command.
+
+async def needs Python 3.5 or later.
+"""
+import argparse
+import asyncio
+import random
+
+import cmd2
+from cmd2.argparse_completer import ACTION_ARG_CHOICES
+
+HOSTS = ['alpha.example.com', 'beta.example.com', 'gamma.example.com']
+
+
+class ConnectionPool(object):
+    """Stands in for the connection pool of an async client library"""
+    def __init__(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.requests = 0
+
+    async def query(self, host: str) -> str:
+        self.requests += 1
+        await asyncio.sleep(random.uniform(0.05, 0.2))
+        return 'up'
+
+
+class AsyncCommandsApp(cmd2.Cmd):
+    """Example cmd2 application with async commands"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pool = None
+
+    async def get_pool(self) -> ConnectionPool:
+        """Create the connection pool the first time a command needs it"""
+        if self.pool is None:
+            self.pool = ConnectionPool()
+        return self.pool
+
+    async def host_names(self):
+        """Async function which provides the choices for a host argument"""
+        await asyncio.sleep(0)
+        return HOSTS
+
+    status_parser = argparse.ArgumentParser()
+    setattr(status_parser.add_argument('hosts', nargs='+', help='hosts to query'), ACTION_ARG_CHOICES, host_names)
+
+    @cmd2.with_argparser(status_parser)
+    async def do_status(self, args):
+        """Query the status of hosts at the same time"""
+        pool = await self.get_pool()
+        results = await asyncio.gather(*[pool.query(host) for host in args.hosts])
+        for host, result in zip(args.hosts, results):
+            self.poutput('{}: {}'.format(host, result))
+
+    async def do_requests(self, _):
+        """Show how many requests the connection pool has made"""
+        pool = await self.get_pool()
+        self.poutput('{} requests made through one pool'.format(pool.requests))
+
+
+if __name__ == '__main__':
+    app = AsyncCommandsApp()
+    app.cmdloop()
@@ -84,6 +84,19 @@ def tox_clean(context):
     rmrf('.tox')
 namespace_clean.add_task(tox_clean, 'tox')
 
+@invoke.task
+def benchmark(context, output=None, compare=None, quick=False):
+    "Run the benchmark suite, optionally saving results as JSON and comparing them to a baseline"
+    cmdline = 'python benchmarks/suite.py'
+    if quick:
+        cmdline += ' --quick'
+    if output:
+        cmdline += ' -o {}'.format(output)
+    if compare:
+        cmdline += ' --compare {}'.format(compare)
+    context.run(cmdline)
+namespace.add_task(benchmark)
+
 
 #####
 #
@@ -21,6 +21,11 @@ if sys.version_info < (3, 5):
 else:
     from contextlib import redirect_stdout, redirect_stderr
 
+# Commands and completers written with async def are a syntax error before Python 3.5
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_async.py')
+
 # Prefer statically linked gnureadline if available (for macOS compatibility due to issues with libedit)
 try:
     import gnureadline as readline
@@ -36,8 +41,8 @@ except ImportError:
 # Help text for base cmd2.Cmd application
 BASE_HELP = """Documented commands (type help <topic>):
 ========================================
-alias  help     load   py        quit  shell
-edit   history  macro  pyscript  set   shortcuts
+alias  fg    history  kill  macro     profile  pyscript  set    shortcuts  wait
+edit   help  jobs     load  parallel  py       quit      shell  stats    
 """  # noqa: W291
 
 BASE_HELP_VERBOSE = """
@@ -45,16 +50,23 @@ Documented commands (type help <topic>):
 ================================================================================
 alias               Manage aliases
 edit                Edit a file in a text editor
+fg                  Wait for a background job to finish and print its output
 help                List available commands or provide detailed help for a specific command
 history             View, run, edit, save, or clear previously entered commands
+jobs                List background jobs
+kill                Kill background jobs
 load                Run commands in script file that is encoded as either ASCII or UTF-8 text
 macro               Manage macros
+parallel            Run thread-safe commands at the same time
+profile             Run a command under a profiler and report where it spent its time
 py                  Invoke Python command or shell
 pyscript            Run a Python script file inside the console
 quit                Exit this application
 set                 Set a settable parameter or show current settings of parameters
 shell               Execute a command as if at the OS prompt
 shortcuts           List available shortcuts
+stats               Show latency statistics for the commands which have run
+wait                Wait for background jobs to finish
 """
 
 # Help text for the history command
@@ -96,7 +108,8 @@ SHORTCUTS_TXT = """Shortcuts for other commands:
 """
 
 # Output from the show command with default settings
-SHOW_TXT = """colors: Terminal
+SHOW_TXT = """collect_stats: False
+colors: Terminal
 continuation_prompt: >
 debug: False
 echo: False
@@ -109,6 +122,7 @@ timing: False
 """
 
 SHOW_LONG = """
+collect_stats: False      # Record command latency statistics for the stats command
 colors: Terminal          # Allow colorized output (valid values: Terminal, Always, Never)
 continuation_prompt: >    # On 2nd+ line of input
 debug: False              # Show full error stack on error
@@ -0,0 +1,12 @@
+# flake8: noqa F821
+# This script limits how much output app() keeps from each command
+full = app('help').stdout
+
+app.max_capture_bytes = 20
+limited = app('help').stdout
+
+# The most recent output is kept
+if limited == full[-20:]:
+    print("PASSED")
+else:
+    print("FAILED")
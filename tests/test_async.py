@@ -0,0 +1,244 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing of commands and completers written with async def, which needs Python 3.5 or later.
+conftest.py skips collecting this module on older versions.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+
+import cmd2
+from cmd2 import utils
+from .conftest import base_app, complete_tester, run_cmd
+
+
+class AsyncApp(cmd2.Cmd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stdout = utils.StdSim(self.stdout)
+        self.loops = []
+
+    async def do_fetch(self, statement):
+        import asyncio
+        await asyncio.sleep(0)
+        self.loops.append(asyncio.get_event_loop())
+        self.poutput('fetched {}'.format(statement.args))
+
+    fetch_parser = argparse.ArgumentParser()
+    fetch_parser.add_argument('--stop', action='store_true')
+    fetch_parser.add_argument('item')
+
+    @cmd2.with_argparser(fetch_parser)
+    async def do_argfetch(self, args):
+        import asyncio
+        await asyncio.sleep(0)
+        self.poutput('fetched {}'.format(args.item))
+        return args.stop
+
+    async def do_fail(self, statement):
+        raise ValueError('async failure')
+
+    async def do_nested(self, statement):
+        self.onecmd_plus_hooks('fetch inner')
+
+    async def do_interrupted(self, statement):
+        import asyncio
+        self.cancelled = False
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+@pytest.fixture
+def async_app():
+    app = AsyncApp()
+    yield app
+    app.close_event_loop()
+
+def test_async_command(async_app):
+    out, err = run_cmd(async_app, 'fetch one')
+    assert out == ['fetched one']
+    assert [str(item) for item in async_app.history] == ['fetch one']
+
+def test_async_command_keeps_event_loop(async_app):
+    run_cmd(async_app, 'fetch one')
+    run_cmd(async_app, 'fetch two')
+    assert async_app.loops[0] is async_app.loops[1] is async_app.event_loop
+    assert not async_app.event_loop.is_closed()
+
+def test_async_command_argparser(async_app):
+    assert not async_app.onecmd_plus_hooks('argfetch one')
+    assert async_app.onecmd_plus_hooks('argfetch --stop two')
+    assert async_app.stdout.getvalue() == 'fetched one\nfetched two\n'
+
+def test_async_command_redirection(async_app):
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        run_cmd(async_app, 'fetch one > {}'.format(filename))
+        with open(filename) as f:
+            assert f.read() == 'fetched one\n'
+    finally:
+        os.remove(filename)
+
+def test_async_command_error(async_app):
+    out, err = run_cmd(async_app, 'fail')
+    assert 'async failure' in err[0]
+
+def test_async_command_hooks(async_app):
+    calls = []
+
+    def precmd_hook(data: cmd2.plugin.PrecommandData) -> cmd2.plugin.PrecommandData:
+        calls.append('precmd')
+        return data
+
+    def postcmd_hook(data: cmd2.plugin.PostcommandData) -> cmd2.plugin.PostcommandData:
+        calls.append('postcmd {}'.format(data.stop))
+        return data
+
+    async_app.register_precmd_hook(precmd_hook)
+    async_app.register_postcmd_hook(postcmd_hook)
+    async_app.onecmd_plus_hooks('argfetch --stop one')
+    assert calls == ['precmd', 'postcmd True']
+
+def test_async_command_nested_run(async_app):
+    out, err = run_cmd(async_app, 'nested')
+    assert out == []
+    assert any("Use 'await'" in line for line in err)
+
+def test_run_coroutine_interrupted(async_app):
+    def interrupt():
+        raise KeyboardInterrupt
+
+    async_app.event_loop.call_later(0.01, interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        async_app.run_coroutine(async_app.do_interrupted(''))
+    assert async_app.cancelled
+
+def test_run_coroutine_other_thread(async_app):
+    import asyncio
+    import threading
+    loop = async_app.event_loop
+    errors = []
+
+    def run():
+        try:
+            async_app.run_coroutine(asyncio.sleep(0))
+        except RuntimeError as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert 'thread' in str(errors[0])
+    assert not loop.is_closed()
+
+def test_close_event_loop(async_app):
+    loop = async_app.event_loop
+    async_app.close_event_loop()
+    assert loop.is_closed()
+    run_cmd(async_app, 'fetch one')
+    assert async_app.event_loop is not loop
+
+def test_close_event_loop_without_shutdown_asyncgens(base_app):
+    # Event loops before Python 3.6 don't have shutdown_asyncgens()
+    loop = mock.Mock(spec=['is_closed', 'close', 'run_until_complete'])
+    loop.is_closed.return_value = False
+    base_app._event_loop = loop
+    base_app.close_event_loop()
+    loop.close.assert_called_once_with()
+    loop.run_until_complete.assert_not_called()
+    assert base_app._event_loop is None
+
+def test_cmdloop_closes_event_loop(async_app):
+    async_app.cmdqueue = ['fetch one', 'quit']
+    with mock.patch.object(sys, 'argv', ['prog']):
+        async_app.cmdloop()
+    assert async_app.loops[0].is_closed()
+
+def test_parallel_refuses_async_command(capsys):
+    class ThreadSafeAsyncApp(cmd2.Cmd):
+        @cmd2.thread_safe
+        async def do_fetch(self, statement):
+            pass
+
+    app = ThreadSafeAsyncApp()
+    app.run_parallel(['fetch one'])
+    out, err = capsys.readouterr()
+    assert "'fetch' is an async command" in err
+
+def test_pipe_async_filter(capsys):
+    class AsyncFilterApp(cmd2.Cmd):
+        @cmd2.pipe_filter
+        async def do_async_filter(self, statement):
+            pass
+
+    app = AsyncFilterApp()
+    app.onecmd_plus_hooks('help | async_filter')
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert "'async_filter' is an async command, which can't be a filter" in err
+
+class AsyncCompletionsApp(cmd2.Cmd):
+    fetch_parser = argparse.ArgumentParser()
+
+    async def host_names(self):
+        import asyncio
+        await asyncio.sleep(0)
+        return ['host1', 'host2', 'other']
+
+    async def complete_item(self, text, line, begidx, endidx):
+        import asyncio
+        await asyncio.sleep(0)
+        return self.basic_complete(text, line, begidx, endidx, ['apple', 'apricot', 'banana'])
+
+    setattr(fetch_parser.add_argument('host'), cmd2.argparse_completer.ACTION_ARG_CHOICES, host_names)
+    setattr(fetch_parser.add_argument('item'), cmd2.argparse_completer.ACTION_ARG_CHOICES, ('complete_item',))
+
+    @cmd2.with_argparser(fetch_parser)
+    async def do_fetch(self, args):
+        pass
+
+    async def do_get(self, statement):
+        pass
+
+    async def complete_get(self, text, line, begidx, endidx):
+        import asyncio
+        await asyncio.sleep(0)
+        return self.basic_complete(text, line, begidx, endidx, ['alpha', 'beta'])
+
+@pytest.fixture
+def async_completions_app():
+    app = AsyncCompletionsApp()
+    yield app
+    app.close_event_loop()
+
+def test_async_completer(async_completions_app):
+    text = 'al'
+    line = 'get {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+    assert complete_tester(text, line, begidx, endidx, async_completions_app) is not None
+    assert async_completions_app.completion_matches == ['alpha ']
+
+def test_async_argparse_choices(async_completions_app):
+    text = 'ho'
+    line = 'fetch {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+    assert complete_tester(text, line, begidx, endidx, async_completions_app) is not None
+    assert async_completions_app.completion_matches == ['host1', 'host2']
+
+def test_async_argparse_completer(async_completions_app):
+    text = 'ap'
+    line = 'fetch host1 {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+    assert complete_tester(text, line, begidx, endidx, async_completions_app) is not None
+    assert async_completions_app.completion_matches == ['apple', 'apricot']
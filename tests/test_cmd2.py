@@ -293,6 +293,10 @@ def test_base_error(base_app):
     assert "is not a recognized command" in err[0]
 
 
+def drain_queued_commands(app):
+    """Remove all queued commands from an app without running them and return them"""
+    return list(iter(app._next_queued_command, None))
+
 def test_base_load(base_app, request):
     test_dir = os.path.dirname(request.module.__file__)
     filename = os.path.join(test_dir, 'script.txt')
@@ -301,13 +305,13 @@ def test_base_load(base_app, request):
     assert base_app._script_dir == []
     assert base_app._current_script_dir is None
 
-    # Run the load command, which populates the command queue and sets the script directory
+    # Run the load command, which queues the script's commands and sets the script directory
     run_cmd(base_app, 'load {}'.format(filename))
 
-    assert base_app.cmdqueue == ['help history', 'eos']
     sdir = os.path.dirname(filename)
     assert base_app._script_dir == [sdir]
     assert base_app._current_script_dir == sdir
+    assert drain_queued_commands(base_app) == ['help history', 'eos']
 
 def test_load_with_empty_args(base_app):
     # The way the load command works, we can't directly capture its stdout or stderr
@@ -359,6 +363,33 @@ def test_load_with_binary_file(base_app, request):
     assert base_app.cmdqueue == []
 
 
+def test_load_with_invalid_line(base_app, capsys):
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.write(fd, b'help\nshortcuts\nhelp \xff\nhistory\n')
+    os.close(fd)
+
+    try:
+        run_cmd(base_app, 'load {}'.format(filename))
+
+        # Lines before the invalid one are queued and the script ends at the invalid line
+        assert drain_queued_commands(base_app) == ['help', 'shortcuts', 'eos']
+        out, err = capsys.readouterr()
+        assert "is not an ASCII or UTF-8 encoded text file" in err
+        assert "line 3" in err
+    finally:
+        os.remove(filename)
+
+def test_load_with_mmap(base_app, request):
+    test_dir = os.path.dirname(request.module.__file__)
+    filename = os.path.join(test_dir, 'scripts', 'utf8.txt')
+    with open(filename, encoding='utf-8') as f:
+        expected = f.read().splitlines()
+    base_app.load_mmap_threshold = 0
+
+    run_cmd(base_app, 'load {}'.format(filename))
+    assert drain_queued_commands(base_app) == expected + ['eos']
+
+
 def test_load_with_utf8_file(base_app, request):
     test_dir = os.path.dirname(request.module.__file__)
     filename = os.path.join(test_dir, 'scripts', 'utf8.txt')
@@ -367,13 +398,13 @@ def test_load_with_utf8_file(base_app, request):
     assert base_app._script_dir == []
     assert base_app._current_script_dir is None
 
-    # Run the load command, which populates the command queue and sets the script directory
+    # Run the load command, which queues the script's commands and sets the script directory
     run_cmd(base_app, 'load {}'.format(filename))
 
-    assert base_app.cmdqueue == ['!echo γνωρίζω', 'eos']
     sdir = os.path.dirname(filename)
     assert base_app._script_dir == [sdir]
     assert base_app._current_script_dir == sdir
+    assert drain_queued_commands(base_app) == ['!echo γνωρίζω', 'eos']
 
 
 def test_load_nested_loads(base_app, request):
@@ -390,8 +421,10 @@ def test_load_nested_loads(base_app, request):
     # commands have been exhausted.
     initial_load = 'load ' + filename
     run_cmd(base_app, initial_load)
-    while base_app.cmdqueue:
-        base_app.onecmd_plus_hooks(base_app.cmdqueue.pop(0))
+    line = base_app._next_queued_command()
+    while line is not None:
+        base_app.onecmd_plus_hooks(line)
+        line = base_app._next_queued_command()
 
     # Check that the right commands were executed.
     expected = """
@@ -438,13 +471,13 @@ def test_base_relative_load(base_app, request):
     assert base_app._script_dir == []
     assert base_app._current_script_dir is None
 
-    # Run the load command, which populates the command queue and sets the script directory
+    # Run the load command, which queues the script's commands and sets the script directory
     run_cmd(base_app, '_relative_load {}'.format(filename))
 
-    assert base_app.cmdqueue == ['help history', 'eos']
     sdir = os.path.dirname(filename)
     assert base_app._script_dir == [sdir]
     assert base_app._current_script_dir == sdir
+    assert drain_queued_commands(base_app) == ['help history', 'eos']
 
 def test_relative_load_requires_an_argument(base_app):
     out, err = run_cmd(base_app, '_relative_load')
@@ -475,6 +508,49 @@ def test_output_redirection(base_app):
     finally:
         os.remove(filename)
 
+@pytest.mark.parametrize('extension, module', [
+    ('.gz', 'gzip'),
+    ('.bz2', 'bz2'),
+    ('.xz', 'lzma'),
+])
+def test_output_redirection_compressed(base_app, extension, module):
+    import importlib
+    opener = importlib.import_module(module).open
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix=extension)
+    os.close(fd)
+
+    try:
+        run_cmd(base_app, 'help > {}'.format(filename))
+        with opener(filename, 'rt') as f:
+            content = f.read()
+        assert normalize(content) == normalize(BASE_HELP)
+
+        # Appending adds another compressed stream to the file
+        run_cmd(base_app, 'help >> {}'.format(filename))
+        with opener(filename, 'rt') as f:
+            assert f.read() == content * 2
+    finally:
+        os.remove(filename)
+
+def test_output_redirection_compress_level(base_app):
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.gz')
+    os.close(fd)
+
+    try:
+        sizes = []
+        for level in (0, 9):
+            base_app.redirect_compress_level = level
+            run_cmd(base_app, 'help -v > {}'.format(filename))
+            sizes.append(os.path.getsize(filename))
+        assert sizes[0] > sizes[1]
+
+        base_app.redirect_compress_level = 10
+        out, err = run_cmd(base_app, 'help > {}'.format(filename))
+        assert not out
+        assert 'Failed to redirect because - compression level must be from 0 to 9' in err[0]
+    finally:
+        os.remove(filename)
+
 def test_output_redirection_to_nonexistent_directory(base_app):
     filename = '~/fakedir/this_does_not_exist.txt'
 
@@ -906,8 +982,9 @@ def test_custom_help_menu(help_app):
     expected = normalize("""
 Documented commands (type help <topic>):
 ========================================
-alias  help     load   py        quit  shell      squat
-edit   history  macro  pyscript  set   shortcuts
+alias  help     kill   parallel  pyscript  shell      stats
+edit   history  load   profile   quit      shortcuts  wait
+fg     jobs     macro  py        set       squat
 
 Undocumented commands:
 ======================
@@ -976,7 +1053,8 @@ cat_nodoc  diddly
 
 Other
 =====
-alias  help  history  load  macro  py  pyscript  quit  set  shell  shortcuts
+alias  help     jobs  load   parallel  py        quit  shell      stats
+fg     history  kill  macro  profile   pyscript  set   shortcuts  wait
 
 Undocumented commands:
 ======================
@@ -1001,16 +1079,23 @@ diddly              This command does diddly
 Other
 ================================================================================
 alias               Manage aliases
+fg                  Wait for a background job to finish and print its output
 help                List available commands or provide detailed help for a specific command
 history             View, run, edit, save, or clear previously entered commands
+jobs                List background jobs
+kill                Kill background jobs
 load                Run commands in script file that is encoded as either ASCII or UTF-8 text
 macro               Manage macros
+parallel            Run thread-safe commands at the same time
+profile             Run a command under a profiler and report where it spent its time
 py                  Invoke Python command or shell
 pyscript            Run a Python script file inside the console
 quit                Exit this application
 set                 Set a settable parameter or show current settings of parameters
 shell               Execute a command as if at the OS prompt
 shortcuts           List available shortcuts
+stats               Show latency statistics for the commands which have run
+wait                Wait for background jobs to finish
 
 Undocumented commands:
 ======================
@@ -1273,6 +1358,50 @@ def test_multiline_complete_statement_with_unclosed_quotes(multiline_app):
     assert statement.multiline_command == 'orate'
     assert statement.terminator == ';'
 
+def test_multiline_complete_statement_with_statement(multiline_app):
+    statement = multiline_app.statement_parser.parse('orate hello')
+    m = mock.MagicMock(name='input')
+    builtins.input = m
+    assert multiline_app._complete_statement(statement) is statement
+    m.assert_not_called()
+
+    with pytest.raises(cmd2.EmptyStatement):
+        multiline_app._complete_statement(multiline_app.statement_parser.parse(''))
+
+def test_multiline_load_script(multiline_app):
+    multiline_app.stdout = utils.StdSim(multiline_app.stdout)
+    fd, filename = tempfile.mkstemp(suffix='.txt', text=True)
+    with os.fdopen(fd, 'w') as f:
+        f.write('orate hello\nbig\nworld;\n\n# a comment\norate -s never\nfinished\n')
+    try:
+        multiline_app.runcmds_plus_hooks(['load {}'.format(filename)])
+    finally:
+        os.remove(filename)
+    assert multiline_app.stdout.getvalue() == 'hellobigworld\nNEVERFINISHED\n'
+    assert [item.statement.raw for item in multiline_app.history] == ['load {}'.format(filename),
+                                                                      'orate hello\nbig\nworld;',
+                                                                      'orate -s never\nfinished\n\n']
+
+def test_multiline_runcmds_plus_hooks(multiline_app):
+    multiline_app.stdout = utils.StdSim(multiline_app.stdout)
+    multiline_app.runcmds_plus_hooks(['orate hello', 'world;', 'orate again'])
+    assert multiline_app.stdout.getvalue() == 'helloworld\nagain\n'
+
+def test_multiline_history_run(multiline_app):
+    multiline_app.stdout = utils.StdSim(multiline_app.stdout)
+    multiline_app.runcmds_plus_hooks(['orate hello', 'world', '', 'orate -s again;'])
+    multiline_app.stdout.clear()
+
+    with mock.patch.object(multiline_app, 'onecmd_plus_hooks',
+                           wraps=multiline_app.onecmd_plus_hooks) as onecmd_plus_hooks:
+        multiline_app.onecmd('history -r 1:2')
+    assert multiline_app.stdout.getvalue() == 'helloworld\nAGAIN\n'
+
+    # The commands are run as the statements parsed from the history
+    statements = [call[0][0] for call in onecmd_plus_hooks.call_args_list]
+    assert [statement.raw for statement in statements] == ['orate hello\nworld\n', 'orate -s again;']
+    assert all(isinstance(statement, cmd2.Statement) for statement in statements)
+
 
 def test_clipboard_failure(base_app, capsys):
     # Force cmd2 clipboard to be disabled
@@ -1428,7 +1557,7 @@ def test_pseudo_raw_input_piped_rawinput_true_echo_true(capsys):
     app, out = piped_rawinput_true(capsys, True, command)
     out = out.splitlines()
     assert out[0] == '{}{}'.format(app.prompt, command)
-    assert out[1].startswith('colors:')
+    assert out[1].startswith('collect_stats:')
 
 # using the decorator puts the original input function back when this unit test returns
 @mock.patch('builtins.input', mock.MagicMock(name='input', side_effect=['set', EOFError]))
@@ -1436,7 +1565,7 @@ def test_pseudo_raw_input_piped_rawinput_true_echo_false(capsys):
     command = 'set'
     app, out = piped_rawinput_true(capsys, False, command)
     firstline = out.splitlines()[0]
-    assert firstline.startswith('colors:')
+    assert firstline.startswith('collect_stats:')
     assert not '{}{}'.format(app.prompt, command) in out
 
 # the next helper function and two tests check for piped
@@ -1456,13 +1585,13 @@ def test_pseudo_raw_input_piped_rawinput_false_echo_true(capsys):
     app, out = piped_rawinput_false(capsys, True, command)
     out = out.splitlines()
     assert out[0] == '{}{}'.format(app.prompt, command)
-    assert out[1].startswith('colors:')
+    assert out[1].startswith('collect_stats:')
 
 def test_pseudo_raw_input_piped_rawinput_false_echo_false(capsys):
     command = 'set'
     app, out = piped_rawinput_false(capsys, False, command)
     firstline = out.splitlines()[0]
-    assert firstline.startswith('colors:')
+    assert firstline.startswith('collect_stats:')
     assert not '{}{}'.format(app.prompt, command) in out
 
 
@@ -1548,6 +1677,152 @@ def test_poutput_color_never(outsim_app):
     expected = msg + '\n'
     assert out == expected
 
+def test_poutput_color_setting_changed(outsim_app):
+    color = Fore.CYAN
+    outsim_app.colors = 'Always'
+    outsim_app.poutput('colored', color=color)
+    outsim_app.colors = 'Never'
+    outsim_app.poutput('plain', color=color)
+    assert outsim_app.stdout.getvalue() == color + 'colored\n' + Fore.RESET + 'plain\n'
+
+def test_poutput_isatty_checked_once(base_app):
+    base_app.colors = 'Terminal'
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.isatty.return_value = False
+    base_app.poutput('one', color=Fore.CYAN)
+    base_app.poutput('two', color=Fore.CYAN)
+    base_app.stdout.isatty.assert_called_once_with()
+    assert [c[0][0] for c in base_app.stdout.write.call_args_list] == ['one\n', 'two\n']
+
+    # A new stream is checked again
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.isatty.return_value = True
+    base_app.poutput('three', color=Fore.CYAN)
+    base_app.stdout.write.assert_called_once_with(Fore.CYAN + 'three\n' + Fore.RESET)
+
+def test_poutput_many(outsim_app):
+    outsim_app.poutput_many(['one', 2, None, '', 'three\n'])
+    assert outsim_app.stdout.getvalue() == 'one\n2\nthree\n'
+
+def test_poutput_many_blocks(base_app):
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.isatty.return_value = False
+    base_app.poutput_many(('row {}'.format(i) for i in range(2500)), end=';')
+    writes = [c[0][0] for c in base_app.stdout.write.call_args_list]
+    assert len(writes) == 3
+    assert ''.join(writes) == ''.join('row {};'.format(i) for i in range(2500))
+
+def test_poutput_many_color(outsim_app):
+    outsim_app.colors = 'Always'
+    outsim_app.poutput_many(['a', 'b'], color=Fore.CYAN)
+    assert outsim_app.stdout.getvalue() == Fore.CYAN + 'a\n' + Fore.RESET + Fore.CYAN + 'b\n' + Fore.RESET
+
+def test_poutput_many_broken_pipe(base_app, capsys):
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.write.side_effect = BrokenPipeError
+    base_app.broken_pipe_warning = 'pipe closed\n'
+    base_app.poutput_many(['a', 'b'])
+    out, err = capsys.readouterr()
+    assert err == 'pipe closed\n'
+
+def test_buffered_output(base_app):
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.isatty.return_value = False
+    stdout = base_app.stdout
+    with base_app.buffered_output(block_size=10) as writer:
+        assert base_app.stdout is writer
+        base_app.poutput('one')
+        stdout.write.assert_not_called()
+        base_app.poutput('two three')
+        stdout.write.assert_called_once_with('one\ntwo three\n')
+        base_app.poutput('four')
+        writer.flush()
+        stdout.write.assert_called_with('four\n')
+        base_app.poutput('five')
+    stdout.write.assert_called_with('five\n')
+    assert base_app.stdout is stdout
+
+def test_buffered_output_sys_stdout(capsys):
+    app = cmd2.Cmd()
+    with app.buffered_output() as writer:
+        assert sys.stdout is writer
+        print('printed')
+        app.poutput('written')
+        assert capsys.readouterr().out == ''
+    assert sys.stdout is app.stdout
+    assert capsys.readouterr().out == 'printed\nwritten\n'
+
+def test_buffered_output_nested(base_app):
+    with base_app.buffered_output() as writer:
+        with base_app.buffered_output() as inner_writer:
+            assert inner_writer is writer
+
+def test_poutput_bytes(outsim_app):
+    outsim_app.poutput('text')
+    outsim_app.poutput_bytes(b'\x00\xff binary')
+    assert outsim_app.stdout.getbytes() == b'text\n\x00\xff binary'
+
+def test_poutput_bytes_empty(outsim_app):
+    outsim_app.poutput_bytes(b'')
+    assert outsim_app.stdout.getbytes() == b''
+
+def test_poutput_bytes_text_stream(base_app):
+    base_app.stdout = io.StringIO()
+    base_app.poutput_bytes('caf\u00e9'.encode('utf-8'))
+    assert base_app.stdout.getvalue() == 'caf\u00e9'
+
+def test_poutput_bytes_broken_pipe(base_app, capsys):
+    base_app.stdout = mock.MagicMock()
+    base_app.stdout.buffer.write.side_effect = BrokenPipeError
+    base_app.broken_pipe_warning = 'pipe closed\n'
+    base_app.poutput_bytes(b'data')
+    out, err = capsys.readouterr()
+    assert err == 'pipe closed\n'
+
+
+class BinaryApp(cmd2.Cmd):
+    # Every byte value with text on each side
+    DATA = b'start\n' + bytes(range(256)) * 1024 + b'\nend\n'
+
+    def do_dump(self, _):
+        """Write binary data"""
+        self.poutput('text first')
+        self.poutput_bytes(self.DATA)
+
+@pytest.fixture
+def binary_app():
+    app = BinaryApp()
+    app.stdout = utils.StdSim(app.stdout)
+    return app
+
+def test_poutput_bytes_redirect_file(binary_app):
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.bin')
+    os.close(fd)
+
+    try:
+        binary_app.onecmd_plus_hooks('dump > {}'.format(filename))
+        with open(filename, 'rb') as f:
+            assert f.read() == b'text first' + os.linesep.encode() + BinaryApp.DATA
+    finally:
+        os.remove(filename)
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="Unix cat command is needed")
+def test_poutput_bytes_pipe(binary_app):
+    binary_app.onecmd_plus_hooks('dump | cat')
+    assert binary_app.stdout.getbytes() == b'text first\n' + BinaryApp.DATA
+
+def test_poutput_bytes_redirect_gzip(binary_app):
+    import gzip
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.bin.gz')
+    os.close(fd)
+
+    try:
+        binary_app.onecmd_plus_hooks('dump > {}'.format(filename))
+        with gzip.open(filename, 'rb') as f:
+            assert f.read() == b'text first' + os.linesep.encode() + BinaryApp.DATA
+    finally:
+        os.remove(filename)
+
 
 # These are invalid names for aliases and macros
 invalid_command_name = [
@@ -1899,8 +2174,9 @@ def test_onecmd_raw_str_quit(outsim_app):
 def test_get_all_commands(base_app):
     # Verify that the base app has the expected commands
     commands = base_app.get_all_commands()
-    expected_commands = ['_relative_load', 'alias', 'edit', 'eof', 'eos', 'help', 'history', 'load', 'macro',
-                         'py', 'pyscript', 'quit', 'set', 'shell', 'shortcuts']
+    expected_commands = ['_relative_load', 'alias', 'edit', 'eof', 'eos', 'fg', 'help', 'history', 'jobs', 'kill',
+                         'load', 'macro', 'parallel', 'profile', 'py', 'pyscript', 'quit', 'set', 'shell',
+                         'shortcuts', 'stats', 'wait']
     assert commands == expected_commands
 
 def test_get_help_topics(base_app):
@@ -2219,3 +2495,880 @@ def test_disabled_message_command_name(disable_commands_app):
 
     out, err = run_cmd(disable_commands_app, 'has_help_func')
     assert err[0].startswith('has_help_func is currently disabled')
+
+def test_command_registry_disable_and_enable(disable_commands_app):
+    real_func = disable_commands_app.cmd_func('has_help_func')
+    disable_commands_app.disable_command('has_help_func', 'disabled')
+    assert disable_commands_app.cmd_func('has_help_func') is not real_func
+    assert 'has_help_func' in disable_commands_app.get_all_commands()
+    assert 'has_help_func' not in disable_commands_app.get_visible_commands()
+
+    disable_commands_app.enable_command('has_help_func')
+    assert disable_commands_app.cmd_func('has_help_func') == real_func
+    assert 'has_help_func' in disable_commands_app.get_visible_commands()
+
+def test_command_registry_runtime_addition(base_app):
+    # Build the registry before adding anything
+    assert 'runtime' not in base_app.get_all_commands()
+
+    def do_runtime(arg):
+        base_app.poutput('runtime ran')
+
+    def complete_runtime(text, line, begidx, endidx):
+        return ['choice']
+
+    base_app.do_runtime = do_runtime
+    base_app.complete_runtime = complete_runtime
+    assert 'runtime' in base_app.get_all_commands()
+    assert 'runtime' in base_app.get_visible_commands()
+    assert base_app._commands['runtime'].completer is complete_runtime
+
+    out, err = run_cmd(base_app, 'runtime')
+    assert out == ['runtime ran']
+
+    del base_app.do_runtime
+    assert 'runtime' not in base_app.get_all_commands()
+    assert base_app.cmd_func('runtime') is None
+
+def test_command_registry_help_topic_addition(base_app):
+    assert 'newtopic' not in base_app.get_help_topics()
+
+    def help_newtopic():
+        base_app.poutput('new topic help')
+
+    base_app.help_newtopic = help_newtopic
+    assert 'newtopic' in base_app.get_help_topics()
+    out, err = run_cmd(base_app, 'help')
+    assert 'newtopic' in ' '.join(out)
+    out, err = run_cmd(base_app, 'help newtopic')
+    assert out == ['new topic help']
+
+    del base_app.help_newtopic
+    assert 'newtopic' not in base_app.get_help_topics()
+
+def test_command_registry_class_addition():
+    class ClassAdditionApp(cmd2.Cmd):
+        pass
+
+    app = ClassAdditionApp()
+    assert 'late' not in app.get_all_commands()
+    assert 'latetopic' not in app.get_help_topics()
+
+    def do_late(self, statement):
+        """Added to the class late"""
+        self.poutput('late ran')
+
+    def help_latetopic(self):
+        self.poutput('late topic help')
+
+    ClassAdditionApp.do_late = do_late
+    ClassAdditionApp.help_latetopic = help_latetopic
+    assert 'late' in app.get_all_commands()
+    assert 'late' in app.get_visible_commands()
+    assert 'latetopic' in app.get_help_topics()
+    out, err = run_cmd(app, 'help')
+    assert 'late' in ' '.join(out).split()
+    out, err = run_cmd(app, 'late')
+    assert out == ['late ran']
+
+    del ClassAdditionApp.do_late
+    assert 'late' not in app.get_all_commands()
+
+def test_command_registry_class_replacement_with_abc_mixin():
+    import abc
+
+    class RequiredCommandMixin(abc.ABC):
+        @abc.abstractmethod
+        def do_required(self, statement):
+            pass
+
+    # A mixin with its own metaclass can be combined with Cmd
+    class ABCApp(cmd2.Cmd, RequiredCommandMixin):
+        def do_required(self, statement):
+            self.poutput('required ran')
+
+    app = ABCApp()
+    assert 'required' in app.get_all_commands()
+    out, err = run_cmd(app, 'required')
+    assert out == ['required ran']
+
+    def help_required(self):
+        self.poutput('required help')
+
+    RequiredCommandMixin.help_required = help_required
+    assert app._commands['required'].help_function == app.help_required
+    del RequiredCommandMixin.help_required
+    assert app._commands['required'].help_function is None
+
+def test_command_registry_metadata(disable_commands_app):
+    info = disable_commands_app._commands['has_help_func']
+    assert info.help_function == disable_commands_app.help_has_help_func
+    assert info.category == disable_commands_app.category_name
+    assert info.argparser is None
+    assert disable_commands_app._commands['help'].argparser is disable_commands_app.do_help.argparser
+
+def test_load_streams_script(base_app, request):
+    test_dir = os.path.dirname(request.module.__file__)
+    filename = os.path.join(test_dir, 'scripts', 'nested.txt')
+    base_app.cmdqueue.append('queued before load')
+
+    run_cmd(base_app, 'load {}'.format(filename))
+
+    # The script's commands aren't copied into cmdqueue
+    assert base_app.cmdqueue == ['queued before load']
+
+    assert base_app._next_queued_command() == '_relative_load precmds.txt'
+    base_app.cmdqueue.append('queued during load')
+
+    # A nested load runs before the rest of the outer script
+    run_cmd(base_app, '_relative_load precmds.txt')
+    assert drain_queued_commands(base_app) == ['set colors Always', 'eos', 'help', 'shortcuts',
+                                               '_relative_load postcmds.txt', 'eos',
+                                               'queued before load', 'queued during load']
+
+def test_clear_command_queue_closes_script(base_app, request):
+    test_dir = os.path.dirname(request.module.__file__)
+    filename = os.path.join(test_dir, 'scripts', 'nested.txt')
+    run_cmd(base_app, 'load {}'.format(filename))
+    assert base_app._next_queued_command() == '_relative_load precmds.txt'
+
+    base_app._clear_command_queue()
+    assert base_app._next_queued_command() is None
+    assert base_app._script_dir == []
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="Terminals aren't restored on Windows")
+@pytest.mark.parametrize('terminal_restore, restored, expect_restore, expect_stty', [
+    (constants.TERMINAL_RESTORE_TERMIOS, True, True, False),
+    (constants.TERMINAL_RESTORE_TERMIOS, False, True, True),
+    (constants.TERMINAL_RESTORE_STTY, True, False, True),
+    (constants.TERMINAL_RESTORE_NEVER, True, False, False),
+])
+def test_terminal_restore(base_app, terminal_restore, restored, expect_restore, expect_stty):
+    base_app._terminal_state = mock.MagicMock(spec=utils.TerminalState)
+    base_app._terminal_state.restore.return_value = restored
+    base_app.terminal_restore = terminal_restore
+
+    with mock.patch.object(base_app.stdout, 'isatty', return_value=True), \
+            mock.patch('subprocess.Popen') as popen_mock:
+        base_app.onecmd_plus_hooks('help')
+    assert base_app._terminal_state.restore.called == expect_restore
+    assert popen_mock.called == expect_stty
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="Terminals aren't restored on Windows")
+def test_terminal_restore_without_saved_state(base_app):
+    assert base_app._terminal_state is None
+    with mock.patch.object(base_app.stdout, 'isatty', return_value=True), \
+            mock.patch('subprocess.Popen') as popen_mock:
+        base_app.onecmd_plus_hooks('help')
+    popen_mock.assert_called_once_with(['stty', 'sane'])
+
+def test_terminal_restore_not_a_tty(base_app):
+    base_app._terminal_state = mock.MagicMock(spec=utils.TerminalState)
+    with mock.patch.object(base_app.stdout, 'isatty', return_value=False), \
+            mock.patch('subprocess.Popen') as popen_mock:
+        base_app.onecmd_plus_hooks('help')
+    assert not base_app._terminal_state.restore.called
+    assert not popen_mock.called
+
+def test_cmdloop_saves_terminal_state():
+    state = mock.MagicMock(spec=utils.TerminalState)
+    saved_states = []
+
+    app = cmd2.Cmd()
+    app.stdout = utils.StdSim(app.stdout)
+
+    def preloop_hook() -> None:
+        saved_states.append(app._terminal_state)
+
+    app.register_preloop_hook(preloop_hook)
+    testargs = ["prog", "quit"]
+    with mock.patch.object(sys, 'argv', testargs), \
+            mock.patch('cmd2.utils.TerminalState.save', return_value=state) as save_mock:
+        app.cmdloop()
+
+    save_mock.assert_called_once_with(sys.stdin)
+    assert saved_states == [state]
+    assert app._terminal_state is None
+
+
+def test_stats_disabled(base_app):
+    run_cmd(base_app, 'help')
+    out, err = run_cmd(base_app, 'stats')
+    assert out == []
+    assert 'Set collect_stats to True' in err[0]
+    assert len(base_app.command_stats) == 0
+
+def test_stats(base_app):
+    run_cmd(base_app, 'set collect_stats True')
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'shortcuts')
+
+    out, err = run_cmd(base_app, 'stats')
+    assert out[0].split() == ['Command', 'Calls', 'Errors', 'p50', 'p95', 'p99', 'Max']
+    assert [line.split()[:3] for line in out[1:]] == [['help', '2', '0'], ['shortcuts', '1', '0']]
+
+    # The stats command itself has now been recorded
+    out, err = run_cmd(base_app, 'stats --sort calls')
+    assert [line.split()[0] for line in out[1:]] == ['help', 'shortcuts', 'stats']
+
+    out, err = run_cmd(base_app, 'stats shortcuts nonexistent')
+    assert [line.split()[0] for line in out[1:]] == ['shortcuts']
+
+def test_stats_phases(base_app):
+    base_app.collect_stats = True
+    run_cmd(base_app, 'help > {}'.format(os.devnull))
+
+    out, err = run_cmd(base_app, 'stats --phases')
+    rows = [line.split()[:2] for line in out[1:]]
+    assert rows == [['help', '1'], ['parse', '1'], ['redirection', '1'], ['precmd', '1'], ['command', '1'],
+                    ['postcmd', '1'], ['finalization', '1']]
+
+def test_stats_errors(base_app):
+    def do_fail(_):
+        raise ValueError('failed')
+
+    base_app.do_fail = do_fail
+    base_app.collect_stats = True
+    run_cmd(base_app, 'fail')
+    assert base_app.command_stats.get('fail').errors == 1
+
+def test_stats_reset(base_app):
+    base_app.collect_stats = True
+    run_cmd(base_app, 'help')
+    base_app.collect_stats = False
+    out, err = run_cmd(base_app, 'stats --reset')
+    assert out == []
+    assert len(base_app.command_stats) == 0
+
+
+def test_profile(base_app):
+    out, err = run_cmd(base_app, 'profile shortcuts')
+    assert normalize(SHORTCUTS_TXT) == out[:len(normalize(SHORTCUTS_TXT))]
+    report = '\n'.join(out)
+    assert 'Ordered by: cumulative time' in report
+    assert 'do_shortcuts' in report
+
+def test_profile_sort(base_app):
+    out, err = run_cmd(base_app, 'profile --sort tottime shortcuts')
+    assert 'Ordered by: internal time' in '\n'.join(out)
+
+def test_profile_runs_hooks_and_arguments(base_app):
+    out, err = run_cmd(base_app, 'profile -n 1 set quiet True')
+    assert base_app.quiet
+    assert base_app.history[-1] == 'set quiet True'
+
+def test_profile_quoted_redirection(base_app):
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        out, err = run_cmd(base_app, 'profile "shortcuts > {}"'.format(filename))
+        with open(filename) as f:
+            assert normalize(f.read()) == normalize(SHORTCUTS_TXT)
+        report = '\n'.join(out)
+        assert 'Shortcuts for other commands' not in report
+        assert '_redirect_output' in report
+    finally:
+        os.remove(filename)
+
+def test_profile_output_file(base_app):
+    import pstats
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.pstats')
+    os.close(fd)
+    try:
+        out, err = run_cmd(base_app, 'profile -o {} shortcuts'.format(filename))
+        assert out == normalize(SHORTCUTS_TXT)
+        assert 'Profile saved to' in err[0]
+        assert any(func[2] == 'do_shortcuts' for func in pstats.Stats(filename).stats)
+    finally:
+        os.remove(filename)
+
+def test_profile_output_file_bad_path(base_app):
+    out, err = run_cmd(base_app, 'profile -o {} shortcuts'.format(os.path.join('nonexistent', 'dir', 'x.pstats')))
+    assert 'Failed to save profile' in err[0]
+
+def test_profile_memory(base_app):
+    import tracemalloc
+
+    def do_allocate(_):
+        base_app.allocated = [bytearray(1024) for _ in range(100)]
+
+    base_app.do_allocate = do_allocate
+    out, err = run_cmd(base_app, 'profile --memory -n 3 allocate')
+    assert out[0] == 'Top 3 lines by memory allocated and still in use'
+    assert len(out) <= 4
+    assert 'test_cmd2.py' in out[1]
+    assert not tracemalloc.is_tracing()
+
+def test_profile_stop(base_app):
+    assert base_app.onecmd_plus_hooks('profile quit')
+
+class BatchApp(cmd2.Cmd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, multiline_commands=['orate'], **kwargs)
+        self.stdout = utils.StdSim(self.stdout)
+        self.finalized = []
+        self.register_cmdfinalization_hook(self.record_finalization)
+
+    def do_say(self, statement):
+        self.poutput(statement.args)
+
+    def do_orate(self, statement):
+        self.poutput(statement.args)
+
+    def do_fail(self, statement):
+        raise ValueError('failed')
+
+    def record_finalization(self, data: cmd2.plugin.CommandFinalizationData) -> cmd2.plugin.CommandFinalizationData:
+        self.finalized.append(data.statement.command if data.statement is not None else None)
+        return data
+
+def test_run_batch():
+    app = BatchApp()
+    stream = io.StringIO('say hello\n\n  orate one\ntwo;\nsay goodbye\n')
+    assert app.run_batch(stream)
+    assert app.stdout.getvalue() == 'hello\none two\ngoodbye\n'
+    assert app.finalized == ['say', None, 'orate', 'say', 'eof']
+    assert app._batch_lines is None
+    assert app._batch_stdout is None
+
+def test_run_batch_after_stdin_was_read():
+    app = BatchApp()
+    stdin = io.TextIOWrapper(io.BytesIO(b'say first\nsay second\rsay third\n'), encoding='utf-8')
+    assert stdin.readline() == 'say first\n'
+    with mock.patch.object(sys, 'stdin', stdin):
+        app.run_batch()
+    assert app.stdout.getvalue() == 'second\nthird\n'
+
+def test_run_batch_matches_cmdloop():
+    lines = 'say hello\norate one\ntwo\n\nfail\nsay "unclosed\nsay goodbye\n'
+    batch_app = BatchApp()
+    batch_app.run_batch(io.StringIO(lines))
+
+    loop_app = BatchApp()
+    loop_app.use_rawinput = False
+    loop_app.stdin = io.StringIO(lines)
+    with mock.patch.object(sys, 'stderr', io.StringIO()):
+        loop_app._cmdloop()
+
+    assert batch_app.stdout.getvalue() == loop_app.stdout.getvalue()
+    assert batch_app.finalized == loop_app.finalized
+    assert [str(item) for item in batch_app.history] == [str(item) for item in loop_app.history]
+
+def test_run_batch_stop():
+    app = BatchApp()
+    assert app.run_batch(io.StringIO('say one\nquit\nsay two\n'))
+    assert app.stdout.getvalue() == 'one\n'
+    assert app.finalized == ['say', 'quit']
+
+def test_run_batch_runs_loaded_script_first(request):
+    test_dir = os.path.dirname(request.module.__file__)
+    filename = os.path.join(test_dir, 'scripts', 'help.txt')
+
+    app = BatchApp()
+    app.run_batch(io.StringIO('load {}\nsay after\n'.format(filename)))
+    out = app.stdout.getvalue().splitlines()
+    assert out[-1] == 'after'
+    assert 'Documented commands (type help <topic>):' in out
+
+def test_run_batch_echo():
+    app = BatchApp()
+    app.echo = True
+    app.run_batch(io.StringIO('say hello\norate one\ntwo;\n'))
+    assert app.stdout.getvalue() == '{0}say hello\nhello\n{0}orate one\n{1}two;\none two\n'.format(
+        app.prompt, app.continuation_prompt)
+
+def test_run_batch_checks_isatty_once():
+    app = BatchApp()
+    with mock.patch.object(app.stdout, 'isatty', return_value=False) as isatty:
+        app.run_batch(io.StringIO('say one\nsay two\nsay three\n'))
+    assert isatty.call_count == 1
+
+def test_run_batch_output_blocks():
+    app = BatchApp()
+    stdsim = app.stdout
+    app.run_batch(io.StringIO('say hello\nsay goodbye\n'), output_block_size=1000)
+    assert app.stdout is stdsim
+    assert stdsim.getvalue() == 'hello\ngoodbye\n'
+
+def test_cmdloop_batch_option():
+    app = BatchApp()
+    testargs = ["prog", "--batch", "say first"]
+    with mock.patch.object(sys, 'argv', testargs), \
+            mock.patch.object(sys, 'stdin', io.StringIO('say second\n')), \
+            mock.patch.object(app, 'pseudo_raw_input', side_effect=AssertionError('prompted')):
+        app.cmdloop()
+    assert app.stdout.getvalue() == 'first\nsecond\n'
+
+class ParallelApp(cmd2.Cmd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.finalized = []
+        self.register_cmdfinalization_hook(self.record_finalization)
+
+    @cmd2.thread_safe
+    def do_status(self, statement):
+        """Wait for a number of seconds and print which host was checked"""
+        import time
+        host, delay = statement.arg_list
+        time.sleep(float(delay))
+        self.poutput('status of {}'.format(host))
+        print('printed by {}'.format(host))
+        self.perror('warning from {}'.format(host), traceback_war=False)
+
+    @cmd2.thread_safe
+    def do_fail(self, statement):
+        raise ValueError('failed in thread')
+
+    @cmd2.thread_safe
+    def do_stop(self, statement):
+        return True
+
+    def do_unsafe(self, statement):
+        pass
+
+    def record_finalization(self, data: cmd2.plugin.CommandFinalizationData) -> cmd2.plugin.CommandFinalizationData:
+        self.finalized.append(data.statement.raw)
+        return data
+
+def test_thread_safe_decorator():
+    assert getattr(ParallelApp.do_status, cmd2.cmd2.THREAD_SAFE)
+    assert not hasattr(ParallelApp.do_unsafe, cmd2.cmd2.THREAD_SAFE)
+
+def test_parallel_ordered(capsys):
+    app = ParallelApp()
+    assert not app.run_parallel(['status a 0.2', 'status b 0', 'status c 0.1'])
+    out, err = capsys.readouterr()
+    assert out == ('status of a\nprinted by a\n'
+                   'status of b\nprinted by b\n'
+                   'status of c\nprinted by c\n')
+    assert err == 'warning from a\nwarning from b\nwarning from c\n'
+    assert app.finalized == ['status a 0.2', 'status b 0', 'status c 0.1']
+    assert [str(item) for item in app.history] == ['status a 0.2', 'status b 0', 'status c 0.1']
+    assert app.stdout is sys.stdout
+
+def test_parallel_runs_at_same_time(capsys):
+    import time
+    app = ParallelApp()
+    start = time.monotonic()
+    app.run_parallel(['status a 0.3', 'status b 0.3', 'status c 0.3'], max_workers=3)
+    assert time.monotonic() - start < 0.8
+
+def test_parallel_unordered(capsys):
+    app = ParallelApp()
+    app.run_parallel(['status a 0.4', 'status b 0'], ordered=False)
+    out, err = capsys.readouterr()
+    assert out == 'status of b\nprinted by b\nstatus of a\nprinted by a\n'
+    assert app.finalized == ['status b 0', 'status a 0.4']
+    assert [str(item) for item in app.history] == ['status a 0.4', 'status b 0']
+
+def test_parallel_command_error(capsys):
+    app = ParallelApp()
+    assert not app.run_parallel(['fail', 'status a 0'])
+    out, err = capsys.readouterr()
+    assert out == 'status of a\nprinted by a\n'
+    assert 'failed in thread' in err
+    assert app.finalized == ['fail', 'status a 0']
+
+def test_parallel_stop(capsys):
+    app = ParallelApp()
+    assert app.run_parallel(['status a 0', 'stop'])
+    assert app.finalized == ['status a 0', 'stop']
+
+@pytest.mark.parametrize('line, error', [
+    ('unsafe', "'unsafe' isn't a thread-safe command"),
+    ('nonexistent', "'nonexistent' isn't a thread-safe command"),
+    ('status a 0 > out.txt', "'status a 0 > out.txt' redirects its output"),
+    ('status "a 0', 'Invalid syntax'),
+])
+def test_parallel_not_allowed(capsys, line, error):
+    app = ParallelApp()
+    app.run_parallel(['status b 0', line])
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert error in err
+    assert app.finalized == []
+    assert len(app.history) == 0
+
+def test_parallel_postparsing_hook_stop(capsys):
+    app = ParallelApp()
+
+    def stop_hook(data: cmd2.plugin.PostparsingData) -> cmd2.plugin.PostparsingData:
+        data.stop = data.statement.arg_list[0] == 'b'
+        return data
+
+    app.register_postparsing_hook(stop_hook)
+    assert app.run_parallel(['status a 0', 'status b 0'])
+    out, err = capsys.readouterr()
+    assert out == 'status of a\nprinted by a\n'
+    assert app.finalized == ['status b 0', 'status a 0']
+
+def test_parallel_command(capsys):
+    app = ParallelApp()
+    app.onecmd_plus_hooks('parallel -j 2 "status a 0.1" "status b 0"')
+    out, err = capsys.readouterr()
+    assert out == 'status of a\nprinted by a\nstatus of b\nprinted by b\n'
+    assert [str(item) for item in app.history] == ['parallel -j 2 "status a 0.1" "status b 0"',
+                                                   'status a 0.1', 'status b 0']
+
+def test_parallel_command_redirected(capsys):
+    app = ParallelApp()
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        app.onecmd_plus_hooks('parallel "status a 0" "status b 0" > {}'.format(filename))
+        with open(filename) as f:
+            assert f.read() == 'status of a\nprinted by a\nstatus of b\nprinted by b\n'
+    finally:
+        os.remove(filename)
+    out, err = capsys.readouterr()
+    assert out == ''
+
+def test_parallel_command_bad_jobs(capsys):
+    app = ParallelApp()
+    app.onecmd_plus_hooks('parallel -j 0 "status a 0"')
+    out, err = capsys.readouterr()
+    assert '--jobs must be at least 1' in err
+    assert out == ''
+
+class JobApp(cmd2.Cmd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import threading
+        self.release = threading.Event()
+        self.finalized = []
+        self.register_cmdfinalization_hook(self.record_finalization)
+
+    @cmd2.thread_safe
+    def do_block(self, statement):
+        """Print the arguments once released"""
+        self.release.wait(5)
+        self.poutput('released {}'.format(statement.args))
+        self.perror('warning from {}'.format(statement.args), traceback_war=False)
+
+    @cmd2.thread_safe
+    def do_spin(self, statement):
+        while True:
+            pass
+
+    @cmd2.thread_safe
+    def do_fail(self, statement):
+        raise ValueError('failed in job')
+
+    def do_unsafe(self, statement):
+        self.poutput(statement.arg_list)
+
+    def record_finalization(self, data: cmd2.plugin.CommandFinalizationData) -> cmd2.plugin.CommandFinalizationData:
+        self.finalized.append(data.statement.raw)
+        return data
+
+def test_job_runs_in_background(capsys):
+    app = JobApp()
+    saved_sys_stdout = sys.stdout
+    assert not app.onecmd_plus_hooks('block a &')
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert err == '[1] block a &\n'
+
+    app.onecmd_plus_hooks('jobs')
+    out, err = capsys.readouterr()
+    assert out == '[1] Running  block a &\n'
+    assert app.finalized == ['jobs']
+
+    app.release.set()
+    app.onecmd_plus_hooks('wait')
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert err == '[1] Done     block a &\n'
+    assert app.finalized == ['jobs', 'block a', 'wait']
+    assert sys.stdout is saved_sys_stdout
+
+    # The job's output is kept until it's brought to the foreground
+    app.onecmd_plus_hooks('fg')
+    out, err = capsys.readouterr()
+    assert out == 'released a\n'
+    assert err == 'warning from a\n'
+    assert len(app.job_table) == 0
+    assert [str(item) for item in app.history] == ['block a &', 'jobs', 'wait', 'fg']
+
+def test_job_reaped_between_commands(capsys):
+    app = JobApp()
+    app.release.set()
+    saved_sys_stdout = sys.stdout
+    app.onecmd_plus_hooks('block a &')
+    app.job_table.get(1).wait()
+    capsys.readouterr()
+
+    # Commands which aren't run by cmdloop() report jobs which finished before them
+    app.runcmds_plus_hooks(['unsafe b'])
+    out, err = capsys.readouterr()
+    assert out == "['b']\n"
+    assert err == '[1] Done     block a &\n'
+    assert app.finalized == ['block a', 'unsafe b']
+    assert sys.stdout is saved_sys_stdout
+
+def test_job_output_to_file(capsys):
+    app = JobApp()
+    app.release.set()
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        app.onecmd_plus_hooks('block a > {} &'.format(filename))
+        app.onecmd_plus_hooks('wait 1')
+        with open(filename) as f:
+            assert f.read() == 'released a\n'
+    finally:
+        os.remove(filename)
+
+    # The job's error output is still waiting for fg
+    job = app.job_table.get(1)
+    assert job.stderr.getvalue() == 'warning from a\n'
+
+def test_job_output_to_gzip_file(capsys):
+    import gzip
+    app = JobApp()
+    app.release.set()
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt.gz')
+    os.close(fd)
+    try:
+        app.onecmd_plus_hooks('block a > {} &'.format(filename))
+        app.onecmd_plus_hooks('wait 1')
+        with gzip.open(filename, 'rt') as f:
+            assert f.read() == 'released a\n'
+    finally:
+        os.remove(filename)
+
+def test_job_redirect_in_main_thread(capsys):
+    app = JobApp()
+    app.onecmd_plus_hooks('block a &')
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        app.onecmd_plus_hooks('unsafe b > {}'.format(filename))
+        app.release.set()
+        app.job_table.get(1).wait()
+        with open(filename) as f:
+            assert f.read() == "['b']\n"
+    finally:
+        os.remove(filename)
+
+    app.onecmd_plus_hooks('fg 1')
+    out, err = capsys.readouterr()
+    assert out == 'released a\n'
+
+def test_job_kill(capsys):
+    app = JobApp()
+    app.onecmd_plus_hooks('spin &')
+    app.onecmd_plus_hooks('kill 1')
+    app.onecmd_plus_hooks('wait')
+    out, err = capsys.readouterr()
+    assert err == '[1] spin &\n[1] Killed   spin &\n'
+    assert len(app.job_table) == 0
+
+    app.onecmd_plus_hooks('kill 1')
+    out, err = capsys.readouterr()
+    assert 'No such job: 1' in err
+
+def test_job_failed(capsys):
+    app = JobApp()
+    app.onecmd_plus_hooks('fail &')
+    app.onecmd_plus_hooks('wait')
+    app.onecmd_plus_hooks('jobs')
+    out, err = capsys.readouterr()
+    assert out == '[1] Failed   fail &\n'
+    assert err == '[1] fail &\n[1] Failed   fail &\n'
+
+    app.onecmd_plus_hooks('fg 1')
+    out, err = capsys.readouterr()
+    assert 'failed in job' in err
+
+def test_ampersand_argument_of_unsafe_command(capsys):
+    app = JobApp()
+    app.onecmd_plus_hooks('unsafe a &')
+    app.onecmd_plus_hooks('unsafe b "&"')
+    out, err = capsys.readouterr()
+    assert out == "['a', '&']\n['b', '\"&\"']\n"
+    assert len(app.job_table) == 0
+
+@pytest.mark.parametrize('line, error', [
+    ('block a | cat &', "pipes its output"),
+    ('block a > &', "redirects to the paste buffer"),
+])
+def test_job_not_allowed(capsys, line, error):
+    app = JobApp()
+    app.onecmd_plus_hooks(line)
+    out, err = capsys.readouterr()
+    assert error in err
+    assert len(app.job_table) == 0
+    assert len(app.history) == 0
+
+def test_job_not_allowed_while_redirecting(capsys):
+    app = JobApp()
+    app.redirecting = True
+    app.onecmd_plus_hooks('block a &')
+    out, err = capsys.readouterr()
+    assert "Background jobs can't be started while output is redirected" in err
+    assert len(app.job_table) == 0
+
+@pytest.mark.parametrize('line, error', [
+    ('fg', 'There are no background jobs'),
+    ('fg 3', 'No such job: 3'),
+    ('wait 3', 'No such job: 3'),
+])
+def test_job_commands_without_jobs(capsys, line, error):
+    app = JobApp()
+    app.onecmd_plus_hooks(line)
+    out, err = capsys.readouterr()
+    assert error in err
+
+def test_kill_finished_job(capsys):
+    app = JobApp()
+    app.release.set()
+    app.onecmd_plus_hooks('block a &')
+    app.onecmd_plus_hooks('wait')
+    app.onecmd_plus_hooks('kill 1')
+    out, err = capsys.readouterr()
+    assert 'Job 1 is not running' in err
+
+def test_job_ids_complete(capsys):
+    app = JobApp()
+    app.onecmd_plus_hooks('block a &')
+    app.onecmd_plus_hooks('block b &')
+    assert app.get_job_ids() == ['1', '2']
+    app.release.set()
+    app.onecmd_plus_hooks('wait')
+
+class FilterApp(cmd2.Cmd):
+    def do_gen(self, statement):
+        """Print a number of lines"""
+        for i in range(int(statement.args or 3)):
+            self.poutput('line {}'.format(i))
+
+    @cmd2.pipe_filter
+    def do_upper(self, statement):
+        for line in self.stdin:
+            self.poutput(line.upper(), end='')
+
+    @cmd2.pipe_filter
+    @cmd2.with_argument_list
+    def do_grep(self, arglist):
+        for line in self.stdin:
+            if arglist[0] in line:
+                print(line, end='')
+
+    @cmd2.pipe_filter
+    def do_head(self, statement):
+        for _ in range(int(statement.args)):
+            self.poutput(self.stdin.readline(), end='')
+
+    @cmd2.pipe_filter
+    def do_count(self, statement):
+        self.poutput(len(self.stdin.read()))
+
+    @cmd2.pipe_filter
+    def do_fail(self, statement):
+        raise ValueError('failed in filter')
+
+def test_pipe_filter_decorator():
+    assert getattr(FilterApp.do_upper, cmd2.cmd2.PIPE_FILTER)
+    assert not hasattr(FilterApp.do_gen, cmd2.cmd2.PIPE_FILTER)
+
+@pytest.mark.parametrize('line, output', [
+    ('gen | upper', 'LINE 0\nLINE 1\nLINE 2\n'),
+    ('gen | upper | grep 1', 'LINE 1\n'),
+    ('gen | grep "line 2"', 'line 2\n'),
+    ('gen | grep line | upper | count', '21\n'),
+    ('gen 100000 | head 2', 'line 0\nline 1\n'),
+])
+def test_pipe_to_filter(capsys, line, output):
+    app = FilterApp()
+    saved_sys_stdout = sys.stdout
+    with mock.patch('subprocess.Popen') as m:
+        app.onecmd_plus_hooks(line)
+    m.assert_not_called()
+    out, err = capsys.readouterr()
+    assert out == output
+    assert err == ''
+    assert sys.stdout is saved_sys_stdout
+    assert app.stdout is saved_sys_stdout
+    assert app.stdin is sys.stdin
+    assert app._job_stdout is None
+    assert [str(item) for item in app.history] == [line]
+
+@pytest.mark.parametrize('alias, line, output', [
+    ('gen 10 "|" head 5', 'piped | count', '35\n'),
+    ('gen 3 "|" grep "line 1"', 'piped | upper', 'LINE 1\n'),
+    ('gen "|" upper', 'piped | grep "LINE 2" | count', '7\n'),
+])
+def test_pipe_filter_alias_with_pipe(capsys, alias, line, output):
+    app = FilterApp()
+    app.onecmd_plus_hooks('alias create piped {}'.format(alias))
+    capsys.readouterr()
+    with mock.patch('subprocess.Popen') as m:
+        app.onecmd_plus_hooks(line)
+    m.assert_not_called()
+    out, err = capsys.readouterr()
+    assert out == output
+    assert err == ''
+
+def test_pipe_filter_redirect(capsys):
+    app = FilterApp()
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    try:
+        app.onecmd_plus_hooks('gen | upper > {}'.format(filename))
+        with open(filename) as f:
+            assert f.read() == 'LINE 0\nLINE 1\nLINE 2\n'
+    finally:
+        os.remove(filename)
+    out, err = capsys.readouterr()
+    assert out == ''
+
+def test_pipe_filter_to_shell(capfd):
+    app = FilterApp()
+    app.onecmd_plus_hooks('gen | upper | {} -c "import sys; print(sys.stdin.read().lower(), end=\'\')"'.format(
+        sys.executable))
+    out, err = capfd.readouterr()
+    assert out == 'line 0\nline 1\nline 2\n'
+
+def test_pipe_to_command_which_isnt_filter():
+    app = FilterApp()
+    with mock.patch('subprocess.Popen') as m:
+        app.onecmd_plus_hooks('gen | gen')
+    m.assert_called_once()
+    assert m.call_args[0][0] == ['gen']
+
+def test_pipe_filter_fails(capsys):
+    app = FilterApp()
+    app.onecmd_plus_hooks('gen 100000 | fail')
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert 'failed in filter' in err
+
+def test_pipe_reader_lines():
+    from cmd2 import pipes
+    pipe = pipes.Pipe()
+    for s in ['one\n', 'tw', 'o\nthr', 'ee\nfour\n', 'five']:
+        pipe.writer.write(s)
+    pipe.writer.close()
+    assert pipe.reader.readlines() == ['one\n', 'two\n', 'three\n', 'four\n', 'five']
+    assert pipe.reader.readline() == ''
+
+def test_pipe_reader_read():
+    from cmd2 import pipes
+    pipe = pipes.Pipe()
+    pipe.writer.write('one\ntwo\n')
+    pipe.writer.close()
+    assert pipe.reader.readline() == 'one\n'
+    assert pipe.reader.read() == 'two\n'
+    with pytest.raises(ValueError):
+        pipe.reader.read(3)
+
+def test_pipe_write_after_reader_closed():
+    from cmd2 import pipes
+    pipe = pipes.Pipe()
+    pipe.writer.write('x')
+    pipe.reader.close()
+    with pytest.raises(BrokenPipeError):
+        pipe.writer.flush()
@@ -6,9 +6,17 @@ Test the parsing logic in parsing.py
 Copyright 2017 Todd Leonhardt <todd.leonhardt@gmail.com>
 Released under MIT license, see LICENSE file
 """
+import pickle
+
 import attr
 import pytest
 
+# Python 3.5 had some regressions in the unitest.mock module, so use 3rd party mock if available
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
 import cmd2
 from cmd2 import constants, utils
 from cmd2.constants import MULTILINE_TERMINATOR
@@ -104,6 +112,66 @@ def test_tokenize_unclosed_quotes(parser):
     with pytest.raises(ValueError):
         _ = parser.tokenize('command with "unclosed quotes')
 
+def _legacy_tokens(parser, line):
+    """Tokens as produced by shlex_split() followed by _split_on_punctuation()"""
+    return parser._split_on_punctuation(shlex_split(line))
+
+@pytest.mark.parametrize('line', [
+    '',
+    '   ',
+    'command',
+    '  command   arg  ',
+    'command\targ\r\narg2',
+    'command "quoted arg" \'single quoted\'',
+    'command "quoted"trailing',
+    'command "one""two"',
+    'command mid"word quote',
+    'command mid\'word quote\'',
+    'command a|"b c"',
+    'command "multi\nline" arg',
+    'command \'"\' "\'"',
+    'command ""',
+    'help|less',
+    'help||less',
+    'help >> out.txt',
+    'help>>>out.txt',
+    'cmd;;; >out',
+    'cmd & | > ;',
+    'cmd ;&;&',
+    'cmd\x0barg',
+    'dir home > café',
+    'cmd "a|b" c|d',
+])
+@pytest.mark.parametrize('allow_redirection', [True, False])
+def test_lex_matches_legacy_tokenizer(parser, line, allow_redirection):
+    parser.allow_redirection = allow_redirection
+    tokens, unquoted_tokens = parser.lex(line)
+    assert tokens == _legacy_tokens(parser, line)
+    assert unquoted_tokens == [utils.strip_quotes(cur_token) for cur_token in tokens]
+
+def test_lex_matches_legacy_tokenizer_random(parser):
+    import random
+    rand = random.Random(1234)
+    alphabet = 'ab "\'|>;&#\t\n-'
+    for _ in range(5000):
+        line = ''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 20)))
+        try:
+            expected = _legacy_tokens(parser, line)
+        except ValueError:
+            with pytest.raises(ValueError):
+                parser.lex(line)
+        else:
+            assert parser.lex(line)[0] == expected
+
+def test_lex_multichar_terminator():
+    parser = StatementParser(terminators=[';;', ';'])
+    line = 'cmd;; arg;;'
+    assert parser.lex(line)[0] == _legacy_tokens(parser, line)
+
+def test_lex_unclosed_quotes(parser):
+    with pytest.raises(ValueError):
+        parser.lex('command with "unclosed quotes')
+
 @pytest.mark.parametrize('tokens,command,args', [
     ([], '', ''),
     (['command'], 'command', ''),
@@ -846,3 +914,298 @@ def test_macro_escaped_arg_pattern():
 
     matches = pattern.findall('{{5text}}')
     assert not matches
+
+def test_parse_cache_hits_and_misses(parser):
+    first = parser.parse('help history')
+    second = parser.parse('help history')
+    assert first is second
+    info = parser.parse_cache_info()
+    assert info.hits == 1
+    assert info.misses == 1
+    assert info.currsize == 1
+
+    # The expand flag is part of the key
+    unexpanded = parser.parse('help history', expand=False)
+    assert unexpanded is not first
+    assert parser.parse_cache_info().misses == 2
+
+    # parse_command_only() results are cached separately from parse()
+    partial = parser.parse_command_only('help history')
+    assert partial is not first
+    assert parser.parse_command_only('help history') is partial
+
+def test_parse_cache_eviction():
+    parser = StatementParser(cache_size=2)
+    first = parser.parse('one')
+    parser.parse('two')
+    parser.parse('one')
+    parser.parse('three')
+    assert parser.parse_cache_info().currsize == 2
+    # 'two' was least recently used, so 'one' is still cached
+    assert parser.parse('one') is first
+    parser.parse('two')
+    assert parser.parse_cache_info().misses == 4
+
+def test_parse_cache_disabled():
+    parser = StatementParser(cache_size=0)
+    assert parser.parse('help') is not parser.parse('help')
+    assert parser.parse_cache_info() == (0, 0, 0, 0)
+
+def test_parse_cache_does_not_store_errors(parser):
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            parser.parse('command with "unclosed quotes')
+    assert parser.parse_cache_info().currsize == 0
+
+def test_parse_cache_cleared_by_alias_change(parser):
+    assert parser.parse('newalias').command == 'newalias'
+    parser.aliases['newalias'] = 'help'
+    assert parser.parse('newalias').command == 'help'
+    del parser.aliases['newalias']
+    assert parser.parse('newalias').command == 'newalias'
+    parser.aliases.update(newalias='shell')
+    assert parser.parse('newalias').command == 'shell'
+    parser.aliases.clear()
+    assert parser.parse('newalias').command == 'newalias'
+
+def test_parse_cache_cleared_by_settings_change(parser):
+    assert parser.parse('help|less').pipe_to == ['less']
+    parser.allow_redirection = False
+    assert parser.parse('help|less').pipe_to == []
+
+    assert parser.parse('cmd;').terminator == ';'
+    parser.terminators = ['&']
+    assert parser.parse('cmd;').terminator == ''
+
+    assert parser.parse('newmulti').multiline_command == ''
+    parser.multiline_commands = ['newmulti']
+    assert parser.parse('newmulti').multiline_command == 'newmulti'
+
+    assert parser.parse('@cmd').command == '@cmd'
+    parser.shortcuts = [('@', 'load')]
+    assert parser.parse('@cmd').command == 'load'
+
+def _legacy_expand(parser, line):
+    """Alias and shortcut expansion as it was done before aliases were looked up by command name"""
+    tmp_aliases = list(parser.aliases.keys())
+    keep_expanding = bool(tmp_aliases)
+    while keep_expanding:
+        for cur_alias in tmp_aliases:
+            keep_expanding = False
+            match = parser._command_pattern.search(line)
+            if match:
+                command = match.group(1)
+                if command and command == cur_alias:
+                    line = parser.aliases[cur_alias] + match.group(2) + line[match.end(2):]
+                    tmp_aliases.remove(cur_alias)
+                    keep_expanding = bool(tmp_aliases)
+                    break
+
+    for (shortcut, expansion) in parser.shortcuts:
+        if line.startswith(shortcut):
+            shortcut_len = len(shortcut)
+            if len(line) == shortcut_len or line[shortcut_len] != ' ':
+                expansion += ' '
+            line = line.replace(shortcut, expansion, 1)
+            break
+    return line
+
+@pytest.mark.parametrize('line', [
+    '',
+    'helpalias',
+    '  helpalias arg',
+    'helpalias>out.txt',
+    '42;',
+    'l | less',
+    'anothermultiline stuff',
+    '?',
+    '?topic',
+    '? topic',
+    '!!ls',
+    'chain1 arg',
+    'loop1',
+    'selfloop',
+    'chain1',
+])
+def test_expand_matches_legacy(parser, line):
+    parser.aliases.update({'chain1': 'chain2 one', 'chain2': 'chain3 two', 'chain3': 'help',
+                           'loop1': 'loop2', 'loop2': 'loop1 x', 'selfloop': 'selfloop again'})
+    assert parser._expand(line) == _legacy_expand(parser, line)
+
+def test_expand_alias_chain_and_cycle(parser):
+    parser.aliases.update({'chain1': 'chain2 one', 'chain2': 'help two', 'loop1': 'loop2', 'loop2': 'loop1 x'})
+    assert parser._expand('chain1 arg') == 'help two one arg'
+    assert parser._expand('loop1') == 'loop1 x'
+
+@pytest.mark.parametrize('shortcuts', [
+    [('@', 'load'), ('@@', '_relative_load')],
+    [('@@', '_relative_load'), ('@', 'load')],
+    [('!', 'shell'), ('!', 'other'), ('', 'empty')],
+])
+@pytest.mark.parametrize('line', ['@', '@@', '@script', '@@script', '@ script', '!ls', '', 'plain'])
+def test_expand_shortcut_precedence_matches_legacy(shortcuts, line):
+    parser = StatementParser(shortcuts=shortcuts)
+    assert parser._expand(line) == _legacy_expand(parser, line)
+
+def test_statement_has_no_dict(parser):
+    statement = parser.parse('say hello')
+    assert not hasattr(statement, '__dict__')
+
+def test_statement_derived_values_are_cached(parser):
+    statement = parser.parse('say "hello there" > out.txt')
+    assert statement.command_and_args is statement.command_and_args
+    assert statement.expanded_command_line is statement.expanded_command_line
+
+    # argv returns a new list each time so modifying it can't corrupt the statement
+    argv = statement.argv
+    argv.append('extra')
+    assert statement.argv == ['say', 'hello there']
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_statement_pickle(parser, protocol):
+    statement = parser.parse('say "hello there" | wc')
+    # fill in the cached values so they are part of the object being pickled
+    _ = statement.argv, statement.expanded_command_line
+
+    restored = pickle.loads(pickle.dumps(statement, protocol))
+    assert restored == statement
+    assert str(restored) == str(statement)
+    assert repr(restored) == repr(statement)
+    assert restored.argv == statement.argv
+    assert restored.expanded_command_line == statement.expanded_command_line
+
+def test_statement_unpickle_dict_state():
+    # A Statement pickled by a version of cmd2 which stored its attributes in a __dict__
+    legacy = (b'\x80\x02ccmd2.parsing\nStatement\nq\x00X\n\x00\x00\x00"hi there"q\x01\x85q\x02\x81q\x03}q\x04('
+              b'X\x04\x00\x00\x00argsq\x05X\n\x00\x00\x00"hi there"q\x06X\x03\x00\x00\x00rawq\x07X\x13\x00\x00\x00'
+              b'say "hi there" | wcq\x08X\x07\x00\x00\x00commandq\tX\x03\x00\x00\x00sayq\nX\x08\x00\x00\x00arg_list'
+              b'q\x0b]q\x0ch\x06aX\x11\x00\x00\x00multiline_commandq\rX\x00\x00\x00\x00q\x0eX\n\x00\x00\x00terminator'
+              b'q\x0fh\x0eX\x06\x00\x00\x00suffixq\x10h\x0eX\x07\x00\x00\x00pipe_toq\x11]q\x12X\x02\x00\x00\x00wcq\x13'
+              b'aX\x06\x00\x00\x00outputq\x14h\x0eX\t\x00\x00\x00output_toq\x15h\x0eub.')
+    statement = pickle.loads(legacy)
+    assert statement == '"hi there"'
+    assert statement.command == 'say'
+    assert statement.argv == ['say', 'hi there']
+    assert statement.pipe_to == ['wc']
+    assert statement.expanded_command_line == 'say "hi there" | wc'
+
+def test_parse_many(parser):
+    script = ['help',
+              '',
+              '# a comment',
+              'multiline first line',
+              'second line;',
+              'say "unclosed',
+              'helpalias history > out.txt',
+              ]
+    results = list(parser.parse_many(script))
+    assert [result.line_number for result in results] == [1, 4, 6, 7]
+
+    assert results[0].statement.command == 'help'
+    assert results[0].error is None
+
+    multiline = results[1].statement
+    assert multiline.multiline_command == 'multiline'
+    assert multiline.raw == 'multiline first line\nsecond line;'
+    assert multiline.arg_list == ['first', 'line', 'second', 'line']
+    assert multiline.terminator == ';'
+
+    assert results[2].statement is None
+    assert isinstance(results[2].error, ValueError)
+    assert results[2].line == 'say "unclosed'
+
+    assert results[3].statement.command == 'help'
+    assert results[3].statement.output_to == 'out.txt'
+
+def test_parse_many_matches_parse(parser):
+    script = ['help history', 'l | less', '!ls -al', '42 arg']
+    assert [result.statement for result in parser.parse_many(script)] == [parser.parse(line) for line in script]
+
+def test_parse_many_strips_line_endings(parser):
+    results = list(parser.parse_many(['help\n', 'say hi\r\n']))
+    assert [result.statement.command_and_args for result in results] == ['help', 'say hi']
+    assert not results[0].statement.terminator
+
+def test_parse_many_multiline_with_quotes(parser):
+    results = list(parser.parse_many(['multiline "open quote', 'still quoted" done;']))
+    assert len(results) == 1
+    assert results[0].statement.arg_list == ['"open quote\nstill quoted"', 'done']
+
+def test_parse_many_blank_line_terminates_multiline(parser):
+    results = list(parser.parse_many(['multiline one', '', 'help']))
+    assert results[0].statement.terminator == constants.LINE_FEED
+    assert results[1].line_number == 3
+
+def test_parse_many_unfinished_multiline_at_end(parser):
+    results = list(parser.parse_many(['help', 'multiline never finished']))
+    assert results[1].line_number == 2
+    assert results[1].statement.multiline_command == 'multiline'
+    assert results[1].statement.terminator == constants.LINE_FEED
+
+    results = list(parser.parse_many(['multiline "never closed']))
+    assert isinstance(results[0].error, ValueError)
+
+def test_parse_many_is_lazy(parser):
+    results = parser.parse_many(['newalias', 'newalias'])
+    assert next(results).statement.command == 'newalias'
+    parser.aliases['newalias'] = 'help'
+    assert next(results).statement.command == 'help'
+
+def test_parse_many_parses_multiline_once(parser):
+    # The lines of a long multiline command are collected without parsing the command again after each one
+    script = ['multiline start'] + ['more words'] * 50 + ['last line;', 'help']
+    with mock.patch.object(parser, 'parse', wraps=parser.parse) as parse:
+        results = list(parser.parse_many(script))
+    assert parse.call_count == 3
+    assert [result.line_number for result in results] == [1, 53]
+    assert results[0].statement.arg_list == ['start'] + ['more', 'words'] * 50 + ['last', 'line']
+
+def test_parse_many_multiline_quotes_and_blank_lines(parser):
+    # A blank line inside quotation marks doesn't end a multiline command
+    results = list(parser.parse_many(['multiline "open', '', 'closed"', 'still going', '', 'help']))
+    assert len(results) == 2
+    assert results[0].statement.raw == 'multiline "open\n\nclosed"\nstill going\n'
+    assert results[0].statement.terminator == constants.LINE_FEED
+    assert results[1].statement.command == 'help'
+
+def test_parse_many_keep_empty(parser):
+    script = ['help', '', '# a comment', 'multiline one', '', 'two;']
+    results = list(parser.parse_many(script, keep_empty=True))
+    assert [result.line_number for result in results] == [1, 2, 3, 4, 6]
+    assert [result.statement.command for result in results] == ['help', '', '', 'multiline', 'two']
+    assert results[3].statement.raw == 'multiline one\n'
+
+def _make_macro(value):
+    """Build a Macro the way the macro create command does"""
+    import re
+    from cmd2.parsing import Macro, MacroArg
+    arg_list = []
+    max_arg_num = 0
+    for match in re.finditer(MacroArg.macro_normal_arg_pattern, value):
+        num_str = MacroArg.digit_pattern.findall(match.group())[0]
+        max_arg_num = max(max_arg_num, int(num_str))
+        arg_list.append(MacroArg(start_index=match.start(), number_str=num_str, is_escaped=False))
+    for match in re.finditer(MacroArg.macro_escaped_arg_pattern, value):
+        num_str = MacroArg.digit_pattern.findall(match.group())[0]
+        arg_list.append(MacroArg(start_index=match.start(), number_str=num_str, is_escaped=True))
+    return Macro(name='fake', value=value, minimum_arg_count=max_arg_num, arg_list=arg_list)
+
+@pytest.mark.parametrize('value,line,resolved', [
+    ('help', 'fake', 'help'),
+    ('say {1} and {2}', 'fake one two', 'say one and two'),
+    ('say {2}{1}{2}', 'fake one two', 'say twoonetwo'),
+    ('say {1}', 'fake "quoted one" extra "quoted extra"', 'say quoted one extra "quoted extra"'),
+    ('say {{1}} {1}', 'fake one', 'say {1} one'),
+    ('say {1} {{1}}', 'fake one', 'say one {1}'),
+    ('say {{{1}}} {{1}', 'fake one', 'say {{1}} {one'),
+    ('say {\N{ARABIC-INDIC DIGIT ONE}}', 'fake one', 'say one'),
+])
+def test_macro_resolve(default_parser, value, line, resolved):
+    macro = _make_macro(value)
+    assert macro.resolve(default_parser.parse(line)) == resolved
+
+def test_macro_resolve_many_args(default_parser):
+    value = 'say ' + ' '.join('{{{}}}'.format(i) for i in range(40, 0, -1))
+    macro = _make_macro(value)
+    line = 'fake ' + ' '.join('a{}'.format(i) for i in range(1, 41))
+    assert macro.resolve(default_parser.parse(line)) == 'say ' + ' '.join('a{}'.format(i) for i in range(40, 0, -1))
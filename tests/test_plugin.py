@@ -6,11 +6,19 @@ Test plugin infrastructure and hooks.
 Copyright 2018 Jared Crapo <jared@kotfu.net>
 Released under MIT license, see LICENSE file
 """
+import os
+import tempfile
+
 import pytest
 
 import cmd2
 from cmd2 import plugin
 
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
 
 class Plugin:
     """A mixin class for testing hook registration and calling"""
@@ -778,6 +786,30 @@ def test_cmdfinalization(capsys):
     assert not err
     assert app.called_cmdfinalization == 2
 
+def test_cmdfinalization_runcmds_blank_and_comment_lines(capsys):
+    app = PluggedApp()
+    app.register_cmdfinalization_hook(app.cmdfinalization_hook)
+    app.runcmds_plus_hooks(['say hello', '', '# a comment'])
+    out, err = capsys.readouterr()
+    assert out == 'hello\n'
+    assert app.called_cmdfinalization == 3
+
+def test_cmdfinalization_load_blank_and_comment_lines(capsys):
+    app = PluggedApp()
+    app.register_cmdfinalization_hook(app.cmdfinalization_hook)
+    fd, filename = tempfile.mkstemp(suffix='.txt', text=True)
+    with os.fdopen(fd, 'w') as f:
+        f.write('say hello\n\n# a comment\n')
+    try:
+        app.runcmds_plus_hooks(['load {}'.format(filename)])
+    finally:
+        os.remove(filename)
+    out, err = capsys.readouterr()
+    assert out == 'hello\n'
+
+    # load itself, the three lines of the script, and the eos command which ends it
+    assert app.called_cmdfinalization == 5
+
 def test_cmdfinalization_stop_first(capsys):
     app = PluggedApp()
     app.register_cmdfinalization_hook(app.cmdfinalization_hook_stop)
@@ -819,3 +851,82 @@ def test_cmdfinalization_hook_exception(capsys):
     assert out == 'hello\n'
     assert err
     assert app.called_cmdfinalization == 1
+
+
+###
+#
+# test compiled hook chains
+#
+###
+def test_compile_hooks_empty():
+    assert plugin.compile_hooks([]) is None
+
+def test_compile_hooks_single():
+    def hook(data: plugin.PrecommandData) -> plugin.PrecommandData:
+        return data
+    assert plugin.compile_hooks([hook]) is hook
+
+def test_compile_hooks_order():
+    def make_hook(name):
+        def hook(data: plugin.PostcommandData) -> plugin.PostcommandData:
+            data.statement += name
+            return data
+        return hook
+
+    hooks = [make_hook('a'), make_hook('b'), make_hook('c')]
+    chain = plugin.compile_hooks(hooks)
+    assert chain(plugin.PostcommandData(False, '')).statement == 'abc'
+
+    # Later registrations don't change a compiled chain
+    hooks.append(make_hook('d'))
+    assert chain(plugin.PostcommandData(False, '')).statement == 'abc'
+
+def test_compile_hooks_stop_early():
+    calls = []
+
+    def stop_hook(data: plugin.PostparsingData) -> plugin.PostparsingData:
+        calls.append('stop')
+        data.stop = True
+        return data
+
+    def other_hook(data: plugin.PostparsingData) -> plugin.PostparsingData:
+        calls.append('other')
+        return data
+
+    data = plugin.compile_hooks([stop_hook, other_hook], stop_early=True)(plugin.PostparsingData(False, ''))
+    assert data.stop
+    assert calls == ['stop']
+
+    calls.clear()
+    data = plugin.compile_hooks([stop_hook, other_hook])(plugin.CommandFinalizationData(False, ''))
+    assert data.stop
+    assert calls == ['stop', 'other']
+
+def test_no_hooks_creates_no_data(capsys):
+    app = PluggedApp()
+    with mock.patch.object(plugin, 'PostparsingData', side_effect=AssertionError), \
+            mock.patch.object(plugin, 'PrecommandData', side_effect=AssertionError), \
+            mock.patch.object(plugin, 'PostcommandData', side_effect=AssertionError), \
+            mock.patch.object(plugin, 'CommandFinalizationData', side_effect=AssertionError):
+        stop = app.onecmd_plus_hooks('say hello')
+    out, err = capsys.readouterr()
+    assert not stop
+    assert out == 'hello\n'
+    assert not err
+
+def test_hooks_without_redirection_keep_pipe_proc_reader(capsys):
+    app = PluggedApp()
+    seen = []
+
+    def precmd_hook(data: plugin.PrecommandData) -> plugin.PrecommandData:
+        seen.append(app.cur_pipe_proc_reader)
+        return data
+
+    app.register_precmd_hook(precmd_hook)
+    outer_reader = object()
+    app.cur_pipe_proc_reader = outer_reader
+    app.onecmd_plus_hooks('say hello')
+
+    # The command runs without the outer pipe process, which is restored afterward
+    assert seen == [None]
+    assert app.cur_pipe_proc_reader is outer_reader
@@ -29,7 +29,7 @@ def test_pyscript_dir(base_app, request):
 
     out, err = run_cmd(base_app, 'pyscript {}'.format(python_script))
     assert out
-    assert out[0] == "['cmd_echo']"
+    assert out[0] == "['cmd_echo', 'max_capture_bytes']"
 
 
 def test_pyscript_stdout_capture(base_app, request):
@@ -40,3 +40,10 @@ def test_pyscript_stdout_capture(base_app, request):
 
     assert out[0] == "PASSED"
     assert out[1] == "PASSED"
+
+
+def test_pyscript_capture_limit(base_app, request):
+    test_dir = os.path.dirname(request.module.__file__)
+    python_script = os.path.join(test_dir, 'pyscript', 'capture_limit.py')
+    out, err = run_cmd(base_app, 'pyscript {}'.format(python_script))
+    assert out[0] == "PASSED"
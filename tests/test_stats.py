@@ -0,0 +1,115 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/stats.py module.
+"""
+import random
+
+import pytest
+
+from cmd2 import stats
+
+
+def test_bucket_bounds_are_contiguous():
+    previous_upper = 0
+    for index in range(stats._NUM_BUCKETS):
+        lower, upper = stats._bucket_bounds(index)
+        assert lower == previous_upper
+        assert upper > lower
+        previous_upper = upper
+
+@pytest.mark.parametrize('duration', [0, 1, 3, 4, 7, 8, 9, 15, 16, 1000, 123456, 999999999, 2 ** 39 + 12345])
+def test_bucket_index(duration):
+    lower, upper = stats._bucket_bounds(stats._bucket_index(duration))
+    assert lower <= duration < upper
+    # Buckets are at most 25% as wide as their lower bound
+    assert upper - lower <= max(1, lower // 4)
+
+def test_bucket_index_overflow():
+    assert stats._bucket_index(2 ** 50) == stats._NUM_BUCKETS - 1
+
+def test_histogram_empty():
+    histogram = stats.LatencyHistogram()
+    assert histogram.count == 0
+    assert histogram.percentile(50) == 0
+
+def test_histogram_single_value():
+    histogram = stats.LatencyHistogram()
+    histogram.add(123456)
+    assert histogram.count == 1
+    assert histogram.min == histogram.max == histogram.total == 123456
+    for percent in (0, 50, 99, 100):
+        assert histogram.percentile(percent) == 123456
+
+def test_histogram_percentiles():
+    rand = random.Random(1)
+    durations = [rand.randint(1000, 10000000) for _ in range(10000)]
+    histogram = stats.LatencyHistogram()
+    for duration in durations:
+        histogram.add(duration)
+
+    durations.sort()
+    assert histogram.count == len(durations)
+    assert histogram.total == sum(durations)
+    assert histogram.min == durations[0]
+    assert histogram.max == durations[-1]
+    for percent in (50, 95, 99):
+        exact = durations[-(-len(durations) * percent // 100) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= exact // 4
+
+def test_timer():
+    timer = stats.CommandTimer()
+    timer.mark(stats.PHASE_PARSE)
+    timer.mark(stats.PHASE_REDIRECTION)
+    timer.mark(stats.PHASE_COMMAND)
+    timer.mark(stats.PHASE_REDIRECTION)
+    assert list(timer.phases) == [stats.PHASE_PARSE, stats.PHASE_REDIRECTION, stats.PHASE_COMMAND]
+    assert all(duration >= 0 for duration in timer.phases.values())
+
+def make_timer(**phases):
+    timer = stats.CommandTimer()
+    timer.phases = phases
+    return timer
+
+def test_collector_record():
+    collector = stats.StatsCollector()
+    collector.record('help', make_timer(parse=10, command=100))
+    collector.record('help', make_timer(parse=20, command=200, postparsing=5), error=True)
+
+    help_stats = collector.get('help')
+    assert help_stats.calls == 2
+    assert help_stats.errors == 1
+    assert help_stats.latency.total == 335
+    assert help_stats.phases['parse'].count == 2
+    assert help_stats.phases['postparsing'].count == 1
+    assert collector.get('set') is None
+    assert len(collector) == 1
+
+    collector.reset()
+    assert len(collector) == 0
+    assert collector.get('help') is None
+
+def test_collector_max_commands():
+    collector = stats.StatsCollector(max_commands=2)
+    for command in ('one', 'two', 'three', 'four', 'one'):
+        collector.record(command, make_timer(command=1))
+
+    assert len(collector) == 3
+    assert collector.get('one').calls == 2
+    assert collector.get('two').calls == 1
+    assert collector.get(stats.OTHER_COMMANDS).calls == 2
+    assert collector.get('three') is None
+
+@pytest.mark.parametrize('duration, expected', [
+    (0, '0 ns'),
+    (999, '999 ns'),
+    (1000, '1 us'),
+    (12345, '12.3 us'),
+    (1500000, '1.5 ms'),
+    (2000000000, '2 s'),
+])
+def test_format_duration(duration, expected):
+    assert stats.format_duration(duration) == expected
+
+def test_phase_order():
+    assert stats.phase_order(['finalization', 'command', 'parse']) == ['parse', 'command', 'finalization']
@@ -0,0 +1,66 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/text_metrics.py module.
+"""
+import pytest
+from colorama import Fore
+from wcwidth import wcswidth
+
+from cmd2 import text_metrics
+
+
+def test_strip_ansi():
+    assert text_metrics.strip_ansi(Fore.GREEN + 'green' + Fore.RESET + ' plain') == 'green plain'
+
+def test_strip_ansi_plain_returns_same_string():
+    text = 'no escapes here'
+    assert text_metrics.strip_ansi(text) is text
+
+@pytest.mark.parametrize('text, plain', [
+    ('', True),
+    ('hello, world! ~', True),
+    ('tab\there', False),
+    ('line\n', False),
+    ('café', False),
+    ('\x7f', False),
+])
+def test_is_plain_ascii(text, plain):
+    assert text_metrics.is_plain_ascii(text) is plain
+
+@pytest.mark.parametrize('text', [
+    '',
+    'plain ascii',
+    'café',
+    '中文 wide',
+    'é combining',
+    'control\x07',
+    'tab\there',
+])
+def test_width_matches_wcswidth(text):
+    assert text_metrics.width(text) == wcswidth(text)
+    colored = Fore.CYAN + text + Fore.RESET
+    assert text_metrics.width(colored) == wcswidth(text)
+
+def test_width_cache():
+    text = Fore.RED + '中文 cached' + Fore.RESET
+    text_metrics.width(text)
+    hits = text_metrics.width_cache_info().hits
+    assert text_metrics.width(text) == 11
+    assert text_metrics.width_cache_info().hits == hits + 1
+
+def test_width_plain_ascii_not_cached():
+    size = text_metrics.width_cache_info().currsize
+    text_metrics.width('plain text which is never cached')
+    assert text_metrics.width_cache_info().currsize == size
+
+def test_widths():
+    assert text_metrics.widths(['a', 'bb', '']) == [1, 2, 0]
+    assert text_metrics.widths(iter(['a', Fore.RED + 'bb' + Fore.RESET, '中'])) == [1, 2, 2]
+    assert text_metrics.widths([]) == []
+
+def test_max_width():
+    assert text_metrics.max_width(['a', 'ccc', 'bb']) == 3
+    assert text_metrics.max_width([Fore.RED + 'a' + Fore.RESET, '中文']) == 4
+    assert text_metrics.max_width([]) == 0
+    assert text_metrics.max_width([], default=20) == 20
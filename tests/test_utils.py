@@ -6,13 +6,17 @@ Unit testing for cmd2/utils.py module.
 Copyright 2018 Todd Leonhardt <todd.leonhardt@gmail.com>
 Released under MIT license, see LICENSE file
 """
+import io
+import os
 import signal
 import sys
+import tempfile
 
 import pytest
 
 from colorama import Fore
 import cmd2.utils as cu
+from cmd2 import constants
 
 HELLO_WORLD = 'Hello, world!'
 
@@ -227,6 +231,98 @@ def test_stdsim_line_buffering(base_app):
     stdsim.buffer.write(bytes_to_write)
     assert os.path.getsize(file.name) == saved_size + len(bytes_to_write)
 
+def test_stdsim_large_contents():
+    stdsim = cu.StdSim(sys.stdout)
+    pieces = ['line {}\n'.format(i) for i in range(50000)]
+    for piece in pieces:
+        stdsim.write(piece)
+    big = b'x' * (cu.ByteBuf.CHUNK_SIZE * 2)
+    stdsim.buffer.write(big)
+
+    expected = ''.join(pieces).encode() + big
+    assert len(stdsim.buffer._chunks) > 1
+    assert stdsim.size == len(expected)
+    assert stdsim.getbytes() == expected
+    assert stdsim.getvalue() == expected.decode()
+
+def test_stdsim_getvalue_incremental():
+    stdsim = cu.StdSim(sys.stdout)
+    euro = '\u20ac'.encode()
+    stdsim.write('a')
+    assert stdsim.getvalue() == 'a'
+
+    # A character split across writes is replaced until the rest of it arrives
+    stdsim.buffer.write(euro[:1])
+    assert stdsim.getvalue() == 'a\ufffd'
+    stdsim.buffer.write(euro[1:])
+    assert stdsim.getvalue() == 'a\u20ac'
+    stdsim.write('b')
+    assert stdsim.getvalue() == 'a\u20acb'
+
+    stdsim.clear()
+    assert stdsim.getvalue() == ''
+    stdsim.write('c')
+    assert stdsim.getvalue() == 'c'
+
+def test_stdsim_iter_lines():
+    stdsim = cu.StdSim(sys.stdout)
+    stdsim.write('one\r\ntwo\n')
+    stdsim.buffer.write(b'x' * cu.ByteBuf.CHUNK_SIZE)
+    stdsim.write('\n\u20ac last')
+    assert list(stdsim.iter_lines()) == ['one', 'two', 'x' * cu.ByteBuf.CHUNK_SIZE, '\u20ac last']
+
+def test_stdsim_iter_lines_empty():
+    assert list(cu.StdSim(sys.stdout).iter_lines()) == []
+
+def test_stdsim_truncate_head():
+    stdsim = cu.StdSim(sys.stdout, max_bytes=10)
+    for i in range(10):
+        stdsim.write('{}\n'.format(i))
+    assert stdsim.getvalue() == '5\n6\n7\n8\n9\n'
+    assert stdsim.size == 10
+    assert stdsim.truncated == 10
+
+    stdsim.buffer.write(b'abcdefghijklmnop')
+    assert stdsim.getvalue() == 'ghijklmnop'
+    assert stdsim.truncated == 26
+
+def test_stdsim_truncate_tail():
+    stdsim = cu.StdSim(sys.stdout, max_bytes=10, overflow=constants.OVERFLOW_TRUNCATE_TAIL)
+    for i in range(10):
+        stdsim.write('{}\n'.format(i))
+    assert stdsim.getvalue() == '0\n1\n2\n3\n4\n'
+    assert stdsim.truncated == 10
+
+    stdsim.clear()
+    assert stdsim.truncated == 0
+    stdsim.write('after clear')
+    assert stdsim.getvalue() == 'after clear'[:10]
+
+def test_stdsim_spill():
+    stdsim = cu.StdSim(sys.stdout, max_bytes=10, overflow=constants.OVERFLOW_SPILL)
+    stdsim.write('short\n')
+    assert not stdsim.spilled
+
+    stdsim.write('this goes past the limit\n')
+    stdsim.write('more\n')
+    assert stdsim.spilled
+    assert not stdsim.buffer._chunks and not stdsim.buffer._tail
+    assert stdsim.truncated == 0
+    assert stdsim.getvalue() == 'short\nthis goes past the limit\nmore\n'
+    assert list(stdsim.iter_lines()) == ['short', 'this goes past the limit', 'more']
+
+    spill_file = stdsim.buffer.spill_file
+    assert stdsim.readbytes() == b'short\nthis goes past the limit\nmore\n'
+    assert spill_file.closed
+    assert not stdsim.spilled
+    assert stdsim.getvalue() == ''
+
+def test_stdsim_bad_overflow():
+    with pytest.raises(ValueError):
+        cu.StdSim(sys.stdout, overflow='drop')
+    with pytest.raises(ValueError):
+        cu.StdSim(sys.stdout, max_bytes=-1)
+
 
 @pytest.fixture
 def pr_none():
@@ -267,6 +363,43 @@ def test_proc_reader_wait(pr_none):
     assert pr_none._proc.poll() == 0
 
 
+def _read_with_proc_reader(code: str):
+    """Run Python code in a process read by a ProcReader and return its output and the CPU time used"""
+    import subprocess
+    import time
+    out = cu.StdSim(sys.stdout)
+    err = cu.StdSim(sys.stderr)
+    proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    start = time.process_time()
+    pr = cu.ProcReader(proc, out, err)
+    pr.wait()
+    return out.getvalue(), err.getvalue(), time.process_time() - start
+
+def test_proc_reader_slow_producer():
+    code = ("import sys, time\n"
+            "for i in range(5):\n"
+            "    print('out', i, flush=True)\n"
+            "    print('err', i, file=sys.stderr, flush=True)\n"
+            "    time.sleep(0.1)\n")
+    out, err, cpu_time = _read_with_proc_reader(code)
+    assert out == ''.join('out {}\n'.format(i) for i in range(5))
+    assert err == ''.join('err {}\n'.format(i) for i in range(5))
+
+    # The reader threads sleep while the process does
+    assert cpu_time < 0.2
+
+def test_proc_reader_pipes_closed_before_exit():
+    code = ("import os, sys, time\n"
+            "print('done', flush=True)\n"
+            "os.close(sys.stdout.fileno())\n"
+            "os.close(sys.stderr.fileno())\n"
+            "time.sleep(0.5)\n")
+    out, err, cpu_time = _read_with_proc_reader(code)
+    assert out == 'done\n'
+    assert err == ''
+    assert cpu_time < 0.2
+
+
 @pytest.fixture
 def context_flag():
     return cu.ContextFlag()
@@ -279,3 +412,227 @@ def test_context_flag_bool(context_flag):
 def test_context_flag_exit_err(context_flag):
     with pytest.raises(ValueError):
         context_flag.__exit__()
+
+
+@pytest.fixture
+def text_file():
+    fd, filename = tempfile.mkstemp(prefix='cmd2_test', suffix='.txt')
+    os.close(fd)
+    yield filename
+    os.remove(filename)
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+@pytest.mark.parametrize('contents', [
+    'help\nshortcuts\n',
+    'no final newline',
+    'blank\n\nlines\n\n',
+    'windows\r\nline\r\nendings\r\n',
+    'old mac\rline endings',
+    '!echo γνωρίζω\nhistory\n',
+    '\n',
+])
+def test_read_text_lines(text_file, contents, use_mmap):
+    with open(text_file, 'w', encoding='utf-8', newline='') as f:
+        f.write(contents)
+    with open(text_file, encoding='utf-8') as f:
+        expected = f.read().splitlines()
+    assert list(cu.read_text_lines(text_file, use_mmap=use_mmap)) == expected
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_read_text_lines_empty(text_file, use_mmap):
+    assert list(cu.read_text_lines(text_file, use_mmap=use_mmap)) == []
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_read_text_lines_decode_error(text_file, use_mmap):
+    with open(text_file, 'wb') as f:
+        f.write(b'first\nsecond\nthird \xff\nfourth\n')
+
+    lines = cu.read_text_lines(text_file, use_mmap=use_mmap)
+    assert next(lines) == 'first'
+    assert next(lines) == 'second'
+    with pytest.raises(UnicodeDecodeError) as excinfo:
+        next(lines)
+    assert 'line 3' in excinfo.value.reason
+
+def test_is_text_file(text_file):
+    with open(text_file, 'wb') as f:
+        f.write('ascii\nutf-8 γνωρίζω\n'.encode('utf-8'))
+    assert cu.is_text_file(text_file)
+
+    with open(text_file, 'wb') as f:
+        f.write(b'ascii\n\xff\n')
+    assert not cu.is_text_file(text_file)
+
+    # Empty files are not text files
+    open(text_file, 'w').close()
+    assert not cu.is_text_file(text_file)
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="termios is not available on Windows")
+def test_terminal_state():
+    import termios
+    master_fd, slave_fd = os.openpty()
+    try:
+        with os.fdopen(slave_fd, 'w', closefd=False) as slave:
+            state = cu.TerminalState.save(slave)
+        assert state.fd == slave_fd
+
+        # Break the terminal like a program exiting in raw mode would
+        attributes = termios.tcgetattr(slave_fd)
+        attributes[3] &= ~(termios.ECHO | termios.ICANON)
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attributes)
+        assert termios.tcgetattr(slave_fd) != state.attributes
+
+        assert state.restore()
+        assert termios.tcgetattr(slave_fd) == state.attributes
+    finally:
+        os.close(master_fd)
+        os.close(slave_fd)
+
+    # The terminal is gone
+    assert not state.restore()
+
+def test_terminal_state_not_a_terminal():
+    assert cu.TerminalState.save(cu.StdSim(sys.stdout)) is None
+    assert cu.TerminalState.save(object()) is None
+
+def test_read_stream_lines_text_stream():
+    stream = io.StringIO('one\ntwo\r\n\nthree')
+    assert list(cu.read_stream_lines(stream)) == ['one', 'two', '', 'three']
+
+def test_read_stream_lines_binary_buffer():
+    text = 'café\r\n漢字\n\nlast'
+    stream = io.TextIOWrapper(io.BytesIO(text.encode('utf-8')), encoding='utf-8')
+    assert list(cu.read_stream_lines(stream)) == ['café', '漢字', '', 'last']
+
+def test_read_stream_lines_universal_newlines():
+    stream = io.TextIOWrapper(io.BytesIO(b'one\rtwo\r\nthree\n'), encoding='utf-8')
+    assert list(cu.read_stream_lines(stream)) == ['one', 'two', 'three']
+
+def test_read_stream_lines_after_partial_read():
+    # Text the stream decoded while a line was read from it isn't skipped
+    stream = io.TextIOWrapper(io.BytesIO(b'first\nsecond\nthird\n'), encoding='utf-8')
+    assert stream.readline() == 'first\n'
+    assert list(cu.read_stream_lines(stream)) == ['second', 'third']
+
+def test_read_stream_lines_empty():
+    stream = io.TextIOWrapper(io.BytesIO(b''), encoding='utf-8')
+    assert list(cu.read_stream_lines(stream)) == []
+
+def test_block_writer():
+    inner = io.StringIO()
+    writer = cu.BlockWriter(inner, block_size=10)
+    writer.write('hello ')
+    assert inner.getvalue() == ''
+    writer.write('world')
+    assert inner.getvalue() == 'hello world'
+    writer.write('!')
+    writer.flush()
+    assert inner.getvalue() == 'hello world!'
+
+def test_block_writer_flushes_for_direct_writes():
+    inner = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+    writer = cu.BlockWriter(inner)
+    writer.write('text ')
+    writer.buffer.write(b'bytes')
+    assert inner.buffer.getvalue() == b'text bytes'
+
+def test_block_writer_bad_type():
+    writer = cu.BlockWriter(io.StringIO())
+    with pytest.raises(TypeError):
+        writer.write(b'bytes')
+
+def test_thread_local_stream():
+    import threading
+    default = io.StringIO()
+    router = cu.ThreadLocalStream(default)
+    captured = io.StringIO()
+
+    def write_in_thread():
+        router.set_stream(captured)
+        router.write('from thread')
+        router.set_stream(None)
+        router.write(' after reset')
+
+    thread = threading.Thread(target=write_in_thread)
+    thread.start()
+    thread.join()
+    router.write('from main')
+
+    assert captured.getvalue() == 'from thread'
+    assert default.getvalue() == ' after resetfrom main'
+    assert router.current_stream is default
+    assert router.getvalue() == default.getvalue()
+
+def test_thread_stream():
+    default = io.StringIO()
+    captured = io.StringIO()
+    router = cu.ThreadLocalStream(default)
+    assert cu.thread_stream(default) is default
+    assert cu.thread_stream(router) is default
+    assert not router.routed
+
+    router.set_stream(captured)
+    assert cu.thread_stream(router) is captured
+    assert router.routed
+
+    # Setting the default stream is the same as resetting
+    router.set_stream(default)
+    assert not router.routed
+
+
+def test_open_output_file_plain():
+    fd, filename = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        with cu.open_output_file(filename) as f:
+            f.write('first\n')
+        with cu.open_output_file(filename, append=True) as f:
+            f.write('second\n')
+        with open(filename) as f:
+            assert f.read() == 'first\nsecond\n'
+    finally:
+        os.remove(filename)
+
+def test_open_output_file_gzip_flush():
+    import gzip
+    fd, filename = tempfile.mkstemp(suffix='.GZ')
+    os.close(fd)
+    try:
+        # Flushing after every line doesn't end a compressed block each time
+        with cu.open_output_file(filename) as f:
+            for i in range(1000):
+                f.write('the same line\n')
+                f.flush()
+        assert os.path.getsize(filename) < 1000
+        with gzip.open(filename, 'rt') as f:
+            assert f.read() == 'the same line\n' * 1000
+    finally:
+        os.remove(filename)
+
+@pytest.mark.parametrize('level', [-1, 10])
+def test_open_output_file_bad_level(level):
+    with pytest.raises(ValueError):
+        cu.open_output_file('never_created.gz', compress_level=level)
+    assert not os.path.exists('never_created.gz')
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="Pipe sizes can only be set on Linux")
+def test_set_pipe_size():
+    import fcntl
+    read_fd, write_fd = os.pipe()
+    try:
+        assert cu.set_pipe_size(write_fd, 128 * 1024)
+        # F_GETPIPE_SZ
+        assert fcntl.fcntl(read_fd, getattr(fcntl, 'F_GETPIPE_SZ', 1032)) == 128 * 1024
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+def test_set_pipe_size_not_pipe():
+    fd, filename = tempfile.mkstemp()
+    try:
+        assert not cu.set_pipe_size(fd, 128 * 1024)
+    finally:
+        os.close(fd)
+        os.remove(filename)